@@ -1,77 +1,1136 @@
+"""
+The computer player. Searches the game tree with an iterative deepening
+principal variation search in aspiration windows, made selective by null-move
+pruning, late-move reductions, futility pruning and razoring, each of which can
+be turned off. The leaves are extended with a quiescence search of captures
+and promotions and the quiet positions are evaluated by material and pawn
+structure, through caches of evaluations and of pawn structure scores.
+Captures are ordered and pruned by static exchange evaluation.
+"""
 
-import copy
+import array
+import concurrent.futures
+import json
+import math
+import random
+from timeit import default_timer as timer
 
+import board
+import cache
+import material
+import pawns
+import tablebase
+import tt
 
-def search(game):
-    moves = game.get_legal_moves()
-    depth = 3
+# Score of a checkmate. Mates found closer to the root score higher.
+MATE_SCORE = 1000
+INFINITY = 10000
 
-    move_num = 1
-    for move in moves:
-        start, end = move
-        x1, y1 = start
-        x2, y2 = end
-
-        # Check if move is an en passant capture
-        if game.en_passant is not None:
-            x3, y3 = game.en_passant
-            if (game.pos[y1][x1] == 'P' or game.pos[y1][x1] == 'p') and \
-                    x2 == x3 and y2 == y3:
-                ep = True
+# The deepest iteration attempted when no time limit stops the search
+MAX_DEPTH = 64
+
+# Tablebase wins score below every mate found by the search and above every
+# evaluation, less the distance to mate from the root. Scores at least
+# DECIDED_SCORE from zero are mates or tablebase wins, which are stored in the
+# transposition table relative to the position and are never pruned on
+TABLEBASE_WIN = MATE_SCORE - MAX_DEPTH - 1
+DECIDED_SCORE = TABLEBASE_WIN - MAX_DEPTH - tablebase.MAX_PLIES
+
+# Evaluations are rounded to hundredths of a pawn, so that no evaluation lies
+# strictly inside a null window
+EVALUATION_DIGITS = 2
+NULL_WINDOW = 0.01
+
+# Aspiration windows start this many pawns either side of the previous score
+# and double on each failure, up to the maximum before the full window is used
+ASPIRATION_WINDOW = 0.5
+MAX_ASPIRATION_WINDOW = 4
+
+# Null-move pruning searches the null move this many plies less deeply, at
+# nodes of at least the minimum depth
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+
+# Late-move reductions reduce quiet moves after the first few moves at nodes
+# of at least the minimum depth
+REDUCTION_MIN_MOVES = 3
+REDUCTION_MIN_DEPTH = 3
+
+# Margins in pawns by which the evaluation must trail alpha for futility
+# pruning at depth 1 and razoring at depths 1 and 2
+FUTILITY_MARGIN = 2
+RAZOR_DEPTH = 2
+RAZOR_MARGINS = [0, 3, 5]
+
+# The exploration constants of Monte Carlo tree search with the UCT and the
+# PUCT selection rules
+UCT_EXPLORATION = 1.4
+PUCT_EXPLORATION = 2.0
+
+# The number of playouts of a Monte Carlo tree search without a time limit
+DEFAULT_PLAYOUTS = 1000
+
+# With a pool of processes each task plays out a leaf this many times, and
+# this many tasks per process are kept running so that the pool never waits on
+# the selection of the next leaf
+PARALLEL_PLAYOUTS = 4
+TASKS_PER_WORKER = 2
+
+# Seconds between checks of the time limits while waiting for playouts
+PLAYOUT_POLL_INTERVAL = 0.01
+
+# Playouts stop after this many random moves and score the position reached by
+# its evaluation
+PLAYOUT_PLIES = 16
+
+# The material gain in pawns by static exchange evaluation that makes a move
+# e times more likely under the PUCT priors
+PRIOR_TEMPERATURE = 2
+
+# Pieces are always promoted to a queen inside the search
+PROMOTION = 'Q'
+
+# The value of each white piece in pawns, black pieces being valued the same
+PIECE_VALUES = {
+    'Q': 9,
+    'R': 5,
+    'N': 3,
+    'B': 3.15,
+    'P': 1
+}
+
+
+class SearchAborted(Exception):
+    """
+    Raised inside the search when the hard time limit has been reached.
+    """
+
+
+class Search:
+    def __init__(self, limits=None, table=None, tablebases=None,
+                 null_move=True, reductions=True, futility=True,
+                 evaluation_entries=cache.DEFAULT_EVALUATION_ENTRIES,
+                 pawn_entries=cache.DEFAULT_PAWN_ENTRIES):
+        """
+        Initialise the search.
+        :param limits: The clock.SearchLimits of the search, or None to search
+        without a time limit.
+        :param table: The tt.TranspositionTable to use, or None for a new
+        table.
+        :param tablebases: The tablebase.Tablebases to probe, or None.
+        :param null_move: True to use null-move pruning.
+        :param reductions: True to use late-move reductions.
+        :param futility: True to use futility pruning and razoring.
+        :param evaluation_entries: The number of entries in the cache of
+        evaluations.
+        :param pawn_entries: The number of entries in the cache of pawn
+        structure scores.
+        """
+        if table is None:
+            table = tt.TranspositionTable()
+        self.limits = limits
+        self.table = table
+        self.tablebases = tablebases
+        self.null_move = null_move
+        self.reductions = reductions
+        self.futility = futility
+        self.evaluation_cache = cache.Cache(evaluation_entries)
+        self.pawn_table = cache.Cache(pawn_entries)
+        self.nodes = 0
+        self.quiescence_nodes = 0
+        self.see_pruned = 0
+        self.null_move_cutoffs = 0
+        self.reduced_moves = 0
+        self.reduction_re_searches = 0
+        self.futility_pruned = 0
+        self.razored = 0
+        self.pvs_re_searches = 0
+        self.aspiration_re_searches = 0
+        self.depth = 0
+        self.best_move = None
+        self.score = 0
+        self.pv = []
+        self.pv_moves = {}
+
+    def iterate(self, game, max_depth=MAX_DEPTH, start_depth=1,
+                on_iteration=None):
+        """
+        Searches the position with iterative deepening until the maximum depth
+        or the time limits are reached. The result of the deepest completed
+        iteration is kept. After the first iteration each iteration searches a
+        window around the previous score, widening it and searching again
+        whenever the score falls outside it.
+        :param game: The position to search.
+        :param max_depth: The deepest iteration to search.
+        :param start_depth: The depth of the first iteration.
+        :param on_iteration: A function called with the depth, score and move
+        after each completed iteration, or None.
+        :return: A tuple (move, score) of the best move and its score from the
+        point of view of the player to move.
+        """
+        moves = order_moves(game, game.get_legal_moves())
+        if not moves:
+            return None, 0
+        self.best_move = moves[0]
+        self.pv = []
+        self.pv_moves = {}
+
+        previous = None
+        for depth in range(start_depth, max_depth + 1):
+            window = ASPIRATION_WINDOW
+            if previous is None or is_decided(previous):
+                alpha, beta = -INFINITY, INFINITY
+            else:
+                alpha, beta = previous - window, previous + window
+            try:
+                while True:
+                    score, move = self.search_root(game, moves, depth, alpha,
+                                                   beta)
+                    if alpha < score < beta:
+                        break
+                    self.aspiration_re_searches += 1
+                    window *= 2
+                    if score <= alpha:
+                        alpha = previous - window
+                    else:
+                        beta = previous + window
+                    if window > MAX_ASPIRATION_WINDOW:
+                        alpha, beta = -INFINITY, INFINITY
+            except SearchAborted:
+                break
+            previous = score
+            self.best_move = move
+            self.score = score
+            self.depth = depth
+            self.pv = self.get_pv(game, depth)
+            self.pv_moves = {}
+            node = game
+            for pv_move in self.pv:
+                self.pv_moves[node.hash] = pv_move
+                node = make_child(node, pv_move)
+            if on_iteration is not None:
+                on_iteration(depth, score, move)
+
+            # Search the best move first in the next iteration
+            moves.remove(move)
+            moves.insert(0, move)
+
+            # A forced mate or a tablebase win cannot be improved upon
+            if is_decided(score):
+                break
+            if self.limits is not None and self.limits.soft_stop():
+                break
+
+        return self.best_move, self.score
+
+    def search_root(self, game, moves, depth, alpha=-INFINITY,
+                    beta=INFINITY):
+        """
+        Searches each of the root moves to the given depth. The first move is
+        searched with the full window and the others with a null window, only
+        being searched again with the full window if they beat the best move.
+        :param game: The position to search.
+        :param moves: The legal moves of the position, best guess first.
+        :param depth: The depth to search to.
+        :param alpha: The lower bound of the search window.
+        :param beta: The upper bound of the search window.
+        :return: A tuple (score, move) of the best score and move. The score
+        is only a bound if it is outside the window, being at most alpha or at
+        least beta.
+        """
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = moves[0]
+        for index, move in enumerate(moves):
+            child = make_child(game, move)
+            if index == 0:
+                score = -self.negamax(child, depth - 1, -beta, -alpha, 1)
             else:
-                ep = False
+                score = -self.negamax(child, depth - 1, -alpha - NULL_WINDOW,
+                                      -alpha, 1)
+                if alpha < score < beta:
+                    self.pvs_re_searches += 1
+                    score = -self.negamax(child, depth - 1, -beta, -alpha, 1)
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score >= beta:
+                break
+            alpha = max(alpha, score)
+
+        if best_score >= beta:
+            bound = tt.LOWER_BOUND
+        elif best_score > original_alpha:
+            bound = tt.EXACT
         else:
-            ep = False
-
-        game_copy = copy.deepcopy(game)
-        game_copy.make_move(start, end, ep)
-        print('move: ', move_num)
-        game_copy.display(start, end)
-
-
-def minimax(node, depth, maximizingPlayer, moves):
-    if depth == 0 or node.is_end_of_game(moves):
-        return raw_material(node.pos)
-    if maximizingPlayer:
-        value = -500
-        for move in node.get_legal_moves():
-            start, end = move
-            x1, y1 = start
-            x2, y2 = end
-            # Check if move is an en passant capture
-            if node.en_passant is not None:
-                x3, y3 = node.en_passant
-                if (node.pos[y1][x1] == 'P' or node.pos[y1][x1] == 'p') and \
-                        x2 == x3 and y2 == y3:
-                    ep = True
-                else:
-                    ep = False
+            bound = tt.UPPER_BOUND
+        self.table.store(game.hash, best_score, depth, bound, best_move)
+        return best_score, best_move
+
+    def get_pv(self, game, depth):
+        """
+        Follows the best moves stored in the transposition table from the
+        position to get the principal variation.
+        :param game: The position.
+        :param depth: The greatest number of moves to follow.
+        :return: The list of moves of the principal variation.
+        """
+        pv = []
+        seen = set()
+        node = game
+        while len(pv) < depth and node.hash not in seen:
+            seen.add(node.hash)
+            entry = self.table.probe(node.hash)
+            if entry is None or entry[3] not in node.get_legal_moves():
+                break
+            pv.append(entry[3])
+            node = make_child(node, entry[3])
+        return pv
+
+    def get_statistics(self):
+        """
+        Gets the counts of the nodes searched, pruned and searched again.
+        :return: A dictionary of each count by name.
+        """
+        return {
+            'nodes': self.nodes,
+            'quiescence nodes': self.quiescence_nodes,
+            'see pruned': self.see_pruned,
+            'null move cutoffs': self.null_move_cutoffs,
+            'reduced moves': self.reduced_moves,
+            'reduction re-searches': self.reduction_re_searches,
+            'futility pruned': self.futility_pruned,
+            'razored': self.razored,
+            'pvs re-searches': self.pvs_re_searches,
+            'aspiration re-searches': self.aspiration_re_searches,
+            'evaluation cache hit rate':
+                self.evaluation_cache.get_hit_rate(),
+            'pawn table hit rate': self.pawn_table.get_hit_rate()
+        }
+
+    def visit(self, node, ply):
+        """
+        Counts a node, checks the time limits and scores the position if the
+        game is decided without searching it.
+        :param node: The position.
+        :param ply: The distance from the root.
+        :return: The score of the position from the point of view of the
+        player to move, or None if it has to be searched.
+        """
+        # Every node generates its legal moves, which takes longer than
+        # reading the clock, so the hard limit is checked at every node
+        self.nodes += 1
+        if self.limits is not None and self.limits.hard_stop():
+            raise SearchAborted
+
+        # Draws by rule or by repeating a position
+        if node.halfmove >= 100 or node.insufficient_material() or \
+                node.is_repetition():
+            return 0
+
+        # Endings with few pieces are looked up
+        if self.tablebases is not None and \
+                material.probe(node.material_key).pieces <= \
+                tablebase.MAX_PIECES:
+            entry = self.tablebases.probe(node)
+            if entry is not None:
+                result, plies = entry
+                if result == tablebase.WIN:
+                    return TABLEBASE_WIN - ply - plies
+                if result == tablebase.LOSS:
+                    return -TABLEBASE_WIN + ply + plies
+                return 0
+        return None
+
+    def quiescence(self, node, alpha, beta, ply):
+        """
+        Searches captures and promotions until the position is quiet, so that
+        positions are not evaluated in the middle of an exchange. The player to
+        move may stand pat on the evaluation instead of capturing, except when
+        in check, where every evasion is searched. Captures losing material by
+        static exchange evaluation are not searched.
+        :param node: The position to search.
+        :param alpha: The lower bound of the search window.
+        :param beta: The upper bound of the search window.
+        :param ply: The distance from the root.
+        :return: The score of the position from the point of view of the player
+        to move.
+        """
+        self.quiescence_nodes += 1
+        score = self.visit(node, ply)
+        if score is not None:
+            return score
+
+        # Checkmate and stalemate only need to know whether there is a legal
+        # move
+        state = node.status()
+        if state == board.CHECKMATE:
+            return -MATE_SCORE + ply
+        if state == board.STALEMATE:
+            return 0
+
+        if state == board.CHECK:
+            moves = order_moves(node, node.get_legal_moves())
+        else:
+            stand_pat = self.evaluate(node)
+            if stand_pat >= beta:
+                return stand_pat
+            alpha = max(alpha, stand_pat)
+
+            scored = []
+            for move in node.get_legal_moves():
+                if is_noisy(node, move):
+                    gain = node.see(move)
+                    if gain < 0:
+                        self.see_pruned += 1
+                    else:
+                        scored.append((gain, move))
+            scored.sort(key=lambda item: item[0], reverse=True)
+            moves = [move for gain, move in scored]
+
+        for move in moves:
+            score = -self.quiescence(make_child(node, move), -beta, -alpha,
+                                     ply + 1)
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def evaluate(self, node):
+        """
+        Evaluates a position, looking it up in the cache of evaluations first.
+        :param node: The position to evaluate.
+        :return: The evaluation of the position from the point of view of the
+        player to move.
+        """
+        evaluation = self.evaluation_cache.probe(node.hash)
+        if evaluation is None:
+            evaluation = evaluate(node, self.pawn_table)
+            self.evaluation_cache.store(node.hash, evaluation)
+        return evaluation
+
+    def negamax(self, node, depth, alpha, beta, ply, allow_null=True):
+        """
+        Alpha-beta search of a position in negamax form.
+        :param node: The position to search.
+        :param depth: The remaining depth to search.
+        :param alpha: The lower bound of the search window.
+        :param beta: The upper bound of the search window.
+        :param ply: The distance from the root.
+        :param allow_null: False if the move into the position was a null move,
+        so that two are never made in a row.
+        :return: The score of the position from the point of view of the player
+        to move.
+        """
+        if depth <= 0:
+            return self.quiescence(node, alpha, beta, ply)
+
+        score = self.visit(node, ply)
+        if score is not None:
+            return score
+
+        moves = node.get_legal_moves()
+        in_check = node.in_check()
+        if not moves:
+            if in_check:
+                return -MATE_SCORE + ply
+            return 0
+        moves = order_moves(node, moves)
+
+        # Use the stored result if it was searched deep enough, otherwise try
+        # its best move first, or else the move of the principal variation of
+        # the previous iteration
+        entry = self.table.probe(node.hash)
+        first_move = self.pv_moves.get(node.hash)
+        if entry is not None:
+            score, entry_depth, bound, entry_move = entry
+            score = score_from_table(score, ply)
+            if entry_depth >= depth and (
+                    bound == tt.EXACT or
+                    (bound == tt.LOWER_BOUND and score >= beta) or
+                    (bound == tt.UPPER_BOUND and score <= alpha)):
+                return score
+            if entry_move is not None:
+                first_move = entry_move
+        if first_move in moves:
+            moves.remove(first_move)
+            moves.insert(0, first_move)
+
+        # Pruning is only sound out of check and with bounds that are not
+        # mate scores or tablebase wins
+        if in_check:
+            static = 0
+        else:
+            static = self.evaluate(node)
+        prune_high = not in_check and not is_decided(beta)
+        prune_low = not in_check and not is_decided(alpha)
+
+        # Null move: if passing the turn still holds beta, a real move will
+        # too. Unsound in zugzwang, so only tried while the player to move has
+        # pieces besides pawns
+        if self.null_move and prune_high and allow_null and \
+                depth >= NULL_MOVE_MIN_DEPTH and static >= beta and \
+                has_pieces(node):
+            child = node.copy()
+            child.make_null_move()
+            score = -self.negamax(child, depth - 1 - NULL_MOVE_REDUCTION,
+                                  -beta, -beta + NULL_WINDOW, ply + 1, False)
+            if score >= beta:
+                self.null_move_cutoffs += 1
+                return beta
+
+        # Razoring: far below alpha near the leaves, only captures can recover
+        if self.futility and prune_low and depth <= RAZOR_DEPTH and \
+                static + RAZOR_MARGINS[depth] <= alpha:
+            score = self.quiescence(node, alpha, alpha + NULL_WINDOW, ply)
+            if score <= alpha:
+                self.razored += 1
+                return score
+
+        # Futility: at the frontier, quiet moves cannot raise a position this
+        # far below alpha
+        futile = self.futility and prune_low and depth == 1 and \
+            static + FUTILITY_MARGIN <= alpha
+
+        original_alpha = alpha
+        best_move = None
+        for index, move in enumerate(moves):
+            quiet = index > 0 and not is_noisy(node, move)
+            child = make_child(node, move)
+
+            # Futile quiet moves are skipped unless they give check, which
+            # could be mate. The first move is always searched
+            if futile and quiet and not child.in_check():
+                self.futility_pruned += 1
+                continue
+
+            # Later moves are expected to be worse than the first, so they are
+            # searched with a null window and searched again with the full
+            # window only if they beat alpha. Late quiet moves that do not give
+            # check are also searched less deeply at first
+            if index == 0:
+                score = -self.negamax(child, depth - 1, -beta, -alpha, ply + 1)
             else:
-                ep = False
-            child_node = copy.deepcopy(node)
-            child_node.make_move(start, end, ep)
-            value = max(value, minimax(child_node, depth - 1, False, moves))
-            return value
-    else:
-        value = 500
-        for move in node.get_legal_moves():
-            start, end = move
-            x1, y1 = start
-            x2, y2 = end
-            # Check if move is an en passant capture
-            if node.en_passant is not None:
-                x3, y3 = node.en_passant
-                if (node.pos[y1][x1] == 'P' or node.pos[y1][x1] == 'p') and \
-                        x2 == x3 and y2 == y3:
-                    ep = True
+                reduction = 0
+                if self.reductions and quiet and \
+                        depth >= REDUCTION_MIN_DEPTH and \
+                        index >= REDUCTION_MIN_MOVES and not child.in_check():
+                    reduction = 1
+                    if depth >= 6 and index >= 2 * REDUCTION_MIN_MOVES:
+                        reduction = 2
+                    self.reduced_moves += 1
+                score = -self.negamax(child, depth - 1 - reduction,
+                                      -alpha - NULL_WINDOW, -alpha, ply + 1)
+                if reduction and score > alpha:
+                    self.reduction_re_searches += 1
+                    score = -self.negamax(child, depth - 1,
+                                          -alpha - NULL_WINDOW, -alpha,
+                                          ply + 1)
+                if alpha < score < beta:
+                    self.pvs_re_searches += 1
+                    score = -self.negamax(child, depth - 1, -beta, -alpha,
+                                          ply + 1)
+
+            if score >= beta:
+                self.table.store(node.hash, score_to_table(score, ply), depth,
+                                 tt.LOWER_BOUND, move)
+                return score
+            if score > alpha:
+                alpha = score
+                best_move = move
+
+        if alpha > original_alpha:
+            bound = tt.EXACT
+        else:
+            bound = tt.UPPER_BOUND
+        self.table.store(node.hash, score_to_table(alpha, ply), depth, bound,
+                         best_move)
+        return alpha
+
+
+def search(game, limits=None, max_depth=MAX_DEPTH, tablebases=None):
+    """
+    Finds the best move in the position.
+    :param game: The position to search.
+    :param limits: The clock.SearchLimits of the search, or None to search
+    without a time limit.
+    :param max_depth: The deepest iteration to search.
+    :param tablebases: The tablebase.Tablebases to probe, or None.
+    :return: The best move found in the form ((start_x, start_y), (end_x,
+    end_y)), or None if there are no legal moves.
+    """
+    move, score = Search(limits, tablebases=tablebases).iterate(game,
+                                                                max_depth)
+    return move
+
+
+class NodeArena:
+    def __init__(self):
+        """
+        Initialise an empty arena. The nodes of a Monte Carlo search tree are
+        numbered and their fields are held in parallel arrays indexed by node
+        number rather than as an object per node. The children of a node are
+        numbered consecutively from first_children.
+        """
+        self.parents = array.array('i')
+        self.moves = array.array('H')
+        self.priors = array.array('d')
+        self.first_children = array.array('i')
+        self.child_counts = array.array('H')
+        self.visits = array.array('I')
+        self.values = array.array('d')
+
+    def __len__(self):
+        return len(self.parents)
+
+    def add(self, parent, move, prior):
+        """
+        Adds a node without children or statistics.
+        :param parent: The number of the parent node, or -1 for the root.
+        :param move: The move into the node packed by board.encode_move.
+        :param prior: The prior probability of the move.
+        :return: The number of the new node.
+        """
+        self.parents.append(parent)
+        self.moves.append(move)
+        self.priors.append(prior)
+        self.first_children.append(0)
+        self.child_counts.append(0)
+        self.visits.append(0)
+        self.values.append(0.0)
+        return len(self.parents) - 1
+
+    def expand(self, index, moves, priors):
+        """
+        Adds the children of a node.
+        :param index: The number of the node.
+        :param moves: The legal moves of the node.
+        :param priors: The prior probability of each move.
+        :return: Nothing.
+        """
+        self.first_children[index] = len(self.parents)
+        self.child_counts[index] = len(moves)
+        for move, prior in zip(moves, priors):
+            self.add(index, board.encode_move(move), prior)
+
+
+class MonteCarloSearch:
+    def __init__(self, limits=None, puct=False, exploration=None,
+                 executor=None, batch=1, tasks=1, seed=None,
+                 playout_plies=PLAYOUT_PLIES):
+        """
+        Initialise the search.
+        :param limits: The clock.SearchLimits of the search, or None to search
+        for a fixed number of playouts.
+        :param puct: True to select moves by PUCT with priors from static
+        exchange evaluation, false to select them by UCT.
+        :param exploration: The exploration constant, or None for the default
+        of the selection rule.
+        :param executor: A concurrent.futures.ProcessPoolExecutor to run the
+        playouts in, or None to run them in this process.
+        :param batch: The number of playouts run from each new leaf.
+        :param tasks: The number of leaves played out in the pool at once.
+        :param seed: The seed of the random playouts, or None.
+        :param playout_plies: The number of random moves of each playout.
+        """
+        if exploration is None:
+            exploration = PUCT_EXPLORATION if puct else UCT_EXPLORATION
+        self.limits = limits
+        self.puct = puct
+        self.exploration = exploration
+        self.executor = executor
+        self.batch = batch
+        self.tasks = tasks
+        self.rng = random.Random(seed)
+        self.playout_plies = playout_plies
+        self.arena = NodeArena()
+        self.playouts = 0
+        self.seconds = 0.0
+
+    def run(self, game, playouts=None):
+        """
+        Grows the search tree of the position until the number of playouts or
+        the time limits are reached.
+        :param game: The position to search.
+        :param playouts: The number of playouts, or None to search until the
+        time limits are reached, or for DEFAULT_PLAYOUTS without limits.
+        :return: A tuple (move, score) of the most visited move and its
+        expected score between 0 and 1 for the player to move, or (None, 0.5)
+        if there are no legal moves.
+        """
+        if playouts is None and self.limits is None:
+            playouts = DEFAULT_PLAYOUTS
+        moves = game.get_legal_moves()
+        if not moves:
+            return None, 0.5
+
+        # The root is expanded whatever its state, as it may be a repetition
+        arena = NodeArena()
+        arena.add(-1, 0, 1.0)
+        arena.expand(0, moves, self.get_priors(game, moves))
+        self.arena = arena
+        self.playouts = 0
+        begin = timer()
+
+        if self.executor is None:
+            while playouts is None or self.playouts < playouts:
+                if self.out_of_time():
+                    break
+                self.step(game)
+        else:
+            self.run_parallel(game, playouts)
+        self.seconds = timer() - begin
+
+        first = arena.first_children[0]
+        children = range(first, first + arena.child_counts[0])
+        best = max(children, key=lambda child: arena.visits[child])
+        score = 0.5
+        if arena.visits[best]:
+            score = arena.values[best] / arena.visits[best]
+        return board.decode_move(arena.moves[best]), score
+
+    def run_parallel(self, game, playouts):
+        """
+        Grows the search tree with the playouts run in the pool of processes.
+        Several leaves are played out at once. Until their results arrive the
+        visits of their playouts count as losses, a virtual loss that steers
+        the next selections towards other leaves.
+        :param game: The root position.
+        :param playouts: The number of playouts, or None for no limit.
+        :return: Nothing.
+        """
+        count = self.batch
+        pending = {}
+        started = 0
+        while not self.out_of_time():
+            # Keep the pool busy, finishing leaves where the game is over at
+            # once
+            while len(pending) < self.tasks and \
+                    (playouts is None or started < playouts) and \
+                    not self.out_of_time():
+                index, node = self.descend(game)
+                self.add_visits(index, count)
+                started += count
+                value = self.expand(index, node)
+                if value is not None:
+                    self.add_value(index, value * count, count)
+                    self.playouts += count
+                    continue
+                future = self.executor.submit(run_playouts, node,
+                                              self.rng.getrandbits(32), count,
+                                              self.playout_plies)
+                pending[future] = index
+            if not pending:
+                break
+
+            done, running = concurrent.futures.wait(
+                pending, PLAYOUT_POLL_INTERVAL,
+                concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                self.add_value(pending.pop(future), future.result(), count)
+                self.playouts += count
+
+        # Playouts still running when the time is up are abandoned
+        for future, index in pending.items():
+            future.cancel()
+            self.add_visits(index, -count)
+
+    def step(self, game):
+        """
+        Runs one iteration: selects a leaf, expands it, plays out from it and
+        backs up the result.
+        :param game: The root position.
+        :return: Nothing.
+        """
+        index, node = self.descend(game)
+        count = self.batch
+        value = self.expand(index, node)
+        if value is not None:
+            value *= count
+        else:
+            value = sum(playout(node, self.rng, self.playout_plies)
+                        for i in range(count))
+        self.add_visits(index, count)
+        self.add_value(index, value, count)
+        self.playouts += count
+
+    def out_of_time(self):
+        """
+        Checks whether the search should stop, which it never does before the
+        first playout.
+        :return: True if a time limit has been reached, false otherwise.
+        """
+        return self.limits is not None and self.playouts > 0 and (
+            self.limits.soft_stop() or self.limits.hard_stop())
+
+    def descend(self, game):
+        """
+        Selects a leaf of the search tree, descending from the root.
+        :param game: The root position.
+        :return: A tuple (index, node) of the number of the leaf and its
+        position.
+        """
+        arena = self.arena
+        index = 0
+        node = game
+        while arena.child_counts[index]:
+            index = self.select(index)
+            node = make_child(node, board.decode_move(arena.moves[index]))
+        return index, node
+
+    def expand(self, index, node):
+        """
+        Adds the children of a leaf unless the game is over there.
+        :param index: The number of the leaf.
+        :param node: The position of the leaf.
+        :return: The score between 0 and 1 for the player to move if the game
+        is over, or None if the leaf was expanded.
+        """
+        value = get_terminal_value(node)
+        if value is None:
+            moves = node.get_legal_moves()
+            self.arena.expand(index, moves, self.get_priors(node, moves))
+        return value
+
+    def add_visits(self, index, count):
+        """
+        Adds visits to a node and its ancestors.
+        :param index: The number of the node.
+        :param count: The number of visits, negative to take them away.
+        :return: Nothing.
+        """
+        arena = self.arena
+        while index >= 0:
+            arena.visits[index] += count
+            index = arena.parents[index]
+
+    def add_value(self, index, value, count):
+        """
+        Backs up the total score of playouts to a node and its ancestors,
+        whose visits have already been added.
+        :param index: The number of the node.
+        :param value: The total score of the playouts for the player to move
+        at the node.
+        :param count: The number of playouts.
+        :return: Nothing.
+        """
+        # Each node holds the total score of the player who moved into it
+        arena = self.arena
+        while index >= 0:
+            value = count - value
+            arena.values[index] += value
+            index = arena.parents[index]
+
+    def select(self, index):
+        """
+        Selects the child of a node to descend to.
+        :param index: The number of the node.
+        :return: The number of the child.
+        """
+        arena = self.arena
+        first = arena.first_children[index]
+        visits = arena.visits[index]
+        if self.puct:
+            scale = self.exploration * math.sqrt(visits)
+        else:
+            scale = self.exploration * math.sqrt(math.log(max(visits, 1)))
+
+        best = first
+        best_score = -INFINITY
+        for child in range(first, first + arena.child_counts[index]):
+            child_visits = arena.visits[child]
+            if self.puct:
+                if child_visits:
+                    mean = arena.values[child] / child_visits
                 else:
-                    ep = False
+                    mean = 0.5
+                score = mean + scale * arena.priors[child] / (1 + child_visits)
+            elif child_visits:
+                score = arena.values[child] / child_visits + \
+                    scale / math.sqrt(child_visits)
             else:
-                ep = False
+                # Unvisited children are tried first
+                return child
+            if score > best_score:
+                best_score = score
+                best = child
+        return best
+
+    def get_priors(self, node, moves):
+        """
+        Gets the prior probabilities of the moves of a position. Under PUCT
+        moves winning material by static exchange evaluation are more likely
+        and moves losing it less likely, under UCT every move is equally
+        likely.
+        :param node: The position.
+        :param moves: The legal moves of the position.
+        :return: The list of the prior of each move.
+        """
+        if not self.puct:
+            return [1 / len(moves)] * len(moves)
+        weights = []
+        for move in moves:
+            gain = node.see(move) if is_noisy(node, move) else 0
+            weights.append(math.exp(gain / PRIOR_TEMPERATURE))
+        total = sum(weights)
+        return [weight / total for weight in weights]
+
+    def get_statistics(self):
+        """
+        Gets the counts of the playouts and nodes of the last search.
+        :return: A dictionary of each count by name.
+        """
+        if self.seconds:
+            rate = self.playouts / self.seconds
+        else:
+            rate = 0.0
+        return {
+            'playouts': self.playouts,
+            'nodes': len(self.arena),
+            'seconds': self.seconds,
+            'playouts per second': rate
+        }
+
+
+def monte_carlo_search(game, limits=None, playouts=None, executor=None,
+                       workers=1, puct=False):
+    """
+    Finds the best move in the position by Monte Carlo tree search.
+    :param game: The position to search.
+    :param limits: The clock.SearchLimits of the search, or None to search
+    for a fixed number of playouts.
+    :param playouts: The number of playouts, or None to search until the time
+    limits are reached, or for DEFAULT_PLAYOUTS without limits.
+    :param executor: A concurrent.futures.ProcessPoolExecutor kept for the
+    whole game to run the playouts in, or None to run them in this process.
+    Each task plays out a leaf PARALLEL_PLAYOUTS times.
+    :param workers: The number of processes of the executor.
+    :param puct: True to select moves by PUCT rather than UCT.
+    :return: The best move found in the form ((start_x, start_y), (end_x,
+    end_y)), or None if there are no legal moves.
+    """
+    if executor is None:
+        search = MonteCarloSearch(limits, puct)
+    else:
+        search = MonteCarloSearch(limits, puct, executor=executor,
+                                  batch=PARALLEL_PLAYOUTS,
+                                  tasks=TASKS_PER_WORKER * workers)
+    return search.run(game, playouts)[0]
+
+
+def get_terminal_value(node):
+    """
+    Scores a position of the Monte Carlo search tree if the game is over.
+    Positions are drawn on their first repetition, as in the alpha-beta
+    search.
+    :param node: The position.
+    :return: The score between 0 and 1 for the player to move, or None if
+    the game is not over.
+    """
+    if node.halfmove >= 100 or node.insufficient_material() or \
+            node.is_repetition():
+        return 0.5
+    state = node.status()
+    if state == board.CHECKMATE:
+        return 0.0
+    if state == board.STALEMATE:
+        return 0.5
+    return None
+
+
+def get_expected_score(evaluation):
+    """
+    Maps an evaluation to an expected score, as tune.sigmoid does with a
+    scaling constant of 1.
+    :param evaluation: The evaluation in pawns.
+    :return: The expected score between 0 and 1.
+    """
+    return 1 / (1 + 10 ** (-evaluation / 4))
+
+
+def playout(game, rng, max_plies=PLAYOUT_PLIES):
+    """
+    Plays random moves from a position until the game ends or the number of
+    moves is reached, when the position is scored by its evaluation. Moves are
+    made without building FEN strings, and without any display or PGN work.
+    :param game: The position to play out, which is left unchanged.
+    :param rng: The random.Random to choose the moves with.
+    :param max_plies: The greatest number of moves to play.
+    :return: The score between 0 and 1 for the player to move in the position.
+    """
+    node = game.copy()
+    for ply in range(max_plies):
+        if node.halfmove >= 100 or node.insufficient_material() or \
+                node.count_repetitions(2) == 2:
+            return 0.5
+        moves = node.get_legal_moves()
+        if not moves:
+            if not node.in_check():
+                return 0.5
+            score = 0.0
+            break
+        start, end = rng.choice(moves)
+        node.make_move(start, end, node.is_en_passant(start, end), PROMOTION,
+                       update_fen=False)
+    else:
+        score = get_expected_score(evaluate(node))
+
+    if node.turn != game.turn:
+        return 1 - score
+    return score
+
+
+def run_playouts(game, seed, count, max_plies=PLAYOUT_PLIES):
+    """
+    Plays out a position several times in a worker process.
+    :param game: The position, with the hashes of the earlier positions that
+    can repeat.
+    :param seed: The seed of the random moves.
+    :param count: The number of playouts.
+    :param max_plies: The greatest number of moves of each playout.
+    :return: The total score of the playouts for the player to move.
+    """
+    rng = random.Random(seed)
+    return sum(playout(game, rng, max_plies) for i in range(count))
+
+
+def score_to_table(score, ply):
+    """
+    Converts a score to be stored in the transposition table. Mate scores and
+    tablebase wins are stored as the distance to mate from the position rather
+    than from the root.
+    :param score: The score relative to the root.
+    :param ply: The distance of the position from the root.
+    :return: The score relative to the position.
+    """
+    if score >= DECIDED_SCORE:
+        return score + ply
+    if score <= -DECIDED_SCORE:
+        return score - ply
+    return score
 
-            value = max(value, minimax(copy.deepcopy(node).make_move(start, end, ep),
-                                       depth - 1, True, moves))
-            return value
+
+def score_from_table(score, ply):
+    """
+    Converts a score read from the transposition table back to a score
+    relative to the root.
+    :param score: The score relative to the position.
+    :param ply: The distance of the position from the root.
+    :return: The score relative to the root.
+    """
+    if score >= DECIDED_SCORE:
+        return score - ply
+    if score <= -DECIDED_SCORE:
+        return score + ply
+    return score
+
+
+def is_decided(score):
+    """
+    Checks whether a score is a mate or a tablebase result rather than an
+    evaluation.
+    :param score: The score.
+    :return: True if the score is a mate or a tablebase win or loss, false
+    otherwise.
+    """
+    return abs(score) >= DECIDED_SCORE
+
+
+def has_pieces(node):
+    """
+    Checks whether the player to move has pieces besides the king and pawns.
+    Without them zugzwang is common and null-move pruning is unsound.
+    :param node: The position.
+    :return: True if the player has a piece, false otherwise.
+    """
+    if node.turn:
+        names = ('Q', 'R', 'lB', 'dB', 'N')
+    else:
+        names = ('q', 'r', 'lb', 'db', 'n')
+    for name in names:
+        if node.piece_count[name]:
+            return True
+    return False
+
+
+def is_noisy(node, move):
+    """
+    Checks whether a move is a capture or a promotion.
+    :param node: The position the move is made from.
+    :param move: The move.
+    :return: True if the move is a capture or a promotion, false otherwise.
+    """
+    (x, y), (x_new, y_new) = move
+    if node.pos[y_new][x_new] != ' ' or node.is_en_passant((x, y),
+                                                           (x_new, y_new)):
+        return True
+    return node.pos[y][x] in ('P', 'p') and y_new in (0, 7)
+
+
+def order_moves(node, moves):
+    """
+    Orders moves for the search: captures and promotions that do not lose
+    material by static exchange evaluation first, best first, then the quiet
+    moves, then the captures that lose material.
+    :param node: The position the moves are made from.
+    :param moves: The legal moves.
+    :return: The ordered list of moves.
+    """
+    good = []
+    quiet = []
+    bad = []
+    for move in moves:
+        if not is_noisy(node, move):
+            quiet.append(move)
+            continue
+        gain = node.see(move)
+        if gain >= 0:
+            good.append((gain, move))
+        else:
+            bad.append((gain, move))
+    good.sort(key=lambda item: item[0], reverse=True)
+    bad.sort(key=lambda item: item[0], reverse=True)
+    return [move for gain, move in good] + quiet + [move for gain, move in bad]
+
+
+def make_child(node, move):
+    """
+    Makes a move on a copy of the position.
+    :param node: The position to make the move from.
+    :param move: The move to make.
+    :return: The position after the move.
+    """
+    start, end = move
+    child = node.copy()
+    child.make_move(start, end, node.is_en_passant(start, end), PROMOTION)
+    return child
+
+
+def evaluate(node, pawn_table=None):
+    """
+    Evaluates a position from the point of view of the player to move.
+    :param node: The position to evaluate.
+    :param pawn_table: The cache.Cache of pawn structure scores keyed by the
+    pawn hash, or None.
+    :return: The evaluation of the position.
+    """
+    structure = None
+    if pawn_table is not None:
+        structure = pawn_table.probe(node.pawn_hash)
+    if structure is None:
+        structure = pawns.evaluate_structure(node.pos)
+        if pawn_table is not None:
+            pawn_table.store(node.pawn_hash, structure)
+
+    evaluation = evaluate_pos(node.pos) + \
+        material.probe(node.material_key).imbalance + structure.score
+
+    # Rounded so that floating point error does not put equal evaluations
+    # either side of a null window
+    evaluation = round(evaluation, EVALUATION_DIGITS)
+    if node.turn:
+        return evaluation
+    return -evaluation
 
 
 def raw_material(pos):
@@ -84,30 +1143,28 @@ def raw_material(pos):
     material_value = 0
     for rank in pos:
         for item in rank:
-            if item == 'Q':
-                material_value += 9
-            elif item == 'q':
-                material_value -= 9
-            elif item == 'R':
-                material_value += 5
-            elif item == 'r':
-                material_value -= 5
-            elif item == 'N':
-                material_value += 3
-            elif item == 'n':
-                material_value -= 3
-            elif item == 'B':
-                material_value += 3.15
-            elif item == 'b':
-                material_value -= 3.15
-            elif item == 'P':
-                material_value += 1
-            elif item == 'p':
-                material_value -= 1
+            if item in PIECE_VALUES:
+                material_value += PIECE_VALUES[item]
+            elif item.upper() in PIECE_VALUES:
+                material_value -= PIECE_VALUES[item.upper()]
 
     return material_value
 
 
+def load_weights(path):
+    """
+    Loads piece values exported by tune.py in place of the defaults.
+    :param path: The path of the JSON file of the piece values.
+    :return: Nothing.
+    """
+    with open(path) as weights_file:
+        weights = json.load(weights_file)
+    for piece, value in weights.items():
+        if piece not in PIECE_VALUES:
+            raise ValueError("Unknown piece: " + piece)
+        PIECE_VALUES[piece] = value
+
+
 def evaluate_pos(pos):
     """
     Gives a rough estimate of the value of the board position. Has human
@@ -120,6 +1177,3 @@ def evaluate_pos(pos):
     evaluation += raw_material(pos)
 
     return evaluation
-
-
-
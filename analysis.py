@@ -0,0 +1,98 @@
+"""
+Multi-PV analysis. Scores every legal move of a position rather than just the
+best one by splitting the root moves across a pool of processes, each of which
+searches its moves to a fixed depth.
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+from timeit import default_timer as timer
+
+import ai
+import board
+import error
+import fen
+
+
+def analyse_move(fen_string, move, depth):
+    """
+    Searches a single root move. The position after the move is searched with
+    iterative deepening so that the final iteration has a filled transposition
+    table to order its moves with.
+    :param fen_string: The FEN string of the root position.
+    :param move: The root move to search.
+    :param depth: The depth to search to, including the root move.
+    :return: A tuple (move, score, nodes, seconds) of the move, its score from
+    the point of view of the player to move at the root, the number of nodes
+    searched and the time taken.
+    """
+    begin = timer()
+    game = board.Position(fen_string, 'c', 'c')
+    child = ai.make_child(game, move)
+    search = ai.Search()
+
+    score = 0
+    for child_depth in range(max(depth - 1, 0) + 1):
+        score = -search.negamax(child, child_depth, -ai.INFINITY, ai.INFINITY,
+                                1)
+
+    return move, score, search.nodes, timer() - begin
+
+
+def analyse(game, depth, processes=None):
+    """
+    Scores every legal move of the position.
+    :param game: The position to analyse.
+    :param depth: The depth to search each move to, including the move itself.
+    :param processes: The number of processes to use, or None for one per
+    core.
+    :return: A list of tuples (move, score, nodes, seconds) as returned by
+    analyse_move, sorted from the best to the worst move for the player to
+    move.
+    """
+    moves = game.get_legal_moves()
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        results = list(executor.map(analyse_move,
+                                    itertools.repeat(game.current_fen), moves,
+                                    itertools.repeat(depth)))
+
+    results.sort(key=lambda result: result[1], reverse=True)
+    return results
+
+
+def move_to_string(move):
+    """
+    Gets the coordinate notation of a move, e.g. e2e4.
+    :param move: The move in the form ((start_x, start_y), (end_x, end_y)).
+    :return: The move as a string.
+    """
+    (x1, y1), (x2, y2) = move
+    return ''.join((board.inv_files[x1], board.inv_ranks[y1],
+                    board.inv_files[x2], board.inv_ranks[y2]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scores every legal move of "
+                                                 "a position")
+    parser.add_argument("fen", help="The FEN string of the position.")
+    parser.add_argument("depth", type=error.positive_int,
+                        help="The depth to search each move to.")
+    parser.add_argument("--processes", type=error.positive_int, default=None,
+                        help="The number of processes to use.")
+    args = parser.parse_args()
+
+    error_code = fen.check_fen(args.fen, 'c', 'c')
+    if error_code:
+        error.exit_game(error_code)
+
+    begin = timer()
+    results = analyse(board.Position(args.fen, 'c', 'c'), args.depth,
+                      args.processes)
+    for move, score, nodes, seconds in results:
+        print(move_to_string(move), round(score, 2), nodes, round(seconds, 3))
+    print("\nTime taken: ", timer() - begin)
+
+
+if __name__ == "__main__":
+    main()
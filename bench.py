@@ -0,0 +1,353 @@
+"""
+Microbenchmarks of the hot paths of board, fen, pgn and ai. Each benchmark
+runs a function over every position of a fixed position set, is warmed up,
+then timed over several repetitions. The results can be written as JSON and
+compared against an earlier run to catch performance regressions.
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+from timeit import default_timer as timer
+
+import ai
+import board
+import error
+import fen
+import pgn
+
+# Fixed position sets as lists of FEN strings
+POSITION_SETS = {
+    'opening': [
+        board.standard_start,
+        'rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2',
+        'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4'
+    ],
+    'middlegame': [
+        'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - '
+        '0 10'
+    ],
+    'endgame': [
+        '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+        '8/8/4k3/8/2R5/8/3PK3/8 w - - 0 50',
+        '8/5pk1/6p1/8/3N4/8/5PPP/6K1 b - - 0 40'
+    ],
+    'promotion': [
+        'n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1',
+        'n1n5/PPPk4/8/8/8/8/4Kppp/5N1N w - - 0 1',
+        '4k3/1P6/8/8/8/8/6p1/4K3 w - - 0 60',
+        '5k2/PPP5/8/8/8/8/5ppp/1K6 w - - 0 30'
+    ],
+    'en_passant': [
+        'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3',
+        'rnbqkbnr/pp1ppppp/8/8/2pPP3/8/PPP2PPP/RNBQKBNR b KQkq d3 0 3',
+        'rnbqkbnr/ppp2ppp/8/3pP3/8/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 3',
+        '8/8/8/1pPpP3/8/8/8/K6k w - b6 0 2',
+        '4k3/8/8/8/3pPp2/8/8/4K3 b - e3 0 1'
+    ]
+}
+
+DEFAULT_WARMUP = 2
+DEFAULT_REPEAT = 10
+
+# A benchmark is reported as a regression when its median time grows by more
+# than this fraction compared to an earlier run
+REGRESSION_THRESHOLD = 0.1
+
+
+def bench_get_legal_moves(games):
+    """
+    Generates the legal moves of each position.
+    :param games: The positions to generate the moves of.
+    :return: The number of positions.
+    """
+    for game in games:
+        game.get_legal_moves()
+    return len(games)
+
+
+def bench_is_attacked(games):
+    """
+    Checks whether each square of each position is attacked.
+    :param games: The positions whose squares are checked.
+    :return: The number of squares checked.
+    """
+    for game in games:
+        for y in range(8):
+            for x in range(8):
+                game.is_attacked((x, y))
+    return 64 * len(games)
+
+
+def bench_get_attack_map(games):
+    """
+    Builds the attack map of each position from scratch.
+    :param games: The positions whose attack maps are built. Their cached maps
+    are cleared first.
+    :return: The number of positions.
+    """
+    for game in games:
+        game.attack_map = None
+        game.get_attack_map()
+    return len(games)
+
+
+def bench_make_move(games):
+    """
+    Makes each legal move of each position on a copy of the position.
+    :param games: The positions to move from, each with its legal moves stored
+    in a moves attribute.
+    :return: The number of moves made.
+    """
+    calls = 0
+    for game in games:
+        for start, end in game.moves:
+            child = game.copy()
+            child.make_move(start, end, game.is_en_passant(start, end), 'Q')
+            calls += 1
+    return calls
+
+
+def bench_get_position(games):
+    """
+    Parses the board of the FEN string of each position.
+    :param games: The positions whose FEN strings are parsed.
+    :return: The number of positions.
+    """
+    for game in games:
+        fen.get_position(game.current_fen, {
+            'K': 0, 'Q': 0, 'R': 0, 'dB': 0, 'lB': 0, 'N': 0, 'P': 0, 'k': 0,
+            'q': 0, 'r': 0, 'db': 0, 'lb': 0, 'n': 0, 'p': 0
+        })
+    return len(games)
+
+
+def bench_get_fen(games):
+    """
+    Builds the FEN string of each position.
+    :param games: The positions to build the FEN strings of.
+    :return: The number of positions.
+    """
+    for game in games:
+        fen.get_fen(game.pos, game.turn, game.castling, game.en_passant,
+                    game.halfmove, game.fullmove)
+    return len(games)
+
+
+def bench_check_fen(games):
+    """
+    Validates the FEN string of each position.
+    :param games: The positions whose FEN strings are validated.
+    :return: The number of positions.
+    """
+    for game in games:
+        fen.check_fen(game.current_fen, 'c', 'c')
+    return len(games)
+
+
+def bench_update_pgn(games):
+    """
+    Writes the PGN of each legal move of each position.
+    :param games: The positions to write the moves of, each with its legal
+    moves stored in a moves attribute. Their PGN is overwritten.
+    :return: The number of moves written.
+    """
+    calls = 0
+    for game in games:
+        for start, end in game.moves:
+            game.pgn = ''
+            pgn.update_pgn(game, start, end)
+            calls += 1
+    return calls
+
+
+def bench_raw_material(games):
+    """
+    Counts the material of each position.
+    :param games: The positions to count the material of.
+    :return: The number of positions.
+    """
+    for game in games:
+        ai.raw_material(game.pos)
+    return len(games)
+
+
+def bench_playout(games):
+    """
+    Plays a random playout from each position with a fixed seed.
+    :param games: The positions to play out, which are left unchanged.
+    :return: The number of playouts.
+    """
+    rng = random.Random(0)
+    for game in games:
+        ai.playout(game, rng)
+    return len(games)
+
+
+# The benchmarks as name: function. Each function runs once over a list of
+# positions and returns the number of calls it made to the benchmarked code.
+BENCHMARKS = {
+    'Position.get_legal_moves': bench_get_legal_moves,
+    'Position.is_attacked': bench_is_attacked,
+    'Position.get_attack_map': bench_get_attack_map,
+    'Position.make_move': bench_make_move,
+    'fen.get_position': bench_get_position,
+    'fen.get_fen': bench_get_fen,
+    'fen.check_fen': bench_check_fen,
+    'pgn.update_pgn': bench_update_pgn,
+    'ai.raw_material': bench_raw_material,
+    'ai.playout': bench_playout
+}
+
+
+def load_positions(name):
+    """
+    Sets up the positions of a position set.
+    :param name: The name of the position set.
+    :return: A list of Position instances, each with its legal moves stored in
+    a moves attribute.
+    """
+    games = []
+    for fen_string in POSITION_SETS[name]:
+        game = board.Position(fen_string, 'c', 'c')
+        game.moves = game.get_legal_moves()
+        games.append(game)
+    return games
+
+
+def run_benchmark(function, games, warmup=DEFAULT_WARMUP,
+                  repeat=DEFAULT_REPEAT):
+    """
+    Times a benchmark over a list of positions.
+    :param function: The benchmark function.
+    :param games: The positions to run it over.
+    :param warmup: The number of untimed runs before timing.
+    :param repeat: The number of timed runs.
+    :return: A dictionary of the statistics of the timed runs.
+    """
+    for i in range(warmup):
+        function(games)
+
+    times = []
+    calls = 0
+    for i in range(repeat):
+        begin = timer()
+        calls = function(games)
+        times.append(timer() - begin)
+
+    median = statistics.median(times)
+    if len(times) > 1:
+        stdev = statistics.stdev(times)
+    else:
+        stdev = 0.0
+    return {
+        'calls': calls,
+        'repeat': repeat,
+        'min': min(times),
+        'max': max(times),
+        'mean': statistics.mean(times),
+        'median': median,
+        'stdev': stdev,
+        'per_call': median / calls if calls else 0.0
+    }
+
+
+def run(set_names, benchmark_names, warmup=DEFAULT_WARMUP,
+        repeat=DEFAULT_REPEAT):
+    """
+    Runs benchmarks over position sets.
+    :param set_names: The names of the position sets to use.
+    :param benchmark_names: The names of the benchmarks to run.
+    :param warmup: The number of untimed runs of each benchmark.
+    :param repeat: The number of timed runs of each benchmark.
+    :return: A dictionary of the run information and of the statistics of each
+    benchmark, keyed by 'benchmark/position set'.
+    """
+    results = {}
+    for set_name in set_names:
+        games = load_positions(set_name)
+        for name in benchmark_names:
+            results['/'.join((name, set_name))] = run_benchmark(
+                BENCHMARKS[name], games, warmup, repeat)
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'results': results
+    }
+
+
+def compare(current, previous, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares the median times of two runs.
+    :param current: The results of the current run.
+    :param previous: The results of an earlier run.
+    :param threshold: The fractional slow down reported as a regression.
+    :return: A list of tuples (key, ratio, regressed) for each benchmark in
+    both runs, where ratio is the current median divided by the previous one.
+    """
+    comparison = []
+    for key, stats in current['results'].items():
+        if key not in previous['results']:
+            continue
+        ratio = stats['median'] / previous['results'][key]['median']
+        comparison.append((key, ratio, ratio > 1 + threshold))
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the hot paths")
+    parser.add_argument("--sets", nargs="+", choices=list(POSITION_SETS),
+                        default=list(POSITION_SETS),
+                        help="The position sets to benchmark over.")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS),
+                        default=list(BENCHMARKS),
+                        help="The benchmarks to run.")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP,
+                        help="The number of untimed runs of each benchmark.")
+    parser.add_argument("--repeat", type=error.positive_int,
+                        default=DEFAULT_REPEAT,
+                        help="The number of timed runs of each benchmark.")
+    parser.add_argument("--json", default=None,
+                        help="The path to write the results to as JSON.")
+    parser.add_argument("--compare", default=None,
+                        help="The JSON results of an earlier run to compare "
+                             "against.")
+    args = parser.parse_args()
+
+    results = run(args.sets, args.benchmarks, args.warmup, args.repeat)
+
+    print('{:<44}{:>8}{:>12}{:>12}{:>12}{:>14}'.format(
+        'Benchmark', 'Calls', 'Min (ms)', 'Median (ms)', 'Stdev (ms)',
+        'Per call (us)'))
+    for key, stats in results['results'].items():
+        print('{:<44}{:>8}{:>12.3f}{:>12.3f}{:>12.3f}{:>14.2f}'.format(
+            key, stats['calls'], stats['min'] * 1e3, stats['median'] * 1e3,
+            stats['stdev'] * 1e3, stats['per_call'] * 1e6))
+
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as json_file:
+            previous = json.load(json_file)
+        regressions = 0
+        print()
+        for key, ratio, regressed in compare(results, previous):
+            if regressed:
+                regressions += 1
+            print('{:<44}{:>8.2f}x{}'.format(key, ratio,
+                                             '  REGRESSION' if regressed
+                                             else ''))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
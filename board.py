@@ -4,7 +4,9 @@ import random
 from timeit import default_timer as timer
 import error
 import fen
+import material
 import pgn
+import zobrist
 
 BLACK = 0
 BLACK_PAWN_RANK = 1
@@ -22,6 +24,34 @@ WHITE_EN_PASSANT_RANK = 3
 WHITE_KING_SIDE_CASTLE = 0
 WHITE_QUEEN_SIDE_CASTLE = 1
 
+# The back rank of the king and rook of each castling privilege
+CASTLING_RANKS = [7, 7, 0, 0]
+
+# The files of the castling rooks of a standard game
+STANDARD_CASTLING_ROOKS = [7, 0, 7, 0]
+
+# The file of the king in a standard game
+STANDARD_KING_FILE = 4
+
+# The steps of the pieces that move a single step
+KNIGHT_STEPS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1),
+                (-1, 2)]
+KING_STEPS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0),
+              (1, 1)]
+
+# The directions of the sliding pieces
+DIAGONAL_STEPS = [(1, 1), (1, -1), (-1, -1), (-1, 1)]
+STRAIGHT_STEPS = [(1, 0), (0, -1), (-1, 0), (0, 1)]
+
+# The values of the pieces in pawns for static exchange evaluation
+SEE_VALUES = {' ': 0, 'P': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 100}
+
+# The states of a position returned by Position.status
+IN_PLAY = 0
+CHECK = 1
+CHECKMATE = 2
+STALEMATE = 3
+
 IS_EN_PASSANT = True
 NOT_EN_PASSANT = False
 
@@ -44,6 +74,9 @@ inv_files = {
 # New standard game position
 standard_start = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
 
+# The pieces a pawn can be promoted to
+PROMOTION_PIECES = ['Q', 'N', 'R', 'B']
+
 # The characters representing the pieces
 pieces = {
     'K': '\u2654', 'Q': '\u2655', 'R': '\u2656', 'B': '\u2657', 'N': '\u2658',
@@ -52,27 +85,120 @@ pieces = {
 }
 
 
+def encode_move(move, promotion=None):
+    """
+    Packs a move into a 16 bit integer. The low 6 bits hold the start square
+    and the next 6 bits the end square, where a square is numbered y * 8 + x.
+    The next 3 bits hold the promotion piece, if any.
+    :param move: The move in the form ((start_x, start_y), (end_x, end_y)).
+    :param promotion: The piece promoted to, or None.
+    :return: The packed move.
+    """
+    (x1, y1), (x2, y2) = move
+    code = (y1 * 8 + x1) | ((y2 * 8 + x2) << 6)
+    if promotion is not None:
+        code |= (PROMOTION_PIECES.index(promotion.upper()) + 1) << 12
+    return code
+
+
+def decode_move(code):
+    """
+    Unpacks a move packed by encode_move.
+    :param code: The packed move.
+    :return: The move in the form ((start_x, start_y), (end_x, end_y)).
+    """
+    start = code & 63
+    end = (code >> 6) & 63
+    return (start % 8, start // 8), (end % 8, end // 8)
+
+
+def decode_promotion(code):
+    """
+    Unpacks the promotion piece of a move packed by encode_move.
+    :param code: The packed move.
+    :return: The upper case promotion piece, or None.
+    """
+    piece = (code >> 12) & 7
+    if piece:
+        return PROMOTION_PIECES[piece - 1]
+    return None
+
+
+def get_castling_path(king_x, rook_x):
+    """
+    Works out how the king and rook move when castling. The king ends on the g
+    or c file and the rook next to it on the f or d file, whatever files they
+    start on.
+    :param king_x: The file the king starts on.
+    :param rook_x: The file the rook starts on.
+    :return: A tuple (king_to, rook_to, empty, path) of the files the king and
+    rook end on, the files that must be empty apart from those of the king and
+    rook and the files the king passes through, which must not be attacked.
+    """
+    if rook_x > king_x:
+        king_to, rook_to = 6, 5
+    else:
+        king_to, rook_to = 2, 3
+    path = tuple(range(min(king_x, king_to), max(king_x, king_to) + 1))
+    rook_path = range(min(rook_x, rook_to), max(rook_x, rook_to) + 1)
+    empty = tuple(sorted((set(path) | set(rook_path)) - {king_x, rook_x}))
+    return king_to, rook_to, empty, path
+
+
+# The castling path of every pair of king and rook files
+CASTLING_PATHS = {
+    (king_x, rook_x): get_castling_path(king_x, rook_x)
+    for king_x in range(8) for rook_x in range(8) if king_x != rook_x
+}
+
+
+def get_count_name(piece, x, y):
+    """
+    Gets the key of a piece in Position.piece_count, which tells bishops on
+    light and dark squares apart.
+    :param piece: The piece.
+    :param x: The x coordinate of the square of the piece.
+    :param y: The y coordinate of the square of the piece.
+    :return: The key.
+    """
+    if piece == 'B' or piece == 'b':
+        if x % 2 == y % 2:
+            return 'l' + piece
+        return 'd' + piece
+    return piece
+
+
 class Position:
-    def __init__(self, position, white, black):
+    def __init__(self, position, white, black, chess960=False):
         """
         Initialise the position.
         :param position: The FEN string representing the starting position.
         :param white: A character representing if white is a human or computer.
         :param black: A character representing if black is a human or computer.
+        :param chess960: True if the game is a game of Chess960, where castling
+        moves are made as the king moving to the square of its rook.
         """
         self.piece_count = {
             'K': 0, 'Q': 0, 'R': 0, 'dB': 0, 'lB': 0, 'N': 0, 'P': 0, 'k': 0,
             'q': 0, 'r': 0, 'db': 0, 'lb': 0, 'n': 0, 'p': 0
         }
         self.pos = fen.get_position(position, self.piece_count)
+        self.material_key = material.get_key(self.piece_count)
         self.turn = fen.get_turn(position.split(' ')[1])
-        self.castling = fen.CASTLING_OPTIONS[position.split(' ')[2]]
+        self.castling, self.castling_rooks = fen.get_castling(
+            position.split(' ')[2], self.pos)
+        self.chess960 = chess960
         self.en_passant = fen.get_en_passant(position.split(' ')[3])
         self.halfmove = int(position.split(' ')[4])
         self.fullmove = int(position.split(' ')[5])
         self.current_fen = fen.get_fen(self.pos, self.turn, self.castling,
                                        self.en_passant, self.halfmove,
-                                       self.fullmove)
+                                       self.fullmove, self.castling_rooks)
+        self.hash = zobrist.get_hash(self.pos, self.turn, self.castling,
+                                     self.en_passant)
+        self.pawn_hash = zobrist.get_pawn_hash(self.pos)
+        self.history = []
+        self.attack_map = None
         self.white = white
         self.black = black
         self.pgn = pgn.set_up_pgn()
@@ -180,7 +306,32 @@ class Position:
                     return False
         return True
 
-    def make_move(self, start, end, en_passant):
+    def copy(self):
+        """
+        Copies the position. Much cheaper than copy.deepcopy as only the
+        mutable board state is duplicated.
+        :return: A new instance of Position that can be changed independently.
+        """
+        other = copy.copy(self)
+        other.pos = [rank[:] for rank in self.pos]
+        other.piece_count = self.piece_count.copy()
+        other.castling = self.castling[:]
+        other.history = self.history[:]
+        return other
+
+    def is_en_passant(self, start, end):
+        """
+        Checks whether a move is an en passant capture.
+        :param start: The starting location of the piece to move.
+        :param end: The end location of the piece to move.
+        :return: True if the move is an en passant capture, false otherwise.
+        """
+        x, y = start
+        return self.en_passant is not None and end == self.en_passant and \
+            (self.pos[y][x] == 'P' or self.pos[y][x] == 'p')
+
+    def make_move(self, start, end, en_passant, promotion=None,
+                  update_fen=True):
         """
         Move the piece at start coordinate to end coordinate. Assumes the move
         is legal. At the end of this method, the check_promotions method is
@@ -188,6 +339,10 @@ class Position:
         :param start: The starting location of the piece to move.
         :param end: The end location of the piece to move.
         :param en_passant: A boolean indicating whether the move is en passant
+        :param promotion: The piece to promote to, or None to let the player
+        choose.
+        :param update_fen: False to leave current_fen as None rather than
+        building the FEN string, for playouts that never read it.
         :return: Nothing.
         """
         x, y = start
@@ -197,60 +352,62 @@ class Position:
         piece = self.pos[y][x]
         end_piece = self.pos[y_new][x_new]
 
-        # Actually move the piece and update piece count
-        self.pos[y][x] = ' '
-        if end_piece != ' ':
-            # Capture move
-            if end_piece != 'B' and end_piece != 'b':
-                self.piece_count[end_piece] -= 1
-            elif end_piece == 'B' and ((x_new % 2 == 0 and y_new % 2 == 0) or
-                                       (x_new % 2 == 1 and y_new % 2 == 1)):
-                self.piece_count['lB'] -= 1
-            elif end_piece == 'B' and ((x_new % 2 == 0 and y_new % 2 == 1) or
-                                       (x_new % 2 == 1 and y_new % 2 == 0)):
-                self.piece_count['dB'] -= 1
-            elif end_piece == 'b' and ((x_new % 2 == 0 and y_new % 2 == 0) or
-                                       (x_new % 2 == 1 and y_new % 2 == 1)):
-                self.piece_count['lb'] -= 1
-            else:
-                self.piece_count['db'] -= 1
-        self.pos[y_new][x_new] = piece
-
-        # Update castling and move rook if castling
-        if x == 0 and y == 0:
-            self.castling[BLACK_QUEEN_SIDE_CASTLE] = False
-        elif x == 7 and y == 0:
-            self.castling[BLACK_KING_SIDE_CASTLE] = False
-        elif x == 0 and y == 7:
-            self.castling[WHITE_QUEEN_SIDE_CASTLE] = False
-        elif x == 7 and y == 7:
-            self.castling[WHITE_KING_SIDE_CASTLE] = False
-        elif x == 4 and y == 0:
-            self.castling[BLACK_KING_SIDE_CASTLE] = False
-            self.castling[BLACK_QUEEN_SIDE_CASTLE] = False
-            if x_new == 6 and y_new == 0 and piece == 'k':
-                self.pos[0][7] = ' '
-                self.pos[0][5] = 'r'
-            elif x_new == 2 and y_new == 0 and piece == 'k':
-                self.pos[0][0] = ' '
-                self.pos[0][3] = 'r'
-        elif x == 4 and y == 7:
-            self.castling[WHITE_KING_SIDE_CASTLE] = False
-            self.castling[WHITE_QUEEN_SIDE_CASTLE] = False
-            if x_new == 6 and y_new == 7 and piece == 'K':
-                self.pos[7][7] = ' '
-                self.pos[7][5] = 'R'
-            elif x_new == 2 and y_new == 7 and piece == 'K':
-                self.pos[7][0] = ' '
-                self.pos[7][3] = 'R'
+        # Move the king and rook if castling
+        castle = None
+        if (piece == 'K' or piece == 'k') and any(self.castling):
+            castle = self.get_castling_side(start, end)
+        if castle is not None:
+            rook_x = self.castling_rooks[castle]
+            king_to, rook_to = CASTLING_PATHS[(x, rook_x)][:2]
+            rank = self.pos[y]
+            rook = rank[rook_x]
+            rank[x] = ' '
+            rank[rook_x] = ' '
+            rank[king_to] = piece
+            rank[rook_to] = rook
+            end_piece = ' '
+        else:
+            # Actually move the piece and update piece count
+            self.pos[y][x] = ' '
+            if end_piece != ' ':
+                # Capture move
+                name = get_count_name(end_piece, x_new, y_new)
+                self.piece_count[name] -= 1
+                self.material_key -= material.WEIGHTS[name]
+                if end_piece == 'P' or end_piece == 'p':
+                    self.pawn_hash ^= \
+                        zobrist.PIECE_KEYS[end_piece][y_new][x_new]
+            self.pos[y_new][x_new] = piece
+            if piece == 'P' or piece == 'p':
+                self.pawn_hash ^= zobrist.PIECE_KEYS[piece][y][x] ^ \
+                    zobrist.PIECE_KEYS[piece][y_new][x_new]
+
+        # Update castling privileges. A privilege is lost when the king moves
+        # or when its rook moves or is captured
+        if any(self.castling):
+            if piece == 'K':
+                self.castling[WHITE_KING_SIDE_CASTLE] = False
+                self.castling[WHITE_QUEEN_SIDE_CASTLE] = False
+            elif piece == 'k':
+                self.castling[BLACK_KING_SIDE_CASTLE] = False
+                self.castling[BLACK_QUEEN_SIDE_CASTLE] = False
+            for i in range(4):
+                if self.castling[i]:
+                    rook_square = (self.castling_rooks[i], CASTLING_RANKS[i])
+                    if start == rook_square or end == rook_square:
+                        self.castling[i] = False
 
         # Remove piece captured en passant
         if en_passant:
             if self.turn:
                 self.piece_count['p'] -= 1
+                self.material_key -= material.WEIGHTS['p']
+                self.pawn_hash ^= zobrist.PIECE_KEYS['p'][y_new + 1][x_new]
                 self.pos[y_new + 1][x_new] = ' '
             else:
                 self.piece_count['P'] -= 1
+                self.material_key -= material.WEIGHTS['P']
+                self.pawn_hash ^= zobrist.PIECE_KEYS['P'][y_new - 1][x_new]
                 self.pos[y_new - 1][x_new] = ' '
 
         # En passant update
@@ -262,26 +419,153 @@ class Position:
                 y_new == BLACK_TWO_SQUARE_MOVE_RANK:
             self.en_passant = (x, BLACK_IN_BETWEEN_RANK)
 
-        # Update halfmove clock
+        # Update halfmove clock and the history of the hashes of positions
+        # that can still repeat, which an irreversible move empties
         if piece == 'P' or piece == 'p' or end_piece != ' ':
             self.halfmove = 0
+            self.history = []
         else:
             self.halfmove += 1
+            self.history.append(self.hash)
 
         # Update fullmove clock
         if not self.turn:
             self.fullmove += 1
 
         # Check promotions
-        self.check_promotions()
+        self.check_promotions(promotion)
 
         # Toggle the turn
         self.turn = 1 - self.turn
 
-        # Update FEN
+        # Update FEN, hash and attack map
+        self.attack_map = None
+        if update_fen:
+            self.current_fen = fen.get_fen(self.pos, self.turn, self.castling,
+                                           self.en_passant, self.halfmove,
+                                           self.fullmove, self.castling_rooks)
+        else:
+            self.current_fen = None
+        self.hash = zobrist.get_hash(self.pos, self.turn, self.castling,
+                                     self.en_passant)
+
+    def make_null_move(self):
+        """
+        Passes the turn to the other player without moving, for null-move
+        pruning in the search. The position is never legal to pass in, so the
+        positions before it are dropped from the history of positions that can
+        repeat.
+        :return: Nothing.
+        """
+        if self.en_passant is not None:
+            self.hash ^= zobrist.EN_PASSANT_KEYS[self.en_passant[0]]
+            self.en_passant = None
+        self.hash ^= zobrist.WHITE_TO_MOVE_KEY
+        self.halfmove += 1
+        self.history = []
+        if not self.turn:
+            self.fullmove += 1
+        self.turn = 1 - self.turn
+
+        self.attack_map = None
         self.current_fen = fen.get_fen(self.pos, self.turn, self.castling,
                                        self.en_passant, self.halfmove,
-                                       self.fullmove)
+                                       self.fullmove, self.castling_rooks)
+
+    def get_attacks(self, turn, ignore=()):
+        """
+        Counts the pieces of a player attacking each square in one sweep over
+        the board.
+        :param turn: The player whose attacks to count.
+        :param ignore: The coordinates of pieces to treat as absent, so that
+        squares behind them along a ray count as attacked.
+        :return: A list of lists of the number of attackers of each square,
+        indexed by y and then x.
+        """
+        counts = [[0] * 8 for y in range(8)]
+        pos = self.pos
+        lifted = [(x, y, pos[y][x]) for x, y in ignore]
+        for x, y, item in lifted:
+            pos[y][x] = ' '
+
+        if turn:
+            pawn, knight, bishop, rook, queen, king = 'P', 'N', 'B', 'R', \
+                'Q', 'K'
+            pawn_step = -1
+        else:
+            pawn, knight, bishop, rook, queen, king = 'p', 'n', 'b', 'r', \
+                'q', 'k'
+            pawn_step = 1
+
+        for y in range(8):
+            for x in range(8):
+                item = pos[y][x]
+                if item == ' ':
+                    continue
+                if item == pawn:
+                    y_new = y + pawn_step
+                    if 0 <= y_new <= 7:
+                        if x > 0:
+                            counts[y_new][x - 1] += 1
+                        if x < 7:
+                            counts[y_new][x + 1] += 1
+                    continue
+                if item == knight:
+                    steps = KNIGHT_STEPS
+                elif item == king:
+                    steps = KING_STEPS
+                else:
+                    if item == bishop:
+                        directions = DIAGONAL_STEPS
+                    elif item == rook:
+                        directions = STRAIGHT_STEPS
+                    elif item == queen:
+                        directions = DIAGONAL_STEPS + STRAIGHT_STEPS
+                    else:
+                        continue
+                    for i, j in directions:
+                        x_new = x + i
+                        y_new = y + j
+                        while 0 <= x_new <= 7 and 0 <= y_new <= 7:
+                            counts[y_new][x_new] += 1
+                            if pos[y_new][x_new] != ' ':
+                                break
+                            x_new += i
+                            y_new += j
+                    continue
+                for i, j in steps:
+                    x_new = x + i
+                    y_new = y + j
+                    if 0 <= x_new <= 7 and 0 <= y_new <= 7:
+                        counts[y_new][x_new] += 1
+
+        for x, y, item in lifted:
+            pos[y][x] = item
+        return counts
+
+    def get_attack_map(self):
+        """
+        Gets the number of pieces of the opponent of the player to move
+        attacking each square. The map is computed once per position with the
+        king of the player to move lifted off the board, so squares the king
+        would step back into along a ray count as attacked, and is dropped by
+        make_move.
+        :return: A list of lists of the number of attackers of each square,
+        indexed by y and then x.
+        """
+        if self.attack_map is None:
+            self.attack_map = self.get_attacks(1 - self.turn,
+                                               (self.get_king_coordinates(),))
+        return self.attack_map
+
+    def in_check(self):
+        """
+        Checks whether the player to move is in check.
+        :return: True if the king of the player to move is attacked, false
+        otherwise.
+        """
+        x, y = self.get_king_coordinates()
+        return self.get_attack_map()[y][x] > 0
 
     def is_attacked(self, coordinates):
         """
@@ -304,6 +588,27 @@ class Position:
 
         return False
 
+    def get_ray_piece(self, coordinates, step, removed=()):
+        """
+        Finds the first piece along a ray from a square.
+        :param coordinates: The (x, y) coordinates of the square the ray
+        starts from, which is not part of the ray.
+        :param step: The (x, y) step of the ray.
+        :param removed: The coordinates of pieces to treat as absent.
+        :return: The (x, y) coordinates of the first piece along the ray, or
+        None if the ray reaches the edge of the board.
+        """
+        x, y = coordinates
+        i, j = step
+        x += i
+        y += j
+        while 0 <= x <= 7 and 0 <= y <= 7:
+            if self.pos[y][x] != ' ' and (x, y) not in removed:
+                return x, y
+            x += i
+            y += j
+        return None
+
     def horizontal_or_vertical_attack(self, coordinates):
         """
         Check if the square at the given coordinates is attacked horizontally
@@ -312,8 +617,6 @@ class Position:
         :return: True if the square is attacked, false otherwise.
         """
 
-        x, y = coordinates
-
         # Determine the queen and rook pieces
         if self.turn:
             queen = 'q'
@@ -322,48 +625,12 @@ class Position:
             queen = 'Q'
             rook = 'R'
 
-        multipliers = [
-            (-1, 1), (-2, 2), (-3, 3), (-4, 4), (-5, 5), (-6, 6), (-7, 7)
-        ]
-
-        blocked_hn = False
-        blocked_hp = False
-        blocked_vn = False
-        blocked_vp = False
-        for multiplier in multipliers:
-            neg_shift, pos_shift = multiplier
-            x_new_n = x + neg_shift
-            y_new_n = y + neg_shift
-            x_new_p = x + pos_shift
-            y_new_p = y + pos_shift
-
-            if 0 <= x_new_n <= 7 and not blocked_hn:
-                char = self.pos[y][x_new_n]
-                if char == rook or char == queen:
-                    return True
-                elif char != ' ' and char != rook and char != queen:
-                    blocked_hn = True
-
-            if 0 <= x_new_p <= 7 and not blocked_hp:
-                char = self.pos[y][x_new_p]
-                if char == rook or char == queen:
-                    return True
-                elif char != ' ' and char != rook and char != queen:
-                    blocked_hp = True
-
-            if 0 <= y_new_n <= 7 and not blocked_vn:
-                char = self.pos[y_new_n][x]
-                if char == rook or char == queen:
-                    return True
-                elif char != ' ' and char != rook and char != queen:
-                    blocked_vn = True
-
-            if 0 <= y_new_p <= 7 and not blocked_vp:
-                char = self.pos[y_new_p][x]
+        for step in STRAIGHT_STEPS:
+            square = self.get_ray_piece(coordinates, step)
+            if square is not None:
+                char = self.pos[square[1]][square[0]]
                 if char == rook or char == queen:
                     return True
-                elif char != ' ' and char != rook and char != queen:
-                    blocked_vp = True
         return False
 
     def diagonal_attack(self, coordinates):
@@ -374,8 +641,6 @@ class Position:
         :return: True if the square is attacked, false otherwise.
         """
 
-        x, y = coordinates
-
         # Determine the queen and bishop pieces
         if self.turn:
             queen = 'q'
@@ -385,22 +650,110 @@ class Position:
             bishop = 'B'
 
         # Search for a diagonal attack
-        for i in [-1, 1]:
-            for j in [-1, 1]:
-                for k in list(range(1, 8)):
-                    x_new = x + i * k
-                    y_new = y + j * k
+        for step in DIAGONAL_STEPS:
+            square = self.get_ray_piece(coordinates, step)
+            if square is not None:
+                char = self.pos[square[1]][square[0]]
+                if char == queen or char == bishop:
+                    return True
+        return False
 
-                    if 0 <= x_new <= 7 and 0 <= y_new <= 7:
-                        char = self.pos[y_new][x_new]
-                        if char != ' ' and char != queen and char != bishop:
-                            break
-                        elif char == queen or char == bishop:
-                            return True
-                    else:
-                        continue
+    def get_attackers(self, coordinates, removed=()):
+        """
+        Finds the pieces of both players attacking a square. Sliders behind
+        removed pieces attack through them, which reveals x-ray attackers as
+        the pieces in front of them are removed.
+        :param coordinates: The (x, y) coordinates of the square.
+        :param removed: The coordinates of pieces to treat as absent.
+        :return: A list of the (x, y) coordinates of the attackers.
+        """
+        x, y = coordinates
+        attackers = []
+
+        # Rooks and queens, and kings next to the square
+        for step in STRAIGHT_STEPS:
+            square = self.get_ray_piece(coordinates, step, removed)
+            if square is not None:
+                char = self.pos[square[1]][square[0]].upper()
+                if char == 'R' or char == 'Q' or (
+                        char == 'K' and abs(square[0] - x) <= 1 and
+                        abs(square[1] - y) <= 1):
+                    attackers.append(square)
+
+        # Bishops and queens, and kings and pawns next to the square
+        for i, j in DIAGONAL_STEPS:
+            square = self.get_ray_piece(coordinates, (i, j), removed)
+            if square is not None:
+                char = self.pos[square[1]][square[0]]
+                adjacent = square == (x + i, y + j)
+                if char.upper() == 'B' or char.upper() == 'Q' or (
+                        adjacent and (char.upper() == 'K' or
+                                      (char == 'P' and j == 1) or
+                                      (char == 'p' and j == -1))):
+                    attackers.append(square)
+
+        # Knights
+        for i, j in KNIGHT_STEPS:
+            x_new = x + i
+            y_new = y + j
+            if 0 <= x_new <= 7 and 0 <= y_new <= 7 and \
+                    self.pos[y_new][x_new].upper() == 'N' and \
+                    (x_new, y_new) not in removed:
+                attackers.append((x_new, y_new))
+
+        return attackers
+
+    def see(self, move):
+        """
+        Static exchange evaluation. Works out the material won or lost by a
+        move once all the captures on its end square have been resolved, each
+        player capturing with their least valuable attacker and either player
+        free to stop capturing when it would lose material.
+        :param move: The move in the form ((start_x, start_y), (end_x, end_y)).
+        :return: The material won in pawns, negative if material is lost.
+        """
+        start, end = move
+        x, y = start
+        x_new, y_new = end
+        removed = {start}
 
-        return False
+        # The material won by each capture in turn
+        if self.is_en_passant(start, end):
+            gains = [SEE_VALUES['P']]
+            removed.add((x_new, y))
+        else:
+            gains = [SEE_VALUES[self.pos[y_new][x_new].upper()]]
+
+        # The value of the piece standing on the square
+        on_square = SEE_VALUES[self.pos[y][x].upper()]
+        side = 1 - self.turn
+        while True:
+            # Find the least valuable attacker of the side to capture
+            attackers = [
+                square for square in self.get_attackers(end, removed)
+                if self.pos[square[1]][square[0]].isupper() == bool(side)
+            ]
+            if not attackers:
+                break
+            attacker = min(attackers, key=lambda square: SEE_VALUES[
+                self.pos[square[1]][square[0]].upper()])
+            value = SEE_VALUES[self.pos[attacker[1]][attacker[0]].upper()]
+
+            # A king cannot capture onto a defended square
+            removed.add(attacker)
+            if value == SEE_VALUES['K'] and any(
+                    self.pos[square[1]][square[0]].isupper() != bool(side)
+                    for square in self.get_attackers(end, removed)):
+                break
+
+            gains.append(on_square - gains[-1])
+            on_square = value
+            side = 1 - side
+
+        # Either player stops capturing when it would lose material
+        for i in range(len(gains) - 1, 0, -1):
+            gains[i - 1] = -max(-gains[i - 1], gains[i])
+        return gains[0]
 
     def knight_attack(self, coordinates):
         """
@@ -478,6 +831,70 @@ class Position:
 
         return legal_moves
 
+    def has_legal_move(self):
+        """
+        Checks whether the player to move has a legal move. Stops at the first
+        legal move found, trying the king first as it is the only piece that
+        can move out of a double check, then the other pieces from the
+        cheapest to generate moves for.
+        :return: True if there is a legal move, false otherwise.
+        """
+        moves = []
+        self.get_king_moves(moves)
+        if moves:
+            return True
+
+        # Find the other pieces of the player to move
+        if self.turn:
+            pawn, knight, bishop, rook, queen = 'P', 'N', 'B', 'R', 'Q'
+        else:
+            pawn, knight, bishop, rook, queen = 'p', 'n', 'b', 'r', 'q'
+        pieces = {pawn: [], knight: [], bishop: [], rook: [], queen: []}
+        y = 0
+        for rank in self.pos:
+            x = 0
+            for item in rank:
+                if item in pieces:
+                    pieces[item].append((x, y))
+                x += 1
+            y += 1
+
+        for start in pieces[pawn]:
+            self.get_pawn_range(start, moves)
+            if moves:
+                return True
+        for start in pieces[knight]:
+            self.get_knight_range(start, moves)
+            if moves:
+                return True
+        for start in pieces[bishop] + pieces[queen]:
+            self.get_diagonal_range(start, moves)
+            if moves:
+                return True
+        for start in pieces[rook] + pieces[queen]:
+            self.get_vertical_range(start, moves)
+            if moves:
+                return True
+            self.get_horizontal_range(start, moves)
+            if moves:
+                return True
+        return False
+
+    def status(self):
+        """
+        Determines whether the player to move is in check, checkmated or
+        stalemated, stopping at the first legal move found.
+        :return: One of IN_PLAY, CHECK, CHECKMATE or STALEMATE.
+        """
+        in_check = self.in_check()
+        if self.has_legal_move():
+            if in_check:
+                return CHECK
+            return IN_PLAY
+        if in_check:
+            return CHECKMATE
+        return STALEMATE
+
     def get_king_moves(self, moves):
         """
         Gets the legal moves by the king from a given position.
@@ -485,64 +902,93 @@ class Position:
         :return: Nothing.
         """
         x, y = self.get_king_coordinates()
+        attacks = self.get_attack_map()
+
+        # Get the adjacent squares of the king that are not attacked
+        for i, j in KING_STEPS:
+            x_new = x + i
+            y_new = y + j
+            if 0 <= x_new <= 7 and 0 <= y_new <= 7 and \
+                    not attacks[y_new][x_new]:
+                char = self.pos[y_new][x_new]
+                if char == ' ' or (char.islower() if self.turn else
+                                   char.isupper()):
+                    moves.append(((x, y), (x_new, y_new)))
 
-        # Get the adjacent squares of the king
-        for i in [-1, 0, 1]:
-            for j in [-1, 0, 1]:
-                if i != 0 or j != 0:
-                    x_new = x + i
-                    y_new = y + j
+        # Check for castling moves
+        if self.turn:
+            sides = (WHITE_KING_SIDE_CASTLE, WHITE_QUEEN_SIDE_CASTLE)
+        else:
+            sides = (BLACK_KING_SIDE_CASTLE, BLACK_QUEEN_SIDE_CASTLE)
+        for side in sides:
+            if self.castling[side] and y == CASTLING_RANKS[side] and \
+                    (self.chess960 or x == STANDARD_KING_FILE):
+                self.add_castling_move((x, y), side, moves)
 
-                    # Find the legal moves and add them
-                    if 0 <= x_new <= 7 and 0 <= y_new <= 7:
-                        char = self.pos[y_new][x_new]
-                        if self.turn:
-                            if (char.islower() or char == ' ') and char != 'k':
-                                self.make_check_and_add_move((x, y),
-                                                             (x_new, y_new),
-                                                             NOT_EN_PASSANT,
-                                                             moves)
-                        else:
-                            if (char.isupper() or char == ' ') and char != 'K':
-                                self.make_check_and_add_move((x, y),
-                                                             (x_new, y_new),
-                                                             NOT_EN_PASSANT,
-                                                             moves)
+    def add_castling_move(self, start, side, moves):
+        """
+        Adds a castling move to the moves list if it is legal. Assumes the
+        player has the castling privilege.
+        :param start: The coordinates of the king.
+        :param side: The index of the castling privilege.
+        :param moves: The list of valid moves in the current position.
+        :return: Nothing.
+        """
+        x, y = start
+        rook_x = self.castling_rooks[side]
+        king_to, rook_to, empty, path = CASTLING_PATHS[(x, rook_x)]
+        rank = self.pos[y]
+
+        # The squares the king and rook pass through must be empty
+        for x_empty in empty:
+            if rank[x_empty] != ' ':
+                return
+
+        # The king must not be in check, pass through check or end in check.
+        # The king is already lifted off the board in the attack map. In
+        # Chess960 the rook can stand between an attacker and the path, so the
+        # attacks are counted again with the rook lifted off as well
+        if self.chess960:
+            attacks = self.get_attacks(1 - self.turn, (start, (rook_x, y)))
+        else:
+            attacks = self.get_attack_map()
+        for x_path in path:
+            if attacks[y][x_path]:
+                return
 
-        # Check for castling moves
-        if self.turn and x == 4 and y == 7:
-            # King side castle
-            if self.castling[WHITE_KING_SIDE_CASTLE] and \
-                    self.pos[7][5] == ' ' and \
-                    self.pos[7][6] == ' ' and not self.is_attacked((5, 7)) \
-                    and not self.is_attacked((6, 7)) and not \
-                    self.is_attacked(self.get_king_coordinates()):
-                moves.append(((4, 7), (6, 7)))
-
-            # Queen side castle
-            if self.castling[WHITE_QUEEN_SIDE_CASTLE] and \
-                    self.pos[7][1] == ' ' and self.pos[7][2] == ' ' and \
-                    self.pos[7][3] == ' ' and not self.is_attacked((2, 7)) \
-                    and not self.is_attacked((3, 7)) and not \
-                    self.is_attacked(self.get_king_coordinates()):
-                moves.append(((4, 7), (2, 7)))
-
-        elif not self.turn and x == 4 and y == 0:
-            # King side castle
-            if self.castling[BLACK_KING_SIDE_CASTLE] and \
-                    self.pos[0][5] == ' ' and self.pos[0][6] == ' ' and \
-                    not self.is_attacked((5, 0)) and not \
-                    self.is_attacked((6, 0)) and not \
-                    self.is_attacked(self.get_king_coordinates()):
-                moves.append(((4, 0), (6, 0)))
-
-            # Queen side castle
-            if self.castling[BLACK_QUEEN_SIDE_CASTLE] and \
-                    self.pos[0][1] == ' ' and self.pos[0][2] == ' ' and \
-                    self.pos[0][3] == ' ' and not self.is_attacked((2, 0)) \
-                    and not self.is_attacked((3, 0)) and not \
-                    self.is_attacked(self.get_king_coordinates()):
-                moves.append(((4, 0), (2, 0)))
+        if self.chess960:
+            moves.append((start, (rook_x, y)))
+        else:
+            moves.append((start, (king_to, y)))
+
+    def get_castling_side(self, start, end):
+        """
+        Checks whether a move of the king of the player to move is a castling
+        move. In Chess960 castling moves are made as the king moving to the
+        square of its rook, otherwise as the king moving two squares.
+        :param start: The starting location of the king.
+        :param end: The end location of the king.
+        :return: The index of the castling privilege used, or None if the move
+        is not a castling move.
+        """
+        x, y = start
+        x_new, y_new = end
+        if self.turn:
+            sides = (WHITE_KING_SIDE_CASTLE, WHITE_QUEEN_SIDE_CASTLE)
+        else:
+            sides = (BLACK_KING_SIDE_CASTLE, BLACK_QUEEN_SIDE_CASTLE)
+        for side in sides:
+            if not self.castling[side] or y != CASTLING_RANKS[side] or \
+                    y_new != y:
+                continue
+            rook_x = self.castling_rooks[side]
+            if self.chess960:
+                if x_new == rook_x:
+                    return side
+            elif x == STANDARD_KING_FILE and rook_x != x and \
+                    x_new == CASTLING_PATHS[(x, rook_x)][0]:
+                return side
+        return None
 
     def get_queen_bishop_rook_moves(self, moves):
         """
@@ -619,24 +1065,31 @@ class Position:
 
         # Determine the knights range
         for knight in knights:
-            x, y = knight
+            self.get_knight_range(knight, moves)
 
-            for i in [-2, -1, 1, 2]:
-                for j in [-2, -1, 1, 2]:
-                    x_new = x + i
-                    y_new = y + j
-                    if abs(i) != abs(j) and 0 <= x_new <= 7 and 0 <= y_new \
-                            <= 7:
-                        char = self.pos[y_new][x_new]
-                        if self.turn and char.islower() or char == ' ':
-                            self.make_check_and_add_move(knight, (x_new,
-                                                                  y_new),
-                                                         NOT_EN_PASSANT, moves)
+    def get_knight_range(self, start, moves):
+        """
+        Determines the range of a knight and stores it in the moves list.
+        Assumes that the enemy king is not in check.
+        :param start: The coordinates of the knight.
+        :param moves: The list of legal moves in the current position.
+        :return: Nothing.
+        """
+        x, y = start
 
-                        elif not self.turn and char.isupper() or char == ' ':
-                            self.make_check_and_add_move(knight, (x_new,
-                                                                  y_new),
-                                                         NOT_EN_PASSANT, moves)
+        for i in [-2, -1, 1, 2]:
+            for j in [-2, -1, 1, 2]:
+                x_new = x + i
+                y_new = y + j
+                if abs(i) != abs(j) and 0 <= x_new <= 7 and 0 <= y_new <= 7:
+                    char = self.pos[y_new][x_new]
+                    if self.turn and char.islower() or char == ' ':
+                        self.make_check_and_add_move(start, (x_new, y_new),
+                                                     NOT_EN_PASSANT, moves)
+
+                    elif not self.turn and char.isupper() or char == ' ':
+                        self.make_check_and_add_move(start, (x_new, y_new),
+                                                     NOT_EN_PASSANT, moves)
 
     def get_pawn_moves(self, moves):
         """
@@ -665,22 +1118,31 @@ class Position:
 
         # Find the pawn movements
         for item in pawns:
-            x, y = item
+            self.get_pawn_range(item, moves)
 
-            if self.turn:
-                y_new = y - 1
-                y1 = WHITE_PAWN_RANK
-                y2 = WHITE_IN_BETWEEN_RANK
-                y3 = WHITE_TWO_SQUARE_MOVE_RANK
-                y4 = WHITE_EN_PASSANT_RANK
-                self.check_pawn_moves(moves, (x, y), y_new, y1, y2, y3, y4)
-            else:
-                y_new = y + 1
-                y1 = BLACK_PAWN_RANK
-                y2 = BLACK_IN_BETWEEN_RANK
-                y3 = BLACK_TWO_SQUARE_MOVE_RANK
-                y4 = BLACK_EN_PASSANT_RANK
-                self.check_pawn_moves(moves, (x, y), y_new, y1, y2, y3, y4)
+    def get_pawn_range(self, start, moves):
+        """
+        Determines the moves of a pawn and stores them in the moves list.
+        Assumes that the enemy king is not in check.
+        :param start: The coordinates of the pawn.
+        :param moves: The list of legal moves in the current position.
+        :return: Nothing.
+        """
+        x, y = start
+
+        if self.turn:
+            y_new = y - 1
+            y1 = WHITE_PAWN_RANK
+            y2 = WHITE_IN_BETWEEN_RANK
+            y3 = WHITE_TWO_SQUARE_MOVE_RANK
+            y4 = WHITE_EN_PASSANT_RANK
+        else:
+            y_new = y + 1
+            y1 = BLACK_PAWN_RANK
+            y2 = BLACK_IN_BETWEEN_RANK
+            y3 = BLACK_TWO_SQUARE_MOVE_RANK
+            y4 = BLACK_EN_PASSANT_RANK
+        self.check_pawn_moves(moves, start, y_new, y1, y2, y3, y4)
 
     def get_vertical_range(self, start, moves):
         """
@@ -789,11 +1251,13 @@ class Position:
 
         return False
 
-    def check_promotions(self):
+    def check_promotions(self, promotion=None):
         """
         Checks if a pawn has reached the other end for a promotion. If one has,
         then the user is prompted for a promotion option. The chosen option is
         then processed and the board is updated.
+        :param promotion: The piece to promote to in either case, or None to
+        let the player choose.
         :return: Nothing.
         """
         # Determine pawn character
@@ -813,7 +1277,12 @@ class Position:
             x = rank.index(pawn)
 
             # Choose a promotion
-            if (self.turn and self.white == 'c') or (not self.turn and
+            if promotion is not None:
+                if self.turn:
+                    choice = promotion.upper()
+                else:
+                    choice = promotion.lower()
+            elif (self.turn and self.white == 'c') or (not self.turn and
                                                      self.black == 'c'):
                 choice = choices[random.randint(0, 3)]
             elif self.turn and self.white == 'h':
@@ -829,21 +1298,12 @@ class Position:
 
             # Make the pawn promotion
             self.piece_count[pawn] -= 1
+            self.pawn_hash ^= zobrist.PIECE_KEYS[pawn][y][x]
             self.pos[y][x] = choice
-            if choice != 'B' and choice != 'b':
-                self.piece_count[choice] += 1
-            elif choice == 'B' and ((x % 2 == 0 and y % 2 == 0) or
-                                    (x % 2 == 1 and y % 2 == 1)):
-                self.piece_count['lB'] += 1
-            elif choice == 'B' and ((x % 2 == 0 and y % 2 == 1) or
-                                    (x % 2 == 1 and y % 2 == 0)):
-                self.piece_count['dB'] += 1
-            elif choice == 'b' and ((x % 2 == 0 and y % 2 == 0) or
-                                    (x % 2 == 1 and y % 2 == 1)):
-                self.piece_count['lb'] += 1
-            elif choice == 'b' and ((x % 2 == 0 and y % 2 == 1) or
-                                    (x % 2 == 1 and y % 2 == 0)):
-                self.piece_count['db'] += 1
+            name = get_count_name(choice, x, y)
+            self.piece_count[name] += 1
+            self.material_key += material.WEIGHTS[name] - \
+                material.WEIGHTS[pawn]
 
             self.pgn = ''.join((self.pgn, '=', choice.upper()))
 
@@ -896,7 +1356,36 @@ class Position:
                 self.make_check_and_add_move(start, (x1, y1), IS_EN_PASSANT,
                                              moves)
 
-    def is_end_of_game(self, moves):
+    def count_repetitions(self, limit=None):
+        """
+        Counts the earlier occurrences of the position. Only the positions
+        since the last irreversible move are scanned, and of those only every
+        second one, as the same player must be to move.
+        :param limit: The count at which to stop scanning, or None to count
+        every occurrence.
+        :return: The number of times the position occurred before, at most the
+        limit.
+        """
+        count = 0
+        history = self.history
+        for i in range(len(history) - 2, max(len(history) - self.halfmove,
+                                             0) - 1, -2):
+            if history[i] == self.hash:
+                count += 1
+                if count == limit:
+                    break
+        return count
+
+    def is_repetition(self):
+        """
+        Checks whether the position occurred before. The search scores such a
+        position as a draw, as the side that could avoid the repetition could
+        also have avoided it the first time.
+        :return: True if the position occurred before, false otherwise.
+        """
+        return self.count_repetitions(1) == 1
+
+    def is_end_of_game(self):
         """
         Check if it is the end of game. If it is a draw, print the draw message
         and reason why. If it is a stalemate, print the stalemate message. If
@@ -907,9 +1396,8 @@ class Position:
         status = 0
 
         # Three fold repetition
-        for key, value in moves:
-            if value >= 3:
-                status = error.THREEFOLD_REPETITION
+        if self.count_repetitions(2) == 2:
+            status = error.THREEFOLD_REPETITION
 
         # 50 move rule
         if self.halfmove >= 100:
@@ -919,14 +1407,11 @@ class Position:
         if self.insufficient_material():
             status = error.INSUFFICIENT_MATERIAL
 
-        # Check for stalemate
-        if not self.is_attacked(self.get_king_coordinates()) and \
-                len(self.get_legal_moves()) == 0:
+        # Check for stalemate and checkmate
+        state = self.status()
+        if state == STALEMATE:
             status = error.STALEMATE
-
-        # Check for checkmate
-        if self.is_attacked(self.get_king_coordinates()) and \
-                len(self.get_legal_moves()) == 0:
+        elif state == CHECKMATE:
             if self.turn:
                 status = error.BLACK_WINS
             else:
@@ -948,11 +1433,9 @@ class Position:
         x, y = start
         x_new, y_new = end
 
-        # Copy the current position
-        last_pos = copy.deepcopy(self.pos)
-
-        # The piece to move
+        # The piece to move and the piece to move to
         piece = self.pos[y][x]
+        end_piece = self.pos[y_new][x_new]
 
         # Actually move the piece
         self.pos[y][x] = ' '
@@ -961,70 +1444,26 @@ class Position:
         # Remove piece captured if en passant
         if en_passant:
             if self.turn:
-                self.pos[y_new + 1][x_new] = ' '
+                captured_y = y_new + 1
             else:
-                self.pos[y_new - 1][x_new] = ' '
+                captured_y = y_new - 1
+            captured = self.pos[captured_y][x_new]
+            self.pos[captured_y][x_new] = ' '
 
         # Check if king is put in check
         if not self.is_attacked(self.get_king_coordinates()) and \
                 self.kings_apart(self.get_king_coordinates()):
             moves.append((start, end))
 
-        # Undo the move
-        self.pos = copy.deepcopy(last_pos)
+        # Undo the move by putting back the squares it changed
+        self.pos[y][x] = piece
+        self.pos[y_new][x_new] = end_piece
+        if en_passant:
+            self.pos[captured_y][x_new] = captured
 
     def insufficient_material(self):
         """
         Check for a draw by insufficient material.
         :return: True if a draw, false otherwise.
         """
-        pieces_sum = sum(self.piece_count.values())
-
-        # King vs King
-        if self.piece_count['K'] == 1 and self.piece_count['k'] == 1 and \
-                pieces_sum == 2:
-            return True
-
-        # King and bishop(s) vs king (same colour bishop(s))
-        if self.piece_count['K'] == 1 and self.piece_count['lB'] and \
-                self.piece_count['k'] == 1 and (pieces_sum -
-                                                self.piece_count['lB']) == 2:
-            return True
-        if self.piece_count['K'] == 1 and self.piece_count['dB'] and \
-                self.piece_count['k'] == 1 and (pieces_sum -
-                                                self.piece_count['dB']) == 2:
-            return True
-        if self.piece_count['K'] == 1 and self.piece_count['k'] == 1 and \
-                self.piece_count['lb'] and (pieces_sum -
-                                            self.piece_count['lb'] == 2):
-            return True
-        if self.piece_count['K'] == 1 and self.piece_count['k'] == 1 and \
-                self.piece_count['db'] and (pieces_sum -
-                                            self.piece_count['db'] == 2):
-            return True
-
-        # King and knight vs King
-        if self.piece_count['K'] == 1 and self.piece_count['N'] == 1 and \
-                self.piece_count['k'] == 1 and (pieces_sum -
-                                                self.piece_count['N'] == 2):
-            return True
-        if self.piece_count['K'] == 1 and self.piece_count['k'] == 1 and \
-                self.piece_count['n'] == 1 and (pieces_sum -
-                                                self.piece_count['n'] == 2):
-            return True
-
-        # King and bishop(s) vs king and bishop(s) (same colour bishops)
-        if self.piece_count['K'] == 1 and self.piece_count['lB'] and \
-                self.piece_count['dB'] == 0 and self.piece_count['k'] == 1 \
-                and self.piece_count['lb'] and self.piece_count['db'] == 0 \
-                and (pieces_sum - self.piece_count['lB'] -
-                     self.piece_count['lb']) == 2:
-            return True
-        if self.piece_count['K'] == 1 and self.piece_count['lB'] == 0 and \
-                self.piece_count['dB'] and self.piece_count['k'] == 1 and \
-                self.piece_count['lb'] == 0 and self.piece_count['db'] and \
-                (pieces_sum - self.piece_count['dB'] -
-                 self.piece_count['db']) == 2:
-            return True
-
-        return False
+        return material.probe(self.material_key).draw
@@ -0,0 +1,176 @@
+"""
+Opening book. A book is a binary file of fixed size entries of a position
+hash, a packed move and a weight, sorted by hash. Books are read through mmap
+and searched with a binary search, so a book is never loaded into memory and
+processes using the same book share it through the page cache.
+"""
+
+import argparse
+import mmap
+import os
+import random
+import struct
+
+import board
+import error
+import pgn
+
+# Each entry holds the position hash, the move packed by board.encode_move and
+# the number of games the move was played in
+ENTRY = struct.Struct('>QHH')
+
+# The number of plies of each game added to a book by default
+DEFAULT_PLIES = 20
+
+MAX_WEIGHT = 0xFFFF
+
+
+def build(lines, path, plies=DEFAULT_PLIES):
+    """
+    Builds a book from the games in PGN input. Games are replayed up to the
+    given number of plies or the first illegal move.
+    :param lines: An iterable of the lines of the PGN input.
+    :param path: The path of the book file to write.
+    :param plies: The number of plies of each game to add.
+    :return: The number of entries written.
+    """
+    weights = {}
+    for tags, moves, result in pgn.read_games(lines):
+        game = board.Position(tags.get('FEN', board.standard_start), 'c', 'c')
+        for san in moves[:plies]:
+            parsed = pgn.parse_move(game, san)
+            if parsed is None:
+                break
+            move, promotion = parsed
+            key = (game.hash, board.encode_move(move, promotion))
+            weights[key] = weights.get(key, 0) + 1
+
+            start, end = move
+            game.make_move(start, end, game.is_en_passant(start, end),
+                           promotion)
+
+    with open(path, 'wb') as book_file:
+        for key in sorted(weights):
+            position_hash, code = key
+            book_file.write(ENTRY.pack(position_hash, code,
+                                       min(weights[key], MAX_WEIGHT)))
+
+    return len(weights)
+
+
+class Book:
+    def __init__(self, path):
+        """
+        Opens a book for reading.
+        :param path: The path of the book file.
+        """
+        self.file = open(path, 'rb')
+        self.entries = os.fstat(self.file.fileno()).st_size // ENTRY.size
+        self.map = None
+        if self.entries:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+
+    def close(self):
+        """
+        Closes the book.
+        :return: Nothing.
+        """
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        """
+        Enters a with statement that closes the book on exit.
+        :return: The book.
+        """
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        Closes the book on leaving a with statement.
+        :param exc_type: The type of the exception raised, or None.
+        :param exc_value: The exception raised, or None.
+        :param traceback: The traceback of the exception, or None.
+        :return: Nothing, so that exceptions are not suppressed.
+        """
+        self.close()
+
+    def get_hash(self, index):
+        """
+        Reads the position hash of an entry.
+        :param index: The index of the entry.
+        :return: The position hash.
+        """
+        return ENTRY.unpack_from(self.map, index * ENTRY.size)[0]
+
+    def get_moves(self, game):
+        """
+        Finds the book moves of a position.
+        :param game: The position to look up.
+        :return: A list of tuples (move, promotion, weight) of the legal book
+        moves of the position.
+        """
+        # Find the first entry of the position
+        low = 0
+        high = self.entries
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_hash(middle) < game.hash:
+                low = middle + 1
+            else:
+                high = middle
+
+        # Read the entries of the position, skipping moves that are not legal
+        # in case of a hash collision
+        moves = []
+        legal_moves = None
+        index = low
+        while index < self.entries:
+            position_hash, code, weight = ENTRY.unpack_from(
+                self.map, index * ENTRY.size)
+            if position_hash != game.hash:
+                break
+            if legal_moves is None:
+                legal_moves = game.get_legal_moves()
+            move = board.decode_move(code)
+            if move in legal_moves:
+                moves.append((move, board.decode_promotion(code), weight))
+            index += 1
+
+        return moves
+
+    def choose(self, game):
+        """
+        Chooses a book move at random, weighted by how often it was played.
+        :param game: The position to choose a move in.
+        :return: A tuple (move, promotion), or None if the position is not in
+        the book.
+        """
+        moves = self.get_moves(game)
+        if not moves:
+            return None
+
+        move, promotion, weight = random.choices(
+            moves, [weight for move, promotion, weight in moves])[0]
+        return move, promotion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds an opening book from "
+                                                 "PGN games")
+    parser.add_argument("pgn", help="The PGN file to read the games from.")
+    parser.add_argument("book", help="The book file to write.")
+    parser.add_argument("--plies", type=error.positive_int,
+                        default=DEFAULT_PLIES,
+                        help="The number of plies of each game to add.")
+    args = parser.parse_args()
+
+    with open(args.pgn) as pgn_file:
+        entries = build(pgn_file, args.book, args.plies)
+    print("Entries written: ", entries)
+
+
+if __name__ == "__main__":
+    main()
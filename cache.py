@@ -0,0 +1,57 @@
+"""
+Bounded caches for the evaluation. A cache holds a fixed number of entries
+indexed by the key modulo the number of entries, a new entry always replacing
+the one in its slot, and counts its probes and hits. The search keeps one
+cache of evaluations keyed by the hash of the position and one of pawn
+structure scores keyed by the pawn hash.
+"""
+
+# Default number of entries in each cache
+DEFAULT_EVALUATION_ENTRIES = 1 << 16
+DEFAULT_PAWN_ENTRIES = 1 << 12
+
+
+class Cache:
+    def __init__(self, entries):
+        """
+        Initialise the cache.
+        :param entries: The number of entries in the cache.
+        """
+        self.entries = entries
+        self.keys = [None] * entries
+        self.values = [None] * entries
+        self.hits = 0
+        self.probes = 0
+
+    def probe(self, key):
+        """
+        Looks up a key in the cache.
+        :param key: The 64 bit key.
+        :return: The stored value, or None if the key is not in the cache.
+        """
+        self.probes += 1
+        index = key % self.entries
+        if self.keys[index] != key:
+            return None
+        self.hits += 1
+        return self.values[index]
+
+    def store(self, key, value):
+        """
+        Stores a value in the cache.
+        :param key: The 64 bit key.
+        :param value: The value.
+        :return: Nothing.
+        """
+        index = key % self.entries
+        self.keys[index] = key
+        self.values[index] = value
+
+    def get_hit_rate(self):
+        """
+        Gets the fraction of probes that found their key.
+        :return: The hit rate between 0 and 1, or 0 if there were no probes.
+        """
+        if not self.probes:
+            return 0
+        return self.hits / self.probes
@@ -0,0 +1,150 @@
+"""
+Time control for timed games. Keeps a base plus increment clock for each side,
+allocates a time budget to each move of a computer player and tells the search
+when it should stop.
+"""
+
+from timeit import default_timer as timer
+
+# Estimated number of moves left in the game at the start and the end of the
+# game. The estimate is interpolated between the two using the game phase.
+MOVES_TO_GO_OPENING = 40
+MOVES_TO_GO_ENDGAME = 20
+
+# Seconds held back from every allocation to cover the time spent outside the
+# search (making the move, display, pgn updates).
+MOVE_OVERHEAD = 0.05
+
+# The hard limit may use at most this many soft budgets and at most this
+# fraction of the remaining time.
+HARD_LIMIT_MULTIPLIER = 4
+HARD_LIMIT_FRACTION = 0.5
+
+# Fraction of the increment that is spent on the current move.
+INCREMENT_USAGE = 0.8
+
+# Phase weights of the non-pawn pieces. The standard starting position has a
+# phase of PHASE_TOTAL and a pawn ending a phase of 0.
+PHASE_WEIGHTS = {
+    'Q': 4, 'R': 2, 'lB': 1, 'dB': 1, 'N': 1,
+    'q': 4, 'r': 2, 'lb': 1, 'db': 1, 'n': 1
+}
+PHASE_TOTAL = 24
+
+
+class Clock:
+    def __init__(self, base, increment):
+        """
+        Initialise the clock.
+        :param base: The starting time of each side in seconds.
+        :param increment: The time added to a side after each of its moves in
+        seconds.
+        """
+        self.remaining = [base, base]
+        self.increment = increment
+        self.turn = None
+        self.turn_start = None
+
+    def start(self, turn):
+        """
+        Starts the clock of the given player.
+        :param turn: The player whose clock is started.
+        :return: Nothing.
+        """
+        self.turn = turn
+        self.turn_start = timer()
+
+    def stop(self):
+        """
+        Stops the running clock, charges the elapsed time to the player that
+        was on move and adds the increment if the player did not flag.
+        :return: True if the player ran out of time, false otherwise.
+        """
+        self.remaining[self.turn] -= timer() - self.turn_start
+        self.turn_start = None
+        if self.remaining[self.turn] < 0:
+            return True
+
+        self.remaining[self.turn] += self.increment
+        return False
+
+    def allocate(self, game):
+        """
+        Allocates the time budget for the move of the player whose turn it is.
+        The soft limit is the time the search should aim to use, the hard limit
+        is the time the search must never exceed.
+        :param game: The current position.
+        :return: The SearchLimits for the move.
+        """
+        remaining = self.remaining[game.turn]
+        if self.turn_start is not None:
+            remaining -= timer() - self.turn_start
+        usable = max(remaining - MOVE_OVERHEAD, 0)
+
+        # Spread the remaining time over the estimated number of moves to go
+        moves_to_go = MOVES_TO_GO_ENDGAME + (MOVES_TO_GO_OPENING -
+                                             MOVES_TO_GO_ENDGAME) * \
+            get_phase(game) / PHASE_TOTAL
+        soft = usable / moves_to_go + self.increment * INCREMENT_USAGE
+
+        # Never allow a single move to put the player in danger of flagging
+        hard = min(soft * HARD_LIMIT_MULTIPLIER, usable * HARD_LIMIT_FRACTION)
+        soft = min(soft, hard)
+
+        return SearchLimits(soft, hard)
+
+
+class SearchLimits:
+    def __init__(self, soft=None, hard=None, stop_event=None):
+        """
+        Initialise the limits of a single search. The limits start counting
+        from the moment they are created.
+        :param soft: Seconds after which no new iteration should be started, or
+        None for no limit.
+        :param hard: Seconds after which the search must stop immediately, or
+        None for no limit.
+        :param stop_event: A multiprocessing.Event that stops the search
+        immediately once set, or None.
+        """
+        self.begin = timer()
+        self.soft = soft
+        self.hard = hard
+        self.stop_event = stop_event
+
+    def elapsed(self):
+        """
+        Gets the time since the limits were created.
+        :return: The elapsed time in seconds.
+        """
+        return timer() - self.begin
+
+    def soft_stop(self):
+        """
+        Checks whether the search should finish rather than start another
+        iteration.
+        :return: True if the soft limit has been reached, false otherwise.
+        """
+        return self.soft is not None and self.elapsed() >= self.soft
+
+    def hard_stop(self):
+        """
+        Checks whether the search must be aborted.
+        :return: True if the hard limit has been reached or the stop event has
+        been set, false otherwise.
+        """
+        if self.stop_event is not None and self.stop_event.is_set():
+            return True
+        return self.hard is not None and self.elapsed() >= self.hard
+
+
+def get_phase(game):
+    """
+    Determines the phase of the game from the remaining non-pawn material.
+    :param game: The current position.
+    :return: A value between 0 (endgame) and PHASE_TOTAL (opening).
+    """
+    phase = 0
+    for piece, weight in PHASE_WEIGHTS.items():
+        phase += game.piece_count[piece] * weight
+
+    return min(phase, PHASE_TOTAL)
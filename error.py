@@ -10,6 +10,8 @@ FIFTY_MOVE_RULE = 5
 THREEFOLD_REPETITION = 6
 INVALID_FEN = 7
 INCORRECT_ARGS = 8
+WHITE_WINS_ON_TIME = 9
+BLACK_WINS_ON_TIME = 10
 
 ARGUMENT_LEN = 3
 
@@ -27,6 +29,76 @@ def player_type(input):
     return input
 
 
+def time_value(input):
+    """
+    Checks and returns a time control value.
+    :param input: The input number of seconds.
+    :return: The number of seconds as a float once validated.
+    """
+    try:
+        seconds = float(input)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid time, must be a number.")
+
+    if seconds < 0:
+        raise argparse.ArgumentTypeError("Invalid time, must not be negative.")
+
+    return seconds
+
+
+def positive_int(input):
+    """
+    Checks and returns a positive integer option.
+    :param input: The input number.
+    :return: The number as an int once validated.
+    """
+    try:
+        number = int(input)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid number, must be an integer.")
+
+    if number <= 0:
+        raise argparse.ArgumentTypeError("Invalid number, must be positive.")
+
+    return number
+
+
+def non_negative_int(input):
+    """
+    Checks and returns a non-negative integer option.
+    :param input: The input number.
+    :return: The number as an int once validated.
+    """
+    try:
+        number = int(input)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid number, must be an integer.")
+
+    if number < 0:
+        raise argparse.ArgumentTypeError("Invalid number, must not be "
+                                         "negative.")
+
+    return number
+
+
+def chess960_number(input):
+    """
+    Checks and returns the number of a Chess960 start position.
+    :param input: The input number.
+    :return: The number as an int once validated.
+    """
+    try:
+        number = int(input)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid number, must be an integer.")
+
+    if not 0 <= number <= 959:
+        raise argparse.ArgumentTypeError("Invalid number, must be between 0 "
+                                         "and 959.")
+
+    return number
+
+
 def check_args(input):
     """
     Check the command line arguments.
@@ -62,6 +134,10 @@ def game_over(status):
         print("Draw by 50-move rule")
     elif status == THREEFOLD_REPETITION:
         print("Draw by threefold repetition")
+    elif status == WHITE_WINS_ON_TIME:
+        print("Black ran out of time, white wins")
+    elif status == BLACK_WINS_ON_TIME:
+        print("White ran out of time, black wins")
     elif status == INVALID_FEN:
         print("Error: Invalid FEN string", file=sys.stderr)
     elif status == INCORRECT_ARGS:
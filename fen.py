@@ -5,16 +5,19 @@ import error
 SPACE_SPLIT_NUM = 6
 SLASH_SPLIT_NUM = 8
 
-CASTLING_OPTIONS = {
-    'KQkq': [True, True, True, True], 'KQk': [True, True, True, False],
-    'KQq': [True, True, False, True], 'Kkq': [True, False, True, True],
-    'Qkq': [False, True, True, True], 'Kk': [True, False, True, False],
-    'Kq': [True, False, False, True], 'Qk': [False, True, True, False],
-    'Qq': [False, True, False, True], 'KQ': [True, True, False, False],
-    'kq': [False, False, True, True], 'K': [True, False, False, False],
-    'k': [False, False, True, False], 'Q': [False, True, False, False],
-    'q': [False, False, False, True], '-': [False, False, False, False]
-}
+# The characters of the castling part of a Shredder-FEN or X-FEN string
+CASTLING_CHARS = 'KQkqABCDEFGHabcdefgh'
+
+# The places of the two knights of a Chess960 start position among the five
+# squares left empty by the bishops and queen
+CHESS960_KNIGHTS = [
+    (0, 1), (0, 2), (0, 3), (0, 4), (1, 2), (1, 3), (1, 4), (2, 3), (2, 4),
+    (3, 4)
+]
+
+# The number of the standard start position among the Chess960 positions
+CHESS960_STANDARD = 518
+CHESS960_POSITIONS = 960
 
 
 def check_fen(line, white, black):
@@ -206,50 +209,83 @@ def check_en_passant(board_lines, en_passant):
 def check_castling(board_lines, castling):
     """
     Checks that the castling part of the FEN string is correctly formatted and
-    that the board position allows for the indicated castling(s). Does not take
-    into account whether the king and/or rook(s) have previously moved.
+    that the board position allows for the indicated castling(s). Accepts
+    standard KQkq privileges as well as Shredder-FEN and X-FEN file letters
+    for Chess960. Does not take into account whether the king and/or rook(s)
+    have previously moved.
     :param board_lines: The list of strings representing each rank.
     :param castling: The castling string
     :return: Appropriate error code if an error occurs, 0 otherwise
     """
-    # Check that the castling option is a valid string
-    if castling not in CASTLING_OPTIONS:
-        return error.INVALID_FEN
+    if castling == '-':
+        return error.NORMAL
 
-    # Find x coordinates of the kings
-    count1, count2 = 0, 0
-    for item in board_lines[7]:
-        if item == 'K':
-            break
-        if item.isdigit():
-            count1 += int(item)
+    sides = set()
+    for char in castling:
+        if char not in CASTLING_CHARS:
+            return error.INVALID_FEN
+        if char.isupper():
+            rank, king, rook, offset = expand_rank(board_lines[7]), 'K', 'R', 0
         else:
-            count1 += 1
-    for item in board_lines[0]:
-        if item == 'k':
-            break
+            rank, king, rook, offset = expand_rank(board_lines[0]), 'k', 'r', 2
+
+        # The king must be on its back rank, between the corners
+        if king not in rank or rank.index(king) in (0, 7):
+            return error.INVALID_FEN
+        king_x = rank.index(king)
+
+        # The rook must be on the back rank on the side of the privilege
+        rook_x = find_castling_rook(rank, rook, king_x, char.upper())
+        if rook_x is None or rank[rook_x] != rook:
+            return error.INVALID_FEN
+
+        # Each side has at most one privilege
+        side = offset + (0 if rook_x > king_x else 1)
+        if side in sides:
+            return error.INVALID_FEN
+        sides.add(side)
+
+    return error.NORMAL
+
+
+def expand_rank(rank):
+    """
+    Expands the string of a rank of a FEN string. Assumes that the rank is
+    formatted correctly.
+    :param rank: The string representing the rank.
+    :return: A list of the 8 items of the rank, ' ' for an empty square.
+    """
+    items = []
+    for item in rank:
         if item.isdigit():
-            count2 += int(item)
+            items.extend([' '] * int(item))
         else:
-            count2 += 1
+            items.append(item)
+    return items
 
-    i = 0
-    while i < len(castling):
-        if castling[i] == 'K':
-            if count1 != 4 or board_lines[7][-1] != 'R':
-                return error.INVALID_FEN
-        elif castling[i] == 'Q':
-            if count1 != 4 or board_lines[7][0] != 'R':
-                return error.INVALID_FEN
-        elif castling[i] == 'k':
-            if count2 != 4 or board_lines[0][-1] != 'r':
-                return error.INVALID_FEN
-        elif castling[i] == 'q':
-            if count2 != 4 or board_lines[0][0] != 'r':
-                return error.INVALID_FEN
-        i += 1
 
-    return error.NORMAL
+def find_castling_rook(rank, rook, king_x, char):
+    """
+    Finds the file of the rook of a castling privilege. K and Q stand for the
+    outermost rook on the king and queen side, and a file letter for the rook
+    on that file.
+    :param rank: The list of the items of the back rank.
+    :param rook: The rook character.
+    :param king_x: The file of the king.
+    :param char: The upper case character of the privilege.
+    :return: The file of the rook, or None if there is no such rook.
+    """
+    if char == 'K':
+        files = range(7, king_x, -1)
+    elif char == 'Q':
+        files = range(0, king_x)
+    else:
+        return board.files[char.lower()]
+
+    for x in files:
+        if rank[x] == rook:
+            return x
+    return None
 
 
 def check_moves(halfmoves, fullmoves):
@@ -322,6 +358,67 @@ def get_turn(char):
         return board.BLACK
 
 
+def get_castling(string, pos):
+    """
+    Determines the castling privileges and the files of the castling rooks.
+    Assumes that the string is in the correct format.
+    :param string: The castling string, standard, Shredder-FEN or X-FEN.
+    :param pos: The list of lists representing the board position.
+    :return: A tuple (castling, rooks) of the list of the four castling
+    privileges and the list of the files of their rooks.
+    """
+    castling = [False, False, False, False]
+    rooks = board.STANDARD_CASTLING_ROOKS[:]
+    for char in string.replace('-', ''):
+        if char.isupper():
+            y, king, rook, offset = 7, 'K', 'R', 0
+        else:
+            y, king, rook, offset = 0, 'k', 'r', 2
+        king_x = board.STANDARD_KING_FILE
+        if king in pos[y]:
+            king_x = pos[y].index(king)
+        rook_x = find_castling_rook(pos[y], rook, king_x, char.upper())
+        if rook_x is None:
+            continue
+        side = offset + (0 if rook_x > king_x else 1)
+        castling[side] = True
+        rooks[side] = rook_x
+
+    return castling, rooks
+
+
+def get_chess960_fen(number):
+    """
+    Gets the FEN of a Chess960 start position by its Scharnagl number. Number
+    518 is the standard start position.
+    :param number: The number of the start position, from 0 to 959.
+    :return: The FEN string.
+    """
+    rank = [None] * 8
+
+    # The bishops go on squares of opposite colours
+    number, light = divmod(number, 4)
+    rank[2 * light + 1] = 'B'
+    number, dark = divmod(number, 4)
+    rank[2 * dark] = 'B'
+
+    # The queen and knights go on the empty squares
+    number, queen = divmod(number, 6)
+    empty = [x for x in range(8) if rank[x] is None]
+    rank[empty[queen]] = 'Q'
+    empty = [x for x in range(8) if rank[x] is None]
+    for i in CHESS960_KNIGHTS[number]:
+        rank[empty[i]] = 'N'
+
+    # The king goes between the rooks
+    for x, piece in zip([x for x in range(8) if rank[x] is None], 'RKR'):
+        rank[x] = piece
+
+    white = ''.join(rank)
+    return '%s/pppppppp/8/8/8/8/PPPPPPPP/%s w KQkq - 0 1' % (white.lower(),
+                                                            white)
+
+
 def get_en_passant(string):
     """
     Determines the coordinates of the en passant square. Assumes that the string
@@ -338,16 +435,50 @@ def get_en_passant(string):
     return x, y
 
 
-def get_fen(pos, turn, castling, en_passant, halfmove, fullmove):
+def get_castling_char(pos, side, castling_rooks):
+    """
+    Gets the X-FEN character of a castling privilege.
+    :param pos: The list of lists representing the board state.
+    :param side: The index of the castling privilege.
+    :param castling_rooks: The files of the rooks of the castling privileges,
+    or None for the standard files.
+    :return: K, Q, k or q, or the file of the rook if another rook stands
+    further out on the same side.
+    """
+    char = 'KQkq'[side]
+    if castling_rooks is None:
+        return char
+
+    rook_x = castling_rooks[side]
+    y = board.CASTLING_RANKS[side]
+    rook = 'R' if side < 2 else 'r'
+    if side % 2 == 0:
+        outer = range(rook_x + 1, 8)
+    else:
+        outer = range(0, rook_x)
+    for x in outer:
+        if pos[y][x] == rook:
+            if side < 2:
+                return board.inv_files[rook_x].upper()
+            return board.inv_files[rook_x]
+    return char
+
+
+def get_fen(pos, turn, castling, en_passant, halfmove, fullmove,
+            castling_rooks=None):
     """
     Get the FEN of the current board position. Assumes that the board is in a
     valid state and that the board and other given parameters are consistent.
+    Castling privileges are written in X-FEN, which is standard FEN unless a
+    castling rook is not the outermost rook on its side of the king.
     :param pos: The list of lists representing the board state.
     :param turn: The player whose turn it is.
     :param castling: The castling privileges.
     :param en_passant: The en passant square.
     :param halfmove: The number of halfmoves.
     :param fullmove: The number of fullmoves.
+    :param castling_rooks: The files of the rooks of the castling privileges,
+    or None for the standard files.
     :return: The FEN string.
     """
     fen = ''
@@ -381,14 +512,8 @@ def get_fen(pos, turn, castling, en_passant, halfmove, fullmove):
     # Add the castling
     i = 0
     for value in castling:
-        if i == 0 and value:
-            fen = ''.join((fen, 'K'))
-        if i == 1 and value:
-            fen = ''.join((fen, 'Q'))
-        if i == 2 and value:
-            fen = ''.join((fen, 'k'))
-        if i == 3 and value:
-            fen = ''.join((fen, 'q'))
+        if value:
+            fen = ''.join((fen, get_castling_char(pos, i, castling_rooks)))
         i += 1
     count = 0
     for item in castling:
@@ -0,0 +1,151 @@
+"""
+Opt-in instrumentation of the hot paths. Once enabled, each instrumented
+function counts its calls and the cumulative time spent in it, including the
+time of nested calls. The functions are wrapped only while instrumentation is
+enabled, so there is no cost at all when it is disabled.
+
+Counts are kept per process: worker processes of a parallel search are not
+included in the report of the main process.
+"""
+
+import functools
+import json
+from timeit import default_timer as timer
+
+import ai
+import board
+import fen
+import pawns
+import pgn
+
+# The instrumented functions as (owner, attribute name, report name)
+TARGETS = [
+    (board.Position, 'get_legal_moves', 'Position.get_legal_moves'),
+    (board.Position, 'is_attacked', 'Position.is_attacked'),
+    (board.Position, 'get_attack_map', 'Position.get_attack_map'),
+    (board.Position, 'make_check_and_add_move',
+     'Position.make_check_and_add_move'),
+    (board.Position, 'make_move', 'Position.make_move'),
+    (fen, 'get_fen', 'fen.get_fen'),
+    (pgn, 'update_pgn', 'pgn.update_pgn'),
+    (ai, 'raw_material', 'ai.raw_material'),
+    (ai, 'evaluate_pos', 'ai.evaluate_pos'),
+    (ai, 'evaluate', 'ai.evaluate'),
+    (pawns, 'evaluate_structure', 'pawns.evaluate_structure')
+]
+
+# The call count and cumulative seconds of each instrumented function
+counters = {}
+
+# The original functions while instrumentation is enabled
+originals = {}
+
+
+def wrap(function, name):
+    """
+    Wraps a function to count its calls and time.
+    :param function: The function to wrap.
+    :param name: The report name of the function.
+    :return: The wrapped function.
+    """
+    counter = counters.setdefault(name, [0, 0.0])
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        begin = timer()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            counter[0] += 1
+            counter[1] += timer() - begin
+
+    return wrapper
+
+
+def enable():
+    """
+    Starts instrumenting the hot paths. Does nothing if already enabled.
+    :return: Nothing.
+    """
+    for owner, attribute, name in TARGETS:
+        if name in originals:
+            continue
+        function = getattr(owner, attribute)
+        originals[name] = function
+        setattr(owner, attribute, wrap(function, name))
+
+
+def disable():
+    """
+    Stops instrumenting the hot paths and restores the original functions.
+    The counts are kept until reset.
+    :return: Nothing.
+    """
+    for owner, attribute, name in TARGETS:
+        if name in originals:
+            setattr(owner, attribute, originals.pop(name))
+
+
+def is_enabled():
+    """
+    Checks whether instrumentation is enabled.
+    :return: True if enabled, false otherwise.
+    """
+    return bool(originals)
+
+
+def reset():
+    """
+    Sets all the counts back to zero.
+    :return: Nothing.
+    """
+    for counter in counters.values():
+        counter[0] = 0
+        counter[1] = 0.0
+
+
+def get_report():
+    """
+    Gets the counts of the instrumented functions.
+    :return: A dictionary from the report name of each function that has been
+    called to a dictionary of its calls, total seconds and mean seconds per
+    call, ordered by total time.
+    """
+    report = {}
+    for name, (calls, total) in sorted(counters.items(),
+                                       key=lambda item: -item[1][1]):
+        if calls:
+            report[name] = {
+                'calls': calls, 'total': total, 'mean': total / calls
+            }
+    return report
+
+
+def format_report(report=None):
+    """
+    Formats the counts as a text table.
+    :param report: A report from get_report, or None for the current counts.
+    :return: The table as a string.
+    """
+    if report is None:
+        report = get_report()
+
+    lines = ['{:<36}{:>12}{:>14}{:>14}'.format('Function', 'Calls',
+                                               'Total (s)', 'Mean (us)')]
+    for name, entry in report.items():
+        lines.append('{:<36}{:>12}{:>14.4f}{:>14.2f}'.format(
+            name, entry['calls'], entry['total'], entry['mean'] * 1e6))
+    return '\n'.join(lines)
+
+
+def write_json(path, report=None):
+    """
+    Writes the counts to a JSON file.
+    :param path: The path of the file to write.
+    :param report: A report from get_report, or None for the current counts.
+    :return: Nothing.
+    """
+    if report is None:
+        report = get_report()
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
@@ -7,57 +7,108 @@ Created November 2018.
 @author: S. Kwan
 
 @TODO:
-    Add Chess960 option
     Add AI
     Add PGN
     Add GUI
     Check if faster to pass class to function or attributes individually
 """
 
-import copy
 import random
 import sys
 import argparse
+import concurrent.futures
 from timeit import default_timer as timer
 
+import ai
 import board
+import book
+import clock
 import error
 import fen
+import instrument
 import pgn
+import smp
+import store
+import tablebase
 
 
-def run_game(game, black, white):
+def run_game(
+    game,
+    black,
+    white,
+    game_clock=None,
+    workers=1,
+    opening_book=None,
+    tablebases=None,
+    hashes=None,
+    mcts=False,
+    executor=None,
+):
     """
     The main entry point of the program.
+    :param game_clock: The clock.Clock of a timed game, or None for an untimed
+    game. Computer players search for their moves in timed games and play
+    random moves otherwise.
+    :param workers: The number of processes computer players search with.
+    :param opening_book: The book.Book computer players take their moves from
+    while the position is in the book, or None.
+    :param tablebases: The tablebase.Tablebases computer players probe while
+    searching, or None.
+    :param hashes: A list the hash of every position of the game is appended
+    to, or None.
+    :param mcts: True for computer players to search with Monte Carlo tree
+    search rather than alpha-beta.
+    :param executor: The concurrent.futures.ProcessPoolExecutor computer
+    players run their Monte Carlo playouts in for the whole game, or None.
     :return: The exit status of the game upon completion.
     """
 
-    moves = []
-    # print(ai.minimax(game, 2, True, moves))
     game.display((0, 0), (0, 0))
+    if hashes is not None:
+        hashes.append(game.hash)
     while True:
         # Check end of game
-        status = game.is_end_of_game(moves)
+        status = game.is_end_of_game()
         if status:
             pgn.add_results(game, status)
             return status
 
-        # Check and record board positions
-        found = False
-        for pos, count in moves:
-            if pos == game:
-                found = True
-                new_count = count + 1
-                moves[moves.index((pos, count))] = (pos, new_count)
-        if not found:
-            moves.append((copy.deepcopy(game), 1))
-
         # Process player turns
+        if game_clock is not None:
+            game_clock.start(game.turn)
         legal_moves = game.get_legal_moves()
+        promotion = None
+        book_move = None
         if (game.turn and white == "c") or (not game.turn and black == "c"):
             # Computer turn
-            random_move = legal_moves[random.randint(0, len(legal_moves) - 1)]
-            start, end = random_move
+            if opening_book is not None:
+                book_move = opening_book.choose(game)
+            if book_move is not None:
+                (start, end), promotion = book_move
+            elif game_clock is not None and mcts:
+                start, end = ai.monte_carlo_search(
+                    game,
+                    game_clock.allocate(game),
+                    executor=executor,
+                    workers=workers,
+                )
+            elif game_clock is not None and workers > 1:
+                tablebase_path = None
+                if tablebases is not None:
+                    tablebase_path = tablebases.directory
+                start, end = smp.parallel_search(
+                    game,
+                    game_clock.allocate(game),
+                    workers=workers,
+                    tablebase_path=tablebase_path,
+                )[0]
+            elif game_clock is not None:
+                start, end = ai.search(
+                    game, game_clock.allocate(game), tablebases=tablebases
+                )
+            else:
+                random_move = legal_moves[random.randint(0, len(legal_moves) - 1)]
+                start, end = random_move
             x1, y1 = start
             x2, y2 = end
         else:
@@ -87,10 +138,21 @@ def run_game(game, black, white):
         else:
             ep = False
 
+        # Check the player did not run out of time
+        if game_clock is not None and game_clock.stop():
+            if game.turn:
+                status = error.BLACK_WINS_ON_TIME
+            else:
+                status = error.WHITE_WINS_ON_TIME
+            pgn.add_results(game, status)
+            return status
+
         pgn.update_pgn(game, (x1, y1), (x2, y2))
-        game.make_move((x1, y1), (x2, y2), ep)
+        game.make_move((x1, y1), (x2, y2), ep, promotion)
         pgn.add_check(game)
         game.display((x1, y1), (x2, y2))
+        if hashes is not None:
+            hashes.append(game.hash)
 
 
 def main():
@@ -116,27 +178,175 @@ def main():
         "be a human player.",
     )
 
+    parser.add_argument(
+        "--chess960",
+        type=error.chess960_number,
+        nargs="?",
+        const=-1,
+        default=None,
+        help="Play Chess960 from the start position of the given number "
+        "between 0 and 959, or from a random start position if no number is "
+        "given.",
+    )
+
+    parser.add_argument(
+        "--time",
+        type=error.time_value,
+        default=None,
+        help="The starting time of each player in seconds. Computer players "
+        "search for their moves when a time is given and play random moves "
+        "otherwise.",
+    )
+
+    parser.add_argument(
+        "--increment",
+        type=error.time_value,
+        default=0,
+        help="The time in seconds added to a player's clock after each of "
+        "their moves.",
+    )
+
+    parser.add_argument(
+        "--workers",
+        type=error.positive_int,
+        default=1,
+        help="The number of processes computer players search with in timed "
+        "games.",
+    )
+
+    parser.add_argument(
+        "--mcts",
+        action="store_true",
+        help="Computer players search with Monte Carlo tree search rather "
+        "than alpha-beta in timed games, running their playouts in the "
+        "processes given by --workers.",
+    )
+
+    parser.add_argument(
+        "--book",
+        default=None,
+        help="The path of an opening book built by book.py for computer "
+        "players to take their opening moves from.",
+    )
+
+    parser.add_argument(
+        "--tablebases",
+        default=None,
+        help="The directory of the endgame tables built by tablebase.py for "
+        "computer players to probe while searching.",
+    )
+
+    parser.add_argument(
+        "--weights",
+        default=None,
+        help="The path of the piece values exported by tune.py for computer "
+        "players to evaluate with.",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Count the calls and time of the hot paths, print a report at the "
+        "end of the game and write it as JSON to the --profile-output path.",
+    )
+
+    parser.add_argument(
+        "--profile-output",
+        default="profile.json",
+        help="The path to write the JSON report of --profile to.",
+    )
+
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="The path of an SQLite database to save the finished game to.",
+    )
+
     args = parser.parse_args()
 
     white = args.white
     black = args.black
 
+    # Pick the start position
+    start_fen = board.standard_start
+    chess960 = args.chess960 is not None
+    if args.chess960 == -1:
+        start_fen = fen.get_chess960_fen(
+            random.randrange(fen.CHESS960_POSITIONS))
+    elif chess960:
+        start_fen = fen.get_chess960_fen(args.chess960)
+
     # Check the fen string
-    error_code = fen.check_fen(board.standard_start, white, black)
+    error_code = fen.check_fen(start_fen, white, black)
     if error_code:
         error.exit_game(error_code)
 
     # Prep the game
-    game = board.Position(board.standard_start, white, black)
+    game = board.Position(start_fen, white, black, chess960)
+
+    # Set up the clocks
+    game_clock = None
+    if args.time is not None:
+        game_clock = clock.Clock(args.time, args.increment)
+
+    opening_book = None
+    if args.book is not None:
+        opening_book = book.Book(args.book)
+
+    tablebases = None
+    if args.tablebases is not None:
+        tablebases = tablebase.Tablebases(args.tablebases)
+
+    if args.weights is not None:
+        ai.load_weights(args.weights)
+
+    if args.profile:
+        instrument.enable()
+
+    # Monte Carlo playouts run in one pool of processes for the whole game
+    executor = None
+    if args.mcts and args.workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(args.workers)
 
     # Play the game
+    hashes = []
     begin = timer()
-    error_code = run_game(game, black, white)
+    try:
+        error_code = run_game(
+            game,
+            black,
+            white,
+            game_clock,
+            args.workers,
+            opening_book,
+            tablebases,
+            hashes,
+            args.mcts,
+            executor,
+        )
+    finally:
+        # Unmap the book and the tables and stop the playout processes once
+        # the game is over
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if opening_book is not None:
+            opening_book.close()
+        if tablebases is not None:
+            tablebases.close()
     finish = timer()
 
+    if args.store is not None:
+        game_store = store.GameStore(args.store)
+        game_store.add_played_game(game, error_code, hashes)
+        game_store.close()
+
     # Print the pgn and time taken to run then exit
     print("\nTime taken: ", finish - begin, "\n\n")
     print(game.pgn)
+    if args.profile:
+        instrument.disable()
+        print("\n" + instrument.format_report() + "\n")
+        instrument.write_json(args.profile_output)
     error.exit_game(error_code)
 
 
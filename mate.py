@@ -0,0 +1,508 @@
+"""
+Mate-in-N solver for composed problems and tactics puzzles. The attacker is
+the player to move and must mate in at most N of their own moves against any
+defence.
+
+The depth-first solver deepens one move at a time so that the shortest mate
+is found. At attacker nodes only checking moves are searched, unless quiet
+moves are allowed for problems with a quiet key, and at defender nodes the
+search stops at the first defence that refutes the attacking move. Results
+are kept in a transposition table of the smallest number of moves each
+position is known to mate in and the largest it is known not to. The table
+is keyed by the position alone, so a result is only stored or reused when no
+draw by repetition or the fifty-move rule, which depend on the moves played
+to reach the position, could have changed it.
+
+For long mates the proof-number search grows a tree towards the positions
+that are cheapest to prove or disprove, keeping the tree in parallel arrays
+and replaying moves from the root rather than storing positions.
+"""
+
+import argparse
+import array
+from timeit import default_timer as timer
+
+import ai
+import board
+import cache
+import error
+import fen
+import perft
+
+# Default number of entries in the transposition table of the solver
+DEFAULT_ENTRIES = 1 << 18
+
+# Default number of nodes the proof-number search may grow
+DEFAULT_MAX_NODES = 1 << 18
+
+# Proof and disproof numbers of a solved node
+INFINITE = 1 << 30
+
+# The results of a proof-number search
+PROVEN = 1
+DISPROVEN = 0
+UNKNOWN = -1
+
+# Stands for no known mate in the transposition table
+NO_MATE = 1 << 10
+
+# A position can only be drawn by threefold repetition once this many
+# reversible plies have been played, as it must have occurred twice before
+# with the same player to move
+REPETITION_PLIES = 8
+
+
+def make_move(game, move, promotion):
+    """
+    Makes a move on a copy of the position without building its FEN.
+    :param game: The position to make the move from.
+    :param move: The move.
+    :param promotion: The piece to promote to, or None.
+    :return: The position after the move.
+    """
+    start, end = move
+    child = game.copy()
+    child.make_move(start, end, game.is_en_passant(start, end), promotion,
+                    update_fen=False)
+    return child
+
+
+def gives_check(child):
+    """
+    Checks whether the move into a position gave check.
+    :param child: The position after the move.
+    :return: True if the player to move is in check, false otherwise.
+    """
+    return child.is_attacked(child.get_king_coordinates())
+
+
+def get_moves(game):
+    """
+    Gets the legal moves of a position with each promotion piece, best guess
+    first.
+    :param game: The position.
+    :return: A list of tuples (move, promotion).
+    """
+    moves = ai.order_moves(game, game.get_legal_moves())
+    return [(move, promotion) for move in moves
+            for promotion in perft.get_promotions(game, move)]
+
+
+class MateSolver:
+    def __init__(self, checks_only=True, entries=DEFAULT_ENTRIES):
+        """
+        Initialise the solver.
+        :param checks_only: True to search only checking moves for the
+        attacker, false to search quiet moves too.
+        :param entries: The number of entries in the transposition table.
+        """
+        self.checks_only = checks_only
+        self.table = cache.Cache(entries)
+        self.nodes = 0
+        self.history_draws = 0
+
+    def get_attacks(self, game, n):
+        """
+        Gets the attacking moves worth searching in a position.
+        :param game: The position, attacker to move.
+        :param n: The number of attacker moves left.
+        :return: A list of tuples (move, promotion, child) of each move, the
+        piece it promotes to or None and the position after it.
+        """
+        attacks = []
+        for move, promotion in get_moves(game):
+            child = make_move(game, move, promotion)
+            if (n == 1 or self.checks_only) and not gives_check(child):
+                continue
+            attacks.append((move, promotion, child))
+        return attacks
+
+    def probe(self, game, n):
+        """
+        Looks up whether a position is known to mate in n moves.
+        :param game: The position, attacker to move.
+        :param n: The number of attacker moves.
+        :return: The stored mating move (move, promotion) if the position is
+        known to mate, False if it is known not to, or None if unknown.
+        """
+        entry = self.table.probe(game.hash)
+        if entry is None:
+            return None
+        mate_in, no_mate_in, move = entry
+
+        # A mate found along other moves may run into a repetition of the
+        # positions before this one
+        if (mate_in <= n and
+                game.halfmove + 2 * mate_in - 1 < REPETITION_PLIES):
+            return move
+        if no_mate_in >= n:
+            return False
+        return None
+
+    def store(self, game, n, move):
+        """
+        Records whether a position mates in n moves.
+        :param game: The position, attacker to move.
+        :param n: The number of attacker moves.
+        :param move: The mating move (move, promotion), or None if there is no
+        mate in n moves.
+        :return: Nothing.
+        """
+        entry = self.table.probe(game.hash)
+        if entry is None:
+            entry = (NO_MATE, 0, None)
+        mate_in, no_mate_in, best = entry
+        if move is not None and n < mate_in:
+            mate_in, best = n, move
+        elif move is None:
+            no_mate_in = max(no_mate_in, n)
+        self.table.store(game.hash, (mate_in, no_mate_in, best))
+
+    def attack(self, game, n):
+        """
+        Searches for a mate in n moves.
+        :param game: The position, attacker to move.
+        :param n: The number of attacker moves.
+        :return: The mating move (move, promotion), or None if there is no
+        mate in n moves.
+        """
+        self.nodes += 1
+        known = self.probe(game, n)
+        if known is not None:
+            return known or None
+
+        history_draws = self.history_draws
+        for move, promotion, child in self.get_attacks(game, n):
+            if self.defend(child, n):
+                self.store(game, n, (move, promotion))
+                return move, promotion
+
+        # A defence that drew by repetition or the fifty-move rule may not
+        # hold when the position is reached by other moves
+        if self.history_draws == history_draws:
+            self.store(game, n, None)
+        return None
+
+    def defend(self, game, n):
+        """
+        Checks whether every defence loses after an attacking move.
+        :param game: The position after the attacking move, defender to move.
+        :param n: The number of attacker moves including the one made.
+        :return: True if the defender is mated within n attacker moves, false
+        if a defence holds.
+        """
+        self.nodes += 1
+        status = game.is_end_of_game()
+        if status in (error.WHITE_WINS, error.BLACK_WINS):
+            return True
+        if status in (error.THREEFOLD_REPETITION, error.FIFTY_MOVE_RULE):
+            self.history_draws += 1
+        if status or n == 1:
+            return False
+
+        # The first defence that holds refutes the attacking move
+        for move, promotion in get_moves(game):
+            if self.attack(make_move(game, move, promotion), n - 1) is None:
+                return False
+        return True
+
+    def solve(self, game, n):
+        """
+        Finds the shortest mate of at most n moves.
+        :param game: The position, attacker to move.
+        :param n: The greatest number of attacker moves.
+        :return: A tuple (moves, line) of the number of moves of the mate and
+        its main line as a list of (move, promotion), or (None, []) if there
+        is no mate in n moves.
+        """
+        for depth in range(1, n + 1):
+            if self.attack(game, depth) is not None:
+                return depth, self.get_line(game, depth)
+        return None, []
+
+    def get_line(self, game, n):
+        """
+        Follows a proven mate through the transposition table, answering each
+        attacking move with the first defence.
+        :param game: The position, attacker to move, known to mate in n moves.
+        :param n: The number of attacker moves.
+        :return: The main line as a list of (move, promotion).
+        """
+        line = []
+        while n > 0:
+            attacking = self.attack(game, n)
+            if attacking is None:
+                break
+            line.append(attacking)
+            game = make_move(game, *attacking)
+            defences = get_moves(game)
+            if not defences:
+                break
+            line.append(defences[0])
+            game = make_move(game, *defences[0])
+            n -= 1
+        return line
+
+    def proof_number_search(self, game, n, max_nodes=DEFAULT_MAX_NODES):
+        """
+        Searches for a mate in n moves by proof-number search. Attacker nodes
+        are proven when any child is proven and defender nodes when every
+        child is.
+        :param game: The position, attacker to move.
+        :param n: The number of attacker moves.
+        :param max_nodes: The greatest number of nodes to grow.
+        :return: A tuple (result, line) of PROVEN, DISPROVEN or UNKNOWN if the
+        node limit was reached, and the main line of a proven mate as a list of
+        (move, promotion).
+        """
+        tree = ProofTree()
+        tree.add(-1, 0, n, True)
+        while tree.proofs[0] and tree.disproofs[0] and \
+                len(tree) < max_nodes:
+            index, node = tree.select(game)
+            self.expand(tree, index, node)
+            tree.update(index)
+        self.nodes += len(tree)
+
+        if tree.proofs[0] == 0:
+            return PROVEN, tree.get_line()
+        if tree.disproofs[0] == 0:
+            return DISPROVEN, []
+        return UNKNOWN, []
+
+    def expand(self, tree, index, node):
+        """
+        Adds the children of a leaf of the proof tree, setting the proof and
+        disproof numbers of those already decided.
+        :param tree: The ProofTree.
+        :param index: The number of the leaf.
+        :param node: The position of the leaf.
+        :return: Nothing.
+        """
+        n = tree.depths[index]
+        if tree.attacker[index]:
+            for move, promotion, child in self.get_attacks(node, n):
+                child_index = tree.add(index, board.encode_move(move,
+                                                                promotion),
+                                       n, False)
+                status = child.is_end_of_game()
+                if status in (error.WHITE_WINS, error.BLACK_WINS):
+                    tree.set_proven(child_index)
+                elif status or n == 1:
+                    tree.set_disproven(child_index)
+        else:
+            for move, promotion in get_moves(node):
+                child = make_move(node, move, promotion)
+                child_index = tree.add(index, board.encode_move(move,
+                                                                promotion),
+                                       n - 1, True)
+                known = self.probe(child, n - 1)
+                if child.is_end_of_game() or known is False:
+                    tree.set_disproven(child_index)
+                elif known:
+                    tree.set_proven(child_index)
+        tree.expanded[index] = 1
+
+
+class ProofTree:
+    def __init__(self):
+        """
+        Initialise an empty proof tree. The nodes are numbered and their
+        fields are held in parallel arrays indexed by node number, the
+        children of a node being numbered consecutively from first_children.
+        """
+        self.parents = array.array('i')
+        self.moves = array.array('H')
+        self.depths = array.array('H')
+        self.attacker = array.array('B')
+        self.expanded = array.array('B')
+        self.first_children = array.array('i')
+        self.child_counts = array.array('H')
+        self.proofs = array.array('l')
+        self.disproofs = array.array('l')
+
+    def __len__(self):
+        return len(self.parents)
+
+    def add(self, parent, move, depth, attacker):
+        """
+        Adds an unexpanded node with proof and disproof numbers of 1.
+        :param parent: The number of the parent node, or -1 for the root.
+        :param move: The move into the node packed by board.encode_move.
+        :param depth: The number of attacker moves left.
+        :param attacker: True if the attacker is to move in the node.
+        :return: The number of the new node.
+        """
+        index = len(self.parents)
+        if parent >= 0 and not self.child_counts[parent]:
+            self.first_children[parent] = index
+        if parent >= 0:
+            self.child_counts[parent] += 1
+        self.parents.append(parent)
+        self.moves.append(move)
+        self.depths.append(depth)
+        self.attacker.append(attacker)
+        self.expanded.append(0)
+        self.first_children.append(0)
+        self.child_counts.append(0)
+        self.proofs.append(1)
+        self.disproofs.append(1)
+        return index
+
+    def set_proven(self, index):
+        """
+        Marks a node as a mate.
+        :param index: The number of the node.
+        :return: Nothing.
+        """
+        self.proofs[index] = 0
+        self.disproofs[index] = INFINITE
+
+    def set_disproven(self, index):
+        """
+        Marks a node as holding against mate.
+        :param index: The number of the node.
+        :return: Nothing.
+        """
+        self.proofs[index] = INFINITE
+        self.disproofs[index] = 0
+
+    def get_children(self, index):
+        """
+        Gets the children of a node.
+        :param index: The number of the node.
+        :return: A range of the numbers of the children.
+        """
+        first = self.first_children[index]
+        return range(first, first + self.child_counts[index])
+
+    def select(self, game):
+        """
+        Descends from the root to the most proving leaf, following the child
+        with the smallest proof number at attacker nodes and the smallest
+        disproof number at defender nodes.
+        :param game: The root position.
+        :return: A tuple (index, node) of the number of the leaf and its
+        position.
+        """
+        index = 0
+        node = game
+        while self.expanded[index]:
+            if self.attacker[index]:
+                index = min(self.get_children(index),
+                            key=lambda child: self.proofs[child])
+            else:
+                index = min(self.get_children(index),
+                            key=lambda child: self.disproofs[child])
+            move = self.moves[index]
+            node = make_move(node, board.decode_move(move),
+                             board.decode_promotion(move))
+        return index, node
+
+    def update(self, index):
+        """
+        Recalculates the proof and disproof numbers from a node up to the
+        root.
+        :param index: The number of the node.
+        :return: Nothing.
+        """
+        while index >= 0:
+            children = self.get_children(index)
+            proofs = [self.proofs[child] for child in children]
+            disproofs = [self.disproofs[child] for child in children]
+            if not children:
+                # No attacking move, or no defence after a non-mating move,
+                # which only a stalemate or draw can give
+                self.set_disproven(index)
+            elif self.attacker[index]:
+                self.proofs[index] = min(proofs)
+                self.disproofs[index] = min(sum(disproofs), INFINITE)
+            else:
+                self.proofs[index] = min(sum(proofs), INFINITE)
+                self.disproofs[index] = min(disproofs)
+            index = self.parents[index]
+
+    def get_line(self):
+        """
+        Follows a proven mate from the root, taking a proven attacking move at
+        attacker nodes and the defence with the largest subtree at defender
+        nodes.
+        :return: The main line as a list of (move, promotion).
+        """
+        line = []
+        index = 0
+        while self.child_counts[index]:
+            children = self.get_children(index)
+            if self.attacker[index]:
+                index = next(child for child in children
+                             if self.proofs[child] == 0)
+            else:
+                index = max(children, key=self.count_nodes)
+            move = self.moves[index]
+            line.append((board.decode_move(move),
+                         board.decode_promotion(move)))
+        return line
+
+    def count_nodes(self, index):
+        """
+        Counts the nodes of the subtree of a node.
+        :param index: The number of the node.
+        :return: The number of nodes.
+        """
+        count = 1
+        for child in self.get_children(index):
+            count += self.count_nodes(child)
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solves mate in N problems")
+    parser.add_argument("fen", help="The FEN string of the problem, attacker "
+                                    "to move.")
+    parser.add_argument("moves", type=error.positive_int,
+                        help="The greatest number of attacker moves.")
+    parser.add_argument("--pns", action='store_true',
+                        help="Use proof-number search, for long mates.")
+    parser.add_argument("--quiet-moves", action='store_true',
+                        help="Search quiet attacking moves as well as checks, "
+                             "for problems with a quiet key.")
+    parser.add_argument("--max-nodes", type=error.positive_int,
+                        default=DEFAULT_MAX_NODES,
+                        help="The greatest number of nodes the proof-number "
+                             "search may grow.")
+    parser.add_argument("--chess960", action='store_true',
+                        help="Solve the position as a Chess960 position.")
+    args = parser.parse_args()
+
+    error_code = fen.check_fen(args.fen, 'c', 'c')
+    if error_code:
+        error.exit_game(error_code)
+
+    game = board.Position(args.fen, 'c', 'c', args.chess960)
+    solver = MateSolver(not args.quiet_moves)
+    begin = timer()
+    if args.pns:
+        result, line = solver.proof_number_search(game, args.moves,
+                                                  args.max_nodes)
+        if result == UNKNOWN:
+            print("Unknown: the node limit was reached")
+        elif result == DISPROVEN:
+            print("No mate in", args.moves)
+        else:
+            print("Mate in", (len(line) + 1) // 2)
+    else:
+        moves, line = solver.solve(game, args.moves)
+        if moves is None:
+            print("No mate in", args.moves)
+        else:
+            print("Mate in", moves)
+
+    if line:
+        print(' '.join(perft.move_to_string(move, promotion)
+                       for move, promotion in line))
+    print("Nodes: ", solver.nodes)
+    print("Time taken: ", timer() - begin)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Material signatures. The counts of the pieces other than the kings are packed
+into an integer key, 4 bits per piece type, which Position keeps up to date as
+pieces are captured and promoted. Each key indexes an entry of a table giving
+the number of pieces, whether the material is a draw, the kind of known
+endgame it is and a material imbalance score for the evaluation.
+
+The table is filled for every signature of up to PRECOMPUTED_PIECES pieces
+besides the kings when the module is loaded, and for any other signature the
+first time it is probed. Recognizers of further endgames are added to
+RECOGNIZERS, after which build() refills the table.
+"""
+
+import collections
+
+# The piece count keys of Position.piece_count in the order of their fields
+FIELDS = ['P', 'N', 'lB', 'dB', 'R', 'Q', 'p', 'n', 'lb', 'db', 'r', 'q']
+
+FIELD_BITS = 4
+FIELD_MASK = (1 << FIELD_BITS) - 1
+
+# The amount each piece adds to the key. The kings are never captured and add
+# nothing
+WEIGHTS = {name: 1 << (FIELD_BITS * i) for i, name in enumerate(FIELDS)}
+WEIGHTS['K'] = 0
+WEIGHTS['k'] = 0
+
+# The kinds of known endgames
+DRAWN = 'drawn'
+LONE_KING = 'lone king'
+OPPOSITE_BISHOPS = 'opposite bishops'
+
+# The bonus in pawns for holding both bishops
+BISHOP_PAIR = 0.5
+
+PRECOMPUTED_PIECES = 3
+
+Entry = collections.namedtuple('Entry', ['pieces', 'draw', 'endgame',
+                                         'imbalance'])
+
+
+def get_key(piece_count):
+    """
+    Packs the piece counts of a position into a material key.
+    :param piece_count: The piece counts of the position.
+    :return: The key.
+    """
+    key = 0
+    for name in FIELDS:
+        key += piece_count[name] * WEIGHTS[name]
+    return key
+
+
+def get_counts(key):
+    """
+    Unpacks a material key.
+    :param key: The key.
+    :return: A dictionary of the count of each field.
+    """
+    return {name: (key >> (FIELD_BITS * i)) & FIELD_MASK
+            for i, name in enumerate(FIELDS)}
+
+
+def get_name(counts):
+    """
+    Names the material in the form of tablebase names, e.g. KRPvKR.
+    :param counts: The count of each field.
+    :return: The name, white first.
+    """
+    white = 'K'
+    black = 'K'
+    for piece in 'QRBNP':
+        if piece == 'B':
+            white += 'B' * (counts['lB'] + counts['dB'])
+            black += 'B' * (counts['lb'] + counts['db'])
+        else:
+            white += piece * counts[piece]
+            black += piece * counts[piece.lower()]
+    return white + 'v' + black
+
+
+def recognize_drawn(counts):
+    """
+    Recognizes a draw by insufficient material: bare kings, a lone knight, or
+    any number of bishops all on squares of the same colour.
+    :param counts: The count of each field.
+    :return: DRAWN, or None.
+    """
+    for name in ('P', 'R', 'Q', 'p', 'r', 'q'):
+        if counts[name]:
+            return None
+
+    knights = counts['N'] + counts['n']
+    light = counts['lB'] + counts['lb']
+    dark = counts['dB'] + counts['db']
+    if knights == 0 and (light == 0 or dark == 0):
+        return DRAWN
+    if knights == 1 and light + dark == 0:
+        return DRAWN
+    return None
+
+
+def recognize_lone_king(counts):
+    """
+    Recognizes a king alone against other pieces.
+    :param counts: The count of each field.
+    :return: LONE_KING, or None.
+    """
+    white = sum(counts[name] for name in FIELDS[:6])
+    black = sum(counts[name] for name in FIELDS[6:])
+    if (white == 0) != (black == 0):
+        return LONE_KING
+    return None
+
+
+def recognize_opposite_bishops(counts):
+    """
+    Recognizes a single bishop each on squares of opposite colours with only
+    pawns besides.
+    :param counts: The count of each field.
+    :return: OPPOSITE_BISHOPS, or None.
+    """
+    for name in ('N', 'R', 'Q', 'n', 'r', 'q'):
+        if counts[name]:
+            return None
+    if (counts['lB'], counts['dB'], counts['lb'], counts['db']) in \
+            ((1, 0, 0, 1), (0, 1, 1, 0)):
+        return OPPOSITE_BISHOPS
+    return None
+
+
+# The recognizers tried in order, each taking the counts and returning the
+# kind of endgame or None
+RECOGNIZERS = [recognize_drawn, recognize_lone_king, recognize_opposite_bishops]
+
+
+def classify(key):
+    """
+    Works out the entry of a material key.
+    :param key: The key.
+    :return: The Entry.
+    """
+    counts = get_counts(key)
+    endgame = None
+    for recognizer in RECOGNIZERS:
+        endgame = recognizer(counts)
+        if endgame is not None:
+            break
+
+    imbalance = 0
+    if counts['lB'] and counts['dB']:
+        imbalance += BISHOP_PAIR
+    if counts['lb'] and counts['db']:
+        imbalance -= BISHOP_PAIR
+
+    return Entry(2 + sum(counts.values()), endgame == DRAWN, endgame,
+                 imbalance)
+
+
+def get_keys(pieces, start=0):
+    """
+    Generates the keys of every signature of exactly the given number of
+    pieces besides the kings.
+    :param pieces: The number of pieces.
+    :param start: The index of the first field the pieces may be in.
+    :return: A generator of the keys.
+    """
+    if pieces == 0:
+        yield 0
+        return
+    for i in range(start, len(FIELDS)):
+        for key in get_keys(pieces - 1, i):
+            yield key + WEIGHTS[FIELDS[i]]
+
+
+def build(max_pieces=PRECOMPUTED_PIECES):
+    """
+    Empties the table and fills it for every signature of up to the given
+    number of pieces besides the kings.
+    :param max_pieces: The number of pieces.
+    :return: Nothing.
+    """
+    table.clear()
+    for pieces in range(max_pieces + 1):
+        for key in get_keys(pieces):
+            table[key] = classify(key)
+
+
+def probe(key):
+    """
+    Looks up the entry of a material key, classifying it on first use.
+    :param key: The key.
+    :return: The Entry.
+    """
+    entry = table.get(key)
+    if entry is None:
+        entry = classify(key)
+        table[key] = entry
+    return entry
+
+
+table = {}
+build()
@@ -0,0 +1,179 @@
+"""
+Compact binary encoding of positions and games. A position takes 32 bytes and
+a move 2 bytes, against 60 or more bytes of FEN text per position.
+
+A position is an occupancy bitboard of 8 bytes with bit y * 8 + x set for each
+occupied square, 16 bytes of 4 bit piece codes for the occupied squares in
+square order, 2 bytes of flags (the player to move, the castling privileges,
+the en passant file and Chess960), a byte for the halfmove clock, 2 bytes for
+the fullmove number, 2 bytes of the 3 bit files of the castling rooks and a
+byte of padding. A game is its starting position, a 2 byte move count and
+the moves packed by board.encode_move.
+"""
+
+import struct
+
+import board
+import fen
+
+POSITION = struct.Struct('>Q16sHBHH1x')
+POSITION_SIZE = POSITION.size
+MOVE = struct.Struct('>H')
+MOVE_COUNT = struct.Struct('>H')
+
+# The 4 bit code of each piece, 0 being unused
+PIECE_CODES = {
+    piece: code for code, piece in enumerate('PNBRQKpnbrqk', 1)
+}
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+
+# The flag bits
+TURN_FLAG = 1
+CASTLING_SHIFT = 1
+EN_PASSANT_FLAG = 1 << 5
+EN_PASSANT_SHIFT = 6
+CHESS960_FLAG = 1 << 9
+
+MAX_HALFMOVE = 0xFF
+MAX_FULLMOVE = 0xFFFF
+
+
+def encode_position(game):
+    """
+    Packs a position into 32 bytes. Halfmove clocks above 255 and fullmove
+    numbers above 65535 are stored as those limits.
+    :param game: The board.Position to pack.
+    :return: The packed position as bytes.
+    """
+    occupancy = 0
+    codes = []
+    for y in range(8):
+        for x in range(8):
+            item = game.pos[y][x]
+            if item != ' ':
+                occupancy |= 1 << (y * 8 + x)
+                codes.append(PIECE_CODES[item])
+    if len(codes) % 2:
+        codes.append(0)
+    nibbles = bytes((codes[i] << 4) | codes[i + 1]
+                    for i in range(0, len(codes), 2))
+
+    flags = 0
+    if game.turn:
+        flags |= TURN_FLAG
+    for i in range(4):
+        if game.castling[i]:
+            flags |= 1 << (CASTLING_SHIFT + i)
+    if game.en_passant is not None:
+        flags |= EN_PASSANT_FLAG | (game.en_passant[0] << EN_PASSANT_SHIFT)
+    if game.chess960:
+        flags |= CHESS960_FLAG
+
+    rooks = 0
+    for i in range(4):
+        rooks |= game.castling_rooks[i] << (3 * i)
+
+    return POSITION.pack(occupancy, nibbles, flags,
+                         min(game.halfmove, MAX_HALFMOVE),
+                         min(game.fullmove, MAX_FULLMOVE), rooks)
+
+
+def decode_position(data, white='c', black='c'):
+    """
+    Unpacks a position packed by encode_position.
+    :param data: The 32 bytes of the position.
+    :param white: A character representing if white is a human or computer.
+    :param black: A character representing if black is a human or computer.
+    :return: The board.Position.
+    """
+    occupancy, nibbles, flags, halfmove, fullmove, rooks = \
+        POSITION.unpack(data)
+
+    pos = [[' '] * 8 for y in range(8)]
+    count = 0
+    for square in range(64):
+        if occupancy >> square & 1:
+            code = nibbles[count // 2]
+            if count % 2:
+                code &= 0xF
+            else:
+                code >>= 4
+            pos[square // 8][square % 8] = CODE_PIECES[code]
+            count += 1
+
+    turn = flags & TURN_FLAG
+    castling = [bool(flags >> (CASTLING_SHIFT + i) & 1) for i in range(4)]
+    en_passant = None
+    if flags & EN_PASSANT_FLAG:
+        if turn:
+            y = board.BLACK_IN_BETWEEN_RANK
+        else:
+            y = board.WHITE_IN_BETWEEN_RANK
+        en_passant = (flags >> EN_PASSANT_SHIFT & 7, y)
+
+    castling_rooks = [rooks >> (3 * i) & 7 for i in range(4)]
+
+    return board.Position(fen.get_fen(pos, turn, castling, en_passant,
+                                      halfmove, fullmove, castling_rooks),
+                          white, black, bool(flags & CHESS960_FLAG))
+
+
+def write_positions(stream, games):
+    """
+    Writes positions to a binary stream.
+    :param stream: A file opened for binary writing.
+    :param games: An iterable of board.Position instances.
+    :return: The number of positions written.
+    """
+    count = 0
+    for game in games:
+        stream.write(encode_position(game))
+        count += 1
+    return count
+
+
+def read_positions(stream):
+    """
+    Reads positions written by write_positions.
+    :param stream: A file opened for binary reading.
+    :return: A generator of board.Position instances.
+    """
+    while True:
+        data = stream.read(POSITION_SIZE)
+        if len(data) < POSITION_SIZE:
+            break
+        yield decode_position(data)
+
+
+def write_game(stream, start, moves):
+    """
+    Writes a game to a binary stream.
+    :param stream: A file opened for binary writing.
+    :param start: The starting board.Position of the game.
+    :param moves: A list of tuples (move, promotion) of the moves of the game,
+    where promotion is the promotion piece or None.
+    :return: Nothing.
+    """
+    stream.write(encode_position(start))
+    stream.write(MOVE_COUNT.pack(len(moves)))
+    stream.write(b''.join(MOVE.pack(board.encode_move(move, promotion))
+                          for move, promotion in moves))
+
+
+def read_games(stream):
+    """
+    Reads games written by write_game.
+    :param stream: A file opened for binary reading.
+    :return: A generator of tuples (start, moves) of the starting
+    board.Position and a list of tuples (move, promotion) of the moves.
+    """
+    while True:
+        data = stream.read(POSITION_SIZE + MOVE_COUNT.size)
+        if len(data) < POSITION_SIZE + MOVE_COUNT.size:
+            break
+        start = decode_position(data[:POSITION_SIZE])
+        count = MOVE_COUNT.unpack(data[POSITION_SIZE:])[0]
+        codes = stream.read(count * MOVE.size)
+        moves = [(board.decode_move(code), board.decode_promotion(code))
+                 for code, in MOVE.iter_unpack(codes)]
+        yield start, moves
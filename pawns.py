@@ -0,0 +1,92 @@
+"""
+Pawn structure evaluation. Passed, isolated and doubled pawns are scored from
+the pawns alone, so the result only changes when a pawn moves, is captured or
+promotes, and can be cached by the pawn hash of the position.
+"""
+
+import collections
+
+# The bonus in pawns for a passed pawn on each rank counted from the player's
+# own side. Pawns never stand on the first or last rank
+PASSED_PAWN = [0, 0.1, 0.15, 0.25, 0.4, 0.65, 1.0, 0]
+
+# The penalties in pawns for each isolated pawn and each pawn doubled on a file
+ISOLATED_PAWN = -0.2
+DOUBLED_PAWN = -0.15
+
+Entry = collections.namedtuple('Entry', ['passed', 'isolated', 'doubled',
+                                         'score'])
+
+
+def get_pawn_ranks(pos):
+    """
+    Finds the pawns of both players.
+    :param pos: The list of lists of the pieces on the board.
+    :return: A tuple (white, black) of lists of the ranks of the pawns on each
+    file, indexed by x.
+    """
+    white = [[] for x in range(8)]
+    black = [[] for x in range(8)]
+    y = 0
+    for rank in pos:
+        x = 0
+        for item in rank:
+            if item == 'P':
+                white[x].append(y)
+            elif item == 'p':
+                black[x].append(y)
+            x += 1
+        y += 1
+    return white, black
+
+
+def evaluate_side(own, other, white):
+    """
+    Scores the pawn structure of one player.
+    :param own: The ranks of the player's pawns on each file.
+    :param other: The ranks of the opponent's pawns on each file.
+    :param white: True if the player is white, whose pawns move towards y = 0.
+    :return: A tuple (passed, isolated, doubled) of the score of each term.
+    """
+    passed = 0
+    isolated = 0
+    doubled = 0
+    for x in range(8):
+        if not own[x]:
+            continue
+        doubled += DOUBLED_PAWN * (len(own[x]) - 1)
+
+        files = range(max(x - 1, 0), min(x + 1, 7) + 1)
+        if not any(own[i] for i in files if i != x):
+            isolated += ISOLATED_PAWN * len(own[x])
+
+        # The front pawn of a file is passed if no pawn of the opponent stands
+        # ahead of it on its own or an adjacent file
+        others = [other_y for i in files for other_y in other[i]]
+        if white:
+            y = min(own[x])
+            blocked = any(other_y < y for other_y in others)
+            rank = 7 - y
+        else:
+            y = max(own[x])
+            blocked = any(other_y > y for other_y in others)
+            rank = y
+        if not blocked:
+            passed += PASSED_PAWN[rank]
+    return passed, isolated, doubled
+
+
+def evaluate_structure(pos):
+    """
+    Scores the pawn structure of a position.
+    :param pos: The list of lists of the pieces on the board.
+    :return: The Entry of the score of each term and their total, in pawns from
+    white's point of view.
+    """
+    white, black = get_pawn_ranks(pos)
+    white_terms = evaluate_side(white, black, True)
+    black_terms = evaluate_side(black, white, False)
+    passed, isolated, doubled = [round(w - b, 2) for w, b in
+                                 zip(white_terms, black_terms)]
+    return Entry(passed, isolated, doubled,
+                 round(passed + isolated + doubled, 2))
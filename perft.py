@@ -0,0 +1,253 @@
+"""
+Perft: counts the leaf nodes of the legal move tree to a fixed depth and
+compares them with published counts to verify move generation, including
+castling in Chess960. Each promotion counts as four moves, one per promotion
+piece.
+
+Deep counts are split by root move across a pool of processes, which also
+gives the divide output of the count below each root move. Each process keeps
+one table of the counts of the subtrees it has counted for all the root moves
+it is given, keyed by the hash of the position and the depth, so that
+transpositions are counted once.
+"""
+
+import argparse
+import concurrent.futures
+import sys
+from timeit import default_timer as timer
+
+import analysis
+import board
+import cache
+import error
+import fen
+
+# Default number of entries in the table of counts of each process
+DEFAULT_ENTRIES = 1 << 20
+
+# The table keys hold the depth in the low bits below the hash
+DEPTH_BITS = 6
+
+# Positions with known counts, as tuples (FEN, chess960, counts by depth)
+REFERENCE = [
+    (board.standard_start, False, [20, 400, 8902, 197281]),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     False, [48, 2039, 97862]),
+    ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', False,
+     [14, 191, 2812, 43238]),
+    ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     False, [6, 264, 9467]),
+    ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', False,
+     [44, 1486, 62379]),
+    (fen.get_chess960_fen(fen.CHESS960_STANDARD), True,
+     [20, 400, 8902, 197281]),
+    ('bqnb1rkr/pp3ppp/3ppn2/2p5/5P2/P2P4/NPP1P1PP/BQ1BNRKR w HFhf - 2 9',
+     True, [21, 528, 12189]),
+    ('2nnrbkr/p1qppppp/8/1ppb4/6PP/3PP3/PPP2P2/BQNNRBKR w HEhe - 1 9', True,
+     [21, 807, 18002])
+]
+
+# The table of counts of a worker process, set up by init_worker
+worker_table = None
+
+
+def get_promotions(game, move):
+    """
+    Gets the pieces a move can promote to.
+    :param game: The position the move is made from.
+    :param move: The move.
+    :return: The list of promotion pieces, or [None] if the move is not a
+    promotion.
+    """
+    (x, y), (x_new, y_new) = move
+    if game.pos[y][x] in ('P', 'p') and y_new in (0, 7):
+        return board.PROMOTION_PIECES
+    return [None]
+
+
+def perft(game, depth, table=None):
+    """
+    Counts the leaf nodes of the legal move tree.
+    :param game: The position to count from.
+    :param depth: The depth of the tree.
+    :param table: The cache.Cache of counts keyed by get_key, or None.
+    :return: The number of leaf nodes.
+    """
+    if depth == 0:
+        return 1
+    if table is not None:
+        nodes = table.probe(get_key(game, depth))
+        if nodes is not None:
+            return nodes
+
+    nodes = 0
+    for move in game.get_legal_moves():
+        promotions = get_promotions(game, move)
+        if depth == 1:
+            nodes += len(promotions)
+            continue
+        start, end = move
+        en_passant = game.is_en_passant(start, end)
+        for promotion in promotions:
+            child = game.copy()
+            child.make_move(start, end, en_passant, promotion,
+                            update_fen=False)
+            nodes += perft(child, depth - 1, table)
+
+    if table is not None:
+        table.store(get_key(game, depth), nodes)
+    return nodes
+
+
+def get_key(game, depth):
+    """
+    Gets the key of the count of a position in the table of counts.
+    :param game: The position.
+    :param depth: The depth counted to.
+    :return: The key.
+    """
+    return (game.hash << DEPTH_BITS) | depth
+
+
+def init_worker(entries):
+    """
+    Sets up the table of counts of a worker process, which is kept for every
+    root move the process counts.
+    :param entries: The number of entries in the table of counts, or 0 for
+    no table.
+    :return: Nothing.
+    """
+    global worker_table
+    worker_table = cache.Cache(entries) if entries else None
+
+
+def count_move(fen_string, chess960, move, promotion, depth):
+    """
+    Counts the leaf nodes below a root move in a worker process, using the
+    table of counts of the process.
+    :param fen_string: The FEN string of the root position.
+    :param chess960: True if the position is from a game of Chess960.
+    :param move: The root move.
+    :param promotion: The piece the move promotes to, or None.
+    :param depth: The depth of the tree, including the root move.
+    :return: The number of leaf nodes.
+    """
+    game = board.Position(fen_string, 'c', 'c', chess960)
+    start, end = move
+    game.make_move(start, end, game.is_en_passant(start, end), promotion,
+                   update_fen=False)
+    return perft(game, depth - 1, worker_table)
+
+
+def divide(game, depth, workers=None, entries=DEFAULT_ENTRIES):
+    """
+    Counts the leaf nodes below each root move, splitting the root moves
+    across a pool of processes.
+    :param game: The position to count from.
+    :param depth: The depth of the tree, at least 1.
+    :param workers: The number of processes, or None for one per core.
+    :param entries: The number of entries in the table of counts of each
+    process, or 0 for no table.
+    :return: A list of tuples (move, promotion, nodes) of each root move, the
+    piece it promotes to or None and the number of leaf nodes below it.
+    """
+    root_moves = [(move, promotion) for move in game.get_legal_moves()
+                  for promotion in get_promotions(game, move)]
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(entries,)) as executor:
+        futures = [executor.submit(count_move, game.current_fen, game.chess960,
+                                   move, promotion, depth)
+                   for move, promotion in root_moves]
+        return [(move, promotion, future.result())
+                for (move, promotion), future in zip(root_moves, futures)]
+
+
+def move_to_string(move, promotion):
+    """
+    Gets the coordinate notation of a move, e.g. e7e8q.
+    :param move: The move in the form ((start_x, start_y), (end_x, end_y)).
+    :param promotion: The piece the move promotes to, or None.
+    :return: The move as a string.
+    """
+    if promotion is None:
+        return analysis.move_to_string(move)
+    return analysis.move_to_string(move) + promotion.lower()
+
+
+def verify(max_depth=None, output=sys.stdout, entries=DEFAULT_ENTRIES):
+    """
+    Checks the counts of the reference positions.
+    :param max_depth: The deepest depth to check, or None for every known
+    depth.
+    :param output: The stream to report each count to.
+    :param entries: The number of entries in the table of counts, or 0 for
+    no table.
+    :return: True if every count matches, false otherwise.
+    """
+    passed = True
+    for fen_string, chess960, counts in REFERENCE:
+        game = board.Position(fen_string, 'c', 'c', chess960)
+        table = cache.Cache(entries) if entries else None
+        for depth, expected in enumerate(counts[:max_depth], 1):
+            nodes = perft(game, depth, table)
+            result = 'ok' if nodes == expected else 'FAILED'
+            print(fen_string, depth, nodes, expected, result, file=output)
+            if nodes != expected:
+                passed = False
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Counts the leaf nodes of "
+                                                 "the legal move tree")
+    parser.add_argument("depth", type=error.positive_int, nargs='?',
+                        help="The depth to count to, or the deepest depth to "
+                             "verify the reference positions to.")
+    parser.add_argument("--fen", default=None,
+                        help="The FEN of the position to count from.")
+    parser.add_argument("--start", type=error.chess960_number, default=None,
+                        help="The number of the Chess960 start position to "
+                             "count from.")
+    parser.add_argument("--chess960", action='store_true',
+                        help="Count the position given by --fen as a "
+                             "Chess960 position.")
+    parser.add_argument("--divide", action='store_true',
+                        help="Print the count below each root move.")
+    parser.add_argument("--workers", type=error.positive_int, default=None,
+                        help="The number of processes to split the root "
+                             "moves across, one per core by default.")
+    parser.add_argument("--entries", type=error.non_negative_int,
+                        default=DEFAULT_ENTRIES,
+                        help="The number of entries in the table of counts "
+                             "of each process, 0 for no table.")
+    args = parser.parse_args()
+
+    if args.fen is None and args.start is None:
+        if not verify(args.depth, entries=args.entries):
+            sys.exit(1)
+        return
+
+    if args.depth is None:
+        parser.error("a depth is required")
+    chess960 = args.chess960
+    if args.fen is not None:
+        fen_string = args.fen
+        if fen.check_fen(fen_string, 'c', 'c'):
+            error.exit_game(error.INVALID_FEN)
+    else:
+        fen_string = fen.get_chess960_fen(args.start)
+        chess960 = True
+    game = board.Position(fen_string, 'c', 'c', chess960)
+    print(fen_string)
+    begin = timer()
+    counts = divide(game, args.depth, args.workers, args.entries)
+    if args.divide:
+        for move, promotion, nodes in counts:
+            print(move_to_string(move, promotion) + ':', nodes)
+        print()
+    print("Nodes: ", sum(nodes for move, promotion, nodes in counts))
+    print("Time taken: ", timer() - begin)
+
+
+if __name__ == "__main__":
+    main()
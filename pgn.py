@@ -1,4 +1,6 @@
 
+import re
+
 import board
 import error
 
@@ -7,6 +9,16 @@ USE_FILE = 1
 USE_RANK = 2
 USE_FILE_AND_RANK = 3
 
+RESULTS = ['1-0', '0-1', '1/2-1/2', '*']
+
+# A move in standard algebraic notation once check and annotation symbols have
+# been removed. The groups are the piece, start file, start rank, end square
+# and promotion piece.
+SAN_PATTERN = re.compile(r'^([KQRBN])?([a-h])?([1-8])?x?([a-h][1-8])'
+                         r'(?:=?([QRBN]))?$')
+TAG_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]$')
+MOVE_NUMBER_PATTERN = re.compile(r'^\d+\.+')
+
 
 def set_up_pgn():
     return "[Event \"The Rapture\"]\n" \
@@ -33,12 +45,14 @@ def update_pgn(game, start, end):
 
     # Add castling
     castling = False
-    if (piece == 'k' and start == (4, 0) and end == (6, 0)) or \
-            (piece == 'K' and start == (4, 7) and end == (6, 7)):
+    side = None
+    if piece == 'K' or piece == 'k':
+        side = game.get_castling_side(start, end)
+    if side == board.WHITE_KING_SIDE_CASTLE or \
+            side == board.BLACK_KING_SIDE_CASTLE:
         game.pgn = ''.join((game.pgn, 'O-O'))
         castling = True
-    elif (piece == 'k' and start == (4, 0) and end == (2, 0)) or \
-            (piece == 'K' and start == (4, 7) and end == (2, 7)):
+    elif side is not None:
         game.pgn = ''.join((game.pgn, 'O-O-O'))
         castling = True
 
@@ -203,7 +217,7 @@ def get_diagonal_attacks(pieces, end, piece, game):
 
 
 def add_check(game):
-    if game.is_attacked(game.get_king_coordinates()):
+    if game.in_check():
         game.pgn = ''.join((game.pgn, '+'))
     game.pgn += ' '
 
@@ -215,6 +229,118 @@ def add_results(game, status):
     elif status == error.BLACK_WINS:
         game.pgn = game.pgn[:-2]
         game.pgn = ''.join((game.pgn, '# 0-1'))
+    elif status == error.WHITE_WINS_ON_TIME:
+        game.pgn = game.pgn[:-1]
+        game.pgn = ''.join((game.pgn, ' 1-0'))
+    elif status == error.BLACK_WINS_ON_TIME:
+        game.pgn = game.pgn[:-1]
+        game.pgn = ''.join((game.pgn, ' 0-1'))
     else:
         game.pgn = game.pgn[:-1]
         game.pgn = ''.join((game.pgn, ' 1/2-1/2'))
+
+
+def read_games(lines):
+    """
+    Reads the games from PGN input one at a time. Comments, variations and
+    numeric annotation glyphs are skipped.
+    :param lines: An iterable of the lines of the PGN input, e.g. a file.
+    :return: A generator of tuples (tags, moves, result) of a dictionary of the
+    tag pairs, a list of the moves in standard algebraic notation and the
+    result string.
+    """
+    tags = {}
+    moves = []
+    result = '*'
+    in_movetext = False
+    comment = False
+    variation = 0
+
+    for line in lines:
+        line = line.strip()
+
+        # Tag pairs start a new game once the previous movetext has been read
+        match = TAG_PATTERN.match(line)
+        if match is not None and not comment and variation == 0:
+            if in_movetext:
+                yield tags, moves, result
+                tags, moves, result = {}, [], '*'
+                in_movetext = False
+            tags[match.group(1)] = match.group(2)
+            continue
+
+        for token in re.split(r'(\{|\}|\(|\)|\s+)', line):
+            if not token or token.isspace():
+                continue
+            if comment:
+                comment = token != '}'
+                continue
+            if token == '{':
+                comment = True
+            elif token.startswith(';'):
+                break
+            elif token == '(':
+                variation += 1
+            elif token == ')':
+                variation -= 1
+            elif variation or token.startswith('$'):
+                continue
+            elif token in RESULTS:
+                result = token
+                in_movetext = True
+            else:
+                token = MOVE_NUMBER_PATTERN.sub('', token)
+                if token:
+                    moves.append(token)
+                in_movetext = True
+
+    if in_movetext or tags:
+        yield tags, moves, result
+
+
+def parse_move(game, san):
+    """
+    Finds the legal move described by a move in standard algebraic notation.
+    :param game: The position the move is made from.
+    :param san: The move, e.g. 'Nbd7', 'exd6', 'e8=Q+' or 'O-O'.
+    :return: A tuple (move, promotion) of the move in the form ((start_x,
+    start_y), (end_x, end_y)) and the promotion piece or None, or None if the
+    move is not legal in the position.
+    """
+    san = san.rstrip('+#!?')
+    legal_moves = game.get_legal_moves()
+
+    # Castling moves
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        for start, end in legal_moves:
+            x, y = start
+            if game.pos[y][x].upper() != 'K':
+                continue
+            side = game.get_castling_side(start, end)
+            if side is None:
+                continue
+            king_side = side == board.WHITE_KING_SIDE_CASTLE or \
+                side == board.BLACK_KING_SIDE_CASTLE
+            if king_side == (len(san) == 3):
+                return (start, end), None
+        return None
+
+    match = SAN_PATTERN.match(san)
+    if match is None:
+        return None
+    piece, file, rank, square, promotion = match.groups()
+    if piece is None:
+        piece = 'P'
+    end = (board.files[square[0]], board.ranks[square[1]])
+
+    for move in legal_moves:
+        (x, y), move_end = move
+        if move_end != end or game.pos[y][x].upper() != piece:
+            continue
+        if file is not None and board.files[file] != x:
+            continue
+        if rank is not None and board.ranks[rank] != y:
+            continue
+        return move, promotion
+
+    return None
@@ -0,0 +1,187 @@
+"""
+An index of the positions reached in a collection of games. The index maps
+the hash of a position, which ignores the move counters like
+board.Position.__eq__, to every (game id, ply) it was reached at.
+
+The index is built in a single streaming pass over PGN input. Entries are
+collected in blocks of bounded size, each block is sorted and written to a
+temporary run file, and the runs are merged into one sorted file. Lookups
+binary search the memory mapped file, so nothing is loaded into memory and no
+game is replayed.
+"""
+
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+from timeit import default_timer as timer
+
+import board
+import error
+import pgn
+
+# Each entry holds the position hash, the game id and the ply
+ENTRY = struct.Struct('>QII')
+
+# The number of entries sorted in memory at once while building
+DEFAULT_BLOCK_ENTRIES = 1 << 20
+
+# The number of entries read from a run at a time while merging
+READ_ENTRIES = 4096
+
+
+def write_run(entries, directory):
+    """
+    Sorts a block of entries and writes it to a temporary run file.
+    :param entries: The list of entries to write.
+    :param directory: The directory of the run file.
+    :return: The path of the run file.
+    """
+    entries.sort()
+    with tempfile.NamedTemporaryFile('wb', dir=directory, suffix='.run',
+                                     delete=False) as run_file:
+        for entry in entries:
+            run_file.write(ENTRY.pack(*entry))
+    return run_file.name
+
+
+def read_run(path):
+    """
+    Reads the entries of a run file in order.
+    :param path: The path of the run file.
+    :return: A generator of the entries.
+    """
+    with open(path, 'rb') as run_file:
+        while True:
+            data = run_file.read(READ_ENTRIES * ENTRY.size)
+            if not data:
+                break
+            yield from ENTRY.iter_unpack(data)
+
+
+def build(lines, path, block_entries=DEFAULT_BLOCK_ENTRIES):
+    """
+    Builds an index of the games in PGN input. Games are numbered from 1 in
+    the order they appear and are replayed up to their first illegal move.
+    :param lines: An iterable of the lines of the PGN input.
+    :param path: The path of the index file to write.
+    :param block_entries: The number of entries sorted in memory at once.
+    :return: A tuple (games, entries) of the number of games and entries
+    indexed.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    runs = []
+    block = []
+    games = 0
+    entries = 0
+    try:
+        for tags, moves, result in pgn.read_games(lines):
+            games += 1
+            game = board.Position(tags.get('FEN', board.standard_start), 'c',
+                                  'c')
+            block.append((game.hash, games, 0))
+            ply = 0
+            for san in moves:
+                parsed = pgn.parse_move(game, san)
+                if parsed is None:
+                    break
+                (start, end), promotion = parsed
+                game.make_move(start, end, game.is_en_passant(start, end),
+                               promotion)
+                ply += 1
+                block.append((game.hash, games, ply))
+
+            if len(block) >= block_entries:
+                entries += len(block)
+                runs.append(write_run(block, directory))
+                block = []
+
+        if block:
+            entries += len(block)
+            runs.append(write_run(block, directory))
+
+        # Merge the sorted runs into the index
+        with open(path, 'wb') as index_file:
+            for entry in heapq.merge(*[read_run(run) for run in runs]):
+                index_file.write(ENTRY.pack(*entry))
+    finally:
+        for run in runs:
+            os.remove(run)
+
+    return games, entries
+
+
+class PositionIndex:
+    def __init__(self, path):
+        """
+        Opens an index for lookups.
+        :param path: The path of the index file.
+        """
+        self.file = open(path, 'rb')
+        self.entries = os.fstat(self.file.fileno()).st_size // ENTRY.size
+        self.map = None
+        if self.entries:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+
+    def close(self):
+        """
+        Closes the index.
+        :return: Nothing.
+        """
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def find(self, position_hash):
+        """
+        Finds every time a position was reached.
+        :param position_hash: The hash of the position, e.g. the hash attribute
+        of a board.Position.
+        :return: A list of tuples (game id, ply), ordered by game and ply.
+        """
+        # Find the first entry of the position
+        low = 0
+        high = self.entries
+        while low < high:
+            middle = (low + high) // 2
+            if ENTRY.unpack_from(self.map, middle * ENTRY.size)[0] < \
+                    position_hash:
+                low = middle + 1
+            else:
+                high = middle
+
+        found = []
+        index = low
+        while index < self.entries:
+            entry_hash, game_id, ply = ENTRY.unpack_from(self.map,
+                                                         index * ENTRY.size)
+            if entry_hash != position_hash:
+                break
+            found.append((game_id, ply))
+            index += 1
+        return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexes the positions of "
+                                                 "PGN games")
+    parser.add_argument("pgn", help="The PGN file to read the games from.")
+    parser.add_argument("index", help="The index file to write.")
+    parser.add_argument("--block-entries", type=error.positive_int,
+                        default=DEFAULT_BLOCK_ENTRIES,
+                        help="The number of entries sorted in memory at once.")
+    args = parser.parse_args()
+
+    begin = timer()
+    with open(args.pgn) as pgn_file:
+        games, entries = build(pgn_file, args.index, args.block_entries)
+    print("Games indexed: ", games)
+    print("Entries written: ", entries)
+    print("Time taken: ", timer() - begin)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Self-play training data. Games are played by the search in a pool of
+processes and positions are sampled from them, each labelled with the search
+score and the result of the game. Samples are written to shards of a fixed
+number of samples, so only the current shard and the games in flight are held
+in memory.
+
+A binary shard is a sequence of samples of a position packed by packed.py, the
+search score in centipawns and the result, both from white's point of view. A
+NumPy shard is a .npy file of a structured array with 12 piece planes per
+position in the order PNBRQKpnbrqk, the score and the result.
+"""
+
+import argparse
+import concurrent.futures
+import os
+import random
+import struct
+
+import ai
+import board
+import error
+import packed
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SAMPLE = struct.Struct('>32shb')
+
+FORMATS = ['bin', 'npy']
+
+# Defaults of a self-play run
+DEFAULT_DEPTH = 2
+DEFAULT_RANDOM_PLIES = 8
+DEFAULT_SAMPLE_RATE = 0.25
+DEFAULT_MAX_PLIES = 300
+DEFAULT_SHARD_SIZE = 100000
+
+# Scores are clamped to fit the 2 byte score of a sample
+MAX_SCORE = 32000
+
+RESULTS = {
+    error.WHITE_WINS: 1,
+    error.BLACK_WINS: -1
+}
+
+
+def play_game(seed, depth=DEFAULT_DEPTH, random_plies=DEFAULT_RANDOM_PLIES,
+              sample_rate=DEFAULT_SAMPLE_RATE, max_plies=DEFAULT_MAX_PLIES):
+    """
+    Plays a game of self-play and samples positions from it. The first moves
+    are random so that games differ, and those positions are never sampled.
+    Games reaching the maximum number of plies are scored as draws.
+    :param seed: The seed of the random moves and sampling.
+    :param depth: The depth each move is searched to.
+    :param random_plies: The number of random moves the game starts with.
+    :param sample_rate: The probability of sampling each searched position.
+    :param max_plies: The number of plies after which the game is stopped.
+    :return: A list of tuples (position, score, result) of the position packed
+    by packed.encode_position and its search score and the result of the game,
+    from white's point of view.
+    """
+    rng = random.Random(seed)
+    game = board.Position(board.standard_start, 'c', 'c')
+    samples = []
+    result = 0
+
+    for ply in range(max_plies):
+        status = game.is_end_of_game()
+        if status:
+            result = RESULTS.get(status, 0)
+            break
+
+        if ply < random_plies:
+            move = rng.choice(game.get_legal_moves())
+        else:
+            move, score = ai.Search().iterate(game, depth)
+            if rng.random() < sample_rate:
+                if not game.turn:
+                    score = -score
+                score = max(-MAX_SCORE, min(MAX_SCORE, round(score * 100)))
+                samples.append((packed.encode_position(game), score))
+
+        start, end = move
+        game.make_move(start, end, game.is_en_passant(start, end),
+                       ai.PROMOTION)
+
+    return [(position, score, result) for position, score in samples]
+
+
+def get_planes(position):
+    """
+    Converts a packed position to piece planes.
+    :param position: The position packed by packed.encode_position.
+    :return: A NumPy array of shape (12, 8, 8) with a 1 on each square
+    occupied by the piece of each plane.
+    """
+    planes = numpy.zeros((12, 8, 8), dtype=numpy.uint8)
+    game = packed.decode_position(position)
+    for y in range(8):
+        for x in range(8):
+            item = game.pos[y][x]
+            if item != ' ':
+                planes[packed.PIECE_CODES[item] - 1, y, x] = 1
+    return planes
+
+
+class ShardWriter:
+    def __init__(self, directory, shard_size=DEFAULT_SHARD_SIZE,
+                 output_format='bin'):
+        """
+        Initialise the writer.
+        :param directory: The directory to write the shards to.
+        :param shard_size: The number of samples of each shard.
+        :param output_format: 'bin' for binary shards or 'npy' for NumPy
+        shards.
+        """
+        if output_format == 'npy' and numpy is None:
+            raise ImportError("NumPy is required for npy shards")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_size = shard_size
+        self.format = output_format
+        self.shards = 0
+        self.samples = 0
+        self.file = None
+        self.buffer = []
+        self.count = 0
+
+    def add(self, position, score, result):
+        """
+        Adds a sample, starting a new shard when the current one is full.
+        :param position: The position packed by packed.encode_position.
+        :param score: The search score in centipawns from white's point of
+        view.
+        :param result: The result of the game from white's point of view.
+        :return: Nothing.
+        """
+        if self.format == 'npy':
+            self.buffer.append((get_planes(position), score, result))
+        else:
+            if self.file is None:
+                self.file = open(self.get_path(), 'wb')
+            self.file.write(SAMPLE.pack(position, score, result))
+        self.count += 1
+        self.samples += 1
+        if self.count == self.shard_size:
+            self.finish_shard()
+
+    def get_path(self):
+        """
+        Gets the path of the current shard.
+        :return: The path.
+        """
+        return os.path.join(self.directory, 'shard-%05d.%s' % (self.shards,
+                                                               self.format))
+
+    def finish_shard(self):
+        """
+        Writes out and closes the current shard, if it has any samples.
+        :return: Nothing.
+        """
+        if not self.count:
+            return
+        if self.format == 'npy':
+            data = numpy.zeros(self.count, dtype=[
+                ('planes', numpy.uint8, (12, 8, 8)),
+                ('score', numpy.int16),
+                ('result', numpy.int8)
+            ])
+            for i, sample in enumerate(self.buffer):
+                data[i] = sample
+            numpy.save(self.get_path(), data)
+            self.buffer = []
+        else:
+            self.file.close()
+            self.file = None
+        self.shards += 1
+        self.count = 0
+
+    def close(self):
+        """
+        Writes out the last shard.
+        :return: Nothing.
+        """
+        self.finish_shard()
+
+
+def read_samples(stream):
+    """
+    Reads the samples of a binary shard.
+    :param stream: A file opened for binary reading.
+    :return: A generator of tuples (position, score, result) of the
+    board.Position and its score and result from white's point of view.
+    """
+    while True:
+        data = stream.read(SAMPLE.size)
+        if len(data) < SAMPLE.size:
+            break
+        position, score, result = SAMPLE.unpack(data)
+        yield packed.decode_position(position), score, result
+
+
+def generate(directory, games, workers=None, seed=0,
+             shard_size=DEFAULT_SHARD_SIZE, output_format='bin', **options):
+    """
+    Plays games of self-play in a pool of processes and writes the sampled
+    positions to shards. At most two games per process are in flight at once.
+    :param directory: The directory to write the shards to.
+    :param games: The number of games to play.
+    :param workers: The number of processes, or None for one per CPU.
+    :param seed: The seed of the first game, each further game using the next.
+    :param shard_size: The number of samples of each shard.
+    :param output_format: 'bin' for binary shards or 'npy' for NumPy shards.
+    :param options: Further keyword arguments passed to play_game.
+    :return: A tuple (samples, shards) of the numbers of samples and shards
+    written.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    writer = ShardWriter(directory, shard_size, output_format)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        in_flight = 2 * workers
+        pending = set()
+        for game_seed in range(seed, seed + games):
+            pending.add(executor.submit(play_game, game_seed, **options))
+            if len(pending) < in_flight:
+                continue
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                for sample in future.result():
+                    writer.add(*sample)
+        for future in concurrent.futures.as_completed(pending):
+            for sample in future.result():
+                writer.add(*sample)
+    writer.close()
+    return writer.samples, writer.shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates training data "
+                                                 "from self-play")
+    parser.add_argument("directory", help="The directory to write the shards "
+                                          "to.")
+    parser.add_argument("--games", type=error.positive_int, default=100,
+                        help="The number of games to play.")
+    parser.add_argument("--workers", type=error.positive_int,
+                        help="The number of processes to play in.")
+    parser.add_argument("--depth", type=error.positive_int,
+                        default=DEFAULT_DEPTH,
+                        help="The depth each move is searched to.")
+    parser.add_argument("--random-plies", type=int,
+                        default=DEFAULT_RANDOM_PLIES,
+                        help="The number of random moves each game starts "
+                             "with.")
+    parser.add_argument("--sample-rate", type=float,
+                        default=DEFAULT_SAMPLE_RATE,
+                        help="The probability of sampling each position.")
+    parser.add_argument("--max-plies", type=error.positive_int,
+                        default=DEFAULT_MAX_PLIES,
+                        help="The number of plies after which a game is "
+                             "drawn.")
+    parser.add_argument("--shard-size", type=error.positive_int,
+                        default=DEFAULT_SHARD_SIZE,
+                        help="The number of samples of each shard.")
+    parser.add_argument("--format", choices=FORMATS, default='bin',
+                        help="The format of the shards.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="The seed of the first game.")
+    args = parser.parse_args()
+
+    samples, shards = generate(args.directory, args.games, args.workers,
+                               args.seed, args.shard_size, args.format,
+                               depth=args.depth,
+                               random_plies=args.random_plies,
+                               sample_rate=args.sample_rate,
+                               max_plies=args.max_plies)
+    print("Samples written: ", samples)
+    print("Shards written: ", shards)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+"""
+A game server hosting many concurrent games over a local TCP or Unix socket.
+Clients send one JSON request per line and receive one JSON response per line.
+Engine moves are searched, and the moves of both players are checked and
+played, in a pool of processes so the event loop never blocks on move
+generation or a search.
+
+Requests:
+    {"cmd": "new", "white": "h", "black": "c", "fen": <optional>}
+    {"cmd": "move", "game": <id>, "move": "e2e4"}, with a fifth character for
+    the promotion piece, e.g. "e7e8n" (queen by default)
+    {"cmd": "state", "game": <id>}
+    {"cmd": "close", "game": <id>}
+    {"cmd": "metrics"}
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import statistics
+from timeit import default_timer as timer
+
+import ai
+import board
+import clock
+import error
+import fen
+import pgn
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Default limits of an engine move
+DEFAULT_DEPTH = 3
+DEFAULT_MOVE_TIME = 1.0
+
+# The number of latency samples kept for the aggregate percentiles
+LATENCY_SAMPLES = 10000
+
+
+def new_position(fen_string):
+    """
+    Sets up the starting position of a game in a worker process.
+    :param fen_string: The FEN string of the starting position.
+    :return: A tuple (position, status) of the board.Position and the state of
+    the game from is_end_of_game.
+    """
+    # Players are always set up as computers so that promotions never prompt
+    # on the server's standard input
+    position = board.Position(fen_string, 'c', 'c')
+    return position, position.is_end_of_game()
+
+
+def play_move(position, move, promotion):
+    """
+    Plays a move in a worker process if it is legal, updating the PGN.
+    :param position: The board.Position to move in.
+    :param move: The move to play.
+    :param promotion: The promotion piece.
+    :return: A tuple (position, status) of the position after the move and the
+    state of the game from is_end_of_game, or None if the move is illegal.
+    """
+    if move not in position.get_legal_moves():
+        return None
+    start, end = move
+    pgn.update_pgn(position, start, end)
+    position.make_move(start, end, position.is_en_passant(start, end),
+                       promotion)
+    pgn.add_check(position)
+
+    status = position.is_end_of_game()
+    if status != error.NORMAL:
+        pgn.add_results(position, status)
+    return position, status
+
+
+def engine_move(position, depth, move_time):
+    """
+    Searches for an engine move in a worker process and plays it.
+    :param position: The board.Position to move in.
+    :param depth: The deepest iteration to search.
+    :param move_time: The hard time limit of the search in seconds.
+    :return: A tuple (move, position, status) of the best move found, the
+    position after it and the state of the game from is_end_of_game.
+    """
+    move = ai.search(position, clock.SearchLimits(move_time / 2, move_time),
+                     depth)
+    return (move,) + play_move(position, move, ai.PROMOTION)
+
+
+def parse_move(text):
+    """
+    Parses a move in coordinate notation.
+    :param text: The move, e.g. e2e4 or e7e8q.
+    :return: A tuple (move, promotion), or None if the text is not a move.
+    """
+    if len(text) not in (4, 5) or text[0] not in board.files or \
+            text[2] not in board.files or text[1] not in board.ranks or \
+            text[3] not in board.ranks:
+        return None
+    promotion = 'Q'
+    if len(text) == 5:
+        if text[4].upper() not in board.PROMOTION_PIECES:
+            return None
+        promotion = text[4].upper()
+
+    start = (board.files[text[0]], board.ranks[text[1]])
+    end = (board.files[text[2]], board.ranks[text[3]])
+    return (start, end), promotion
+
+
+def format_move(move):
+    """
+    Formats a move in coordinate notation.
+    :param move: The move in the form ((start_x, start_y), (end_x, end_y)).
+    :return: The move, e.g. e2e4.
+    """
+    (x1, y1), (x2, y2) = move
+    return ''.join((board.inv_files[x1], board.inv_ranks[y1],
+                    board.inv_files[x2], board.inv_ranks[y2]))
+
+
+class Latency:
+    def __init__(self, samples=LATENCY_SAMPLES):
+        """
+        Initialise the latency statistics.
+        :param samples: The number of most recent samples kept for the
+        percentiles.
+        """
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.recent = collections.deque(maxlen=samples)
+
+    def add(self, seconds):
+        """
+        Records a latency.
+        :param seconds: The latency in seconds.
+        :return: Nothing.
+        """
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        self.recent.append(seconds)
+
+    def summary(self):
+        """
+        Summarises the recorded latencies.
+        :return: A dictionary of the count and the mean, median, 99th
+        percentile and maximum latency in seconds.
+        """
+        if not self.count:
+            return {'count': 0}
+        recent = sorted(self.recent)
+        return {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'median': statistics.median(recent),
+            'p99': recent[min(len(recent) - 1, int(len(recent) * 0.99))],
+            'max': self.maximum
+        }
+
+
+class ServerGame:
+    def __init__(self, game_id, position, status, white, black):
+        """
+        Initialise a hosted game.
+        :param game_id: The id of the game.
+        :param position: The board.Position of the starting position.
+        :param status: The state of the game from is_end_of_game.
+        :param white: 'h' or 'c' for a human or engine white player.
+        :param black: 'h' or 'c' for a human or engine black player.
+        """
+        self.id = game_id
+        self.white = white
+        self.black = black
+        self.position = position
+        self.moves = []
+        self.status = status
+        self.lock = asyncio.Lock()
+        self.move_latency = Latency()
+        self.engine_latency = Latency()
+
+    def engine_to_move(self):
+        """
+        Checks whether the engine is to move in an unfinished game.
+        :return: True if the engine is to move, false otherwise.
+        """
+        if self.status != error.NORMAL:
+            return False
+        if self.position.turn:
+            return self.white == 'c'
+        return self.black == 'c'
+
+    def update(self, move, position, status):
+        """
+        Records a move played in a worker process.
+        :param move: The move played.
+        :param position: The position after the move.
+        :param status: The state of the game from is_end_of_game.
+        :return: Nothing.
+        """
+        self.position = position
+        self.status = status
+        self.moves.append(format_move(move))
+
+    def state(self):
+        """
+        Describes the game.
+        :return: A dictionary of the game state.
+        """
+        return {
+            'game': self.id,
+            'fen': self.position.current_fen,
+            'turn': 'w' if self.position.turn else 'b',
+            'status': self.status,
+            'moves': self.moves,
+            'pgn': self.position.pgn
+        }
+
+
+class GameServer:
+    def __init__(self, executor, depth=DEFAULT_DEPTH,
+                 move_time=DEFAULT_MOVE_TIME):
+        """
+        Initialise the server.
+        :param executor: The concurrent.futures executor moves are checked and
+        played and engine moves searched in.
+        :param depth: The deepest iteration of an engine search.
+        :param move_time: The time limit of an engine search in seconds.
+        """
+        self.executor = executor
+        self.depth = depth
+        self.move_time = move_time
+        self.games = {}
+        self.ids = itertools.count(1)
+        self.request_latency = Latency()
+        self.engine_latency = Latency()
+        self.games_started = 0
+        self.games_finished = 0
+
+    async def handle_client(self, reader, writer):
+        """
+        Serves the requests of a connected client until it disconnects.
+        :param reader: The asyncio.StreamReader of the connection.
+        :param writer: The asyncio.StreamWriter of the connection.
+        :return: Nothing.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                begin = timer()
+                try:
+                    response = await self.handle_request(json.loads(line))
+                except (ValueError, KeyError, TypeError) as exception:
+                    response = {'ok': False, 'error': str(exception)}
+                self.request_latency.add(timer() - begin)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request):
+        """
+        Handles a single request.
+        :param request: The decoded request.
+        :return: The response to send.
+        """
+        command = request['cmd']
+        if command == 'new':
+            return await self.new_game(request)
+        if command == 'metrics':
+            return {'ok': True, 'metrics': self.metrics()}
+        if command not in ('move', 'state', 'close'):
+            return {'ok': False, 'error': 'Unknown command'}
+
+        game = self.games.get(request.get('game'))
+        if game is None:
+            return {'ok': False, 'error': 'Unknown game'}
+        if command == 'move':
+            return await self.move(game, request['move'])
+        if command == 'state':
+            return {'ok': True, **game.state()}
+        del self.games[game.id]
+        return {'ok': True}
+
+    async def new_game(self, request):
+        """
+        Starts a new game, playing the engine's moves if it is to move.
+        :param request: The request with the player types and optional FEN.
+        :return: The response with the state of the new game.
+        """
+        white = request.get('white', 'h')
+        black = request.get('black', 'c')
+        fen_string = request.get('fen', board.standard_start)
+        if error.check_args(white) or error.check_args(black):
+            return {'ok': False, 'error': 'Players must be h or c'}
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(self.executor, fen.check_fen,
+                                      fen_string, 'c', 'c'):
+            return {'ok': False, 'error': 'Invalid FEN'}
+
+        position, status = await loop.run_in_executor(
+            self.executor, new_position, fen_string)
+        game = ServerGame(next(self.ids), position, status, white, black)
+        self.games[game.id] = game
+        self.games_started += 1
+        async with game.lock:
+            await self.play_engine(game)
+        return {'ok': True, **game.state()}
+
+    async def move(self, game, text):
+        """
+        Plays a player's move, then the engine's replies while it is to move.
+        :param game: The ServerGame to move in.
+        :param text: The move in coordinate notation.
+        :return: The response with the state of the game.
+        """
+        parsed = parse_move(text)
+        if parsed is None:
+            return {'ok': False, 'error': 'Invalid move format'}
+        move, promotion = parsed
+
+        async with game.lock:
+            begin = timer()
+            if game.status != error.NORMAL:
+                return {'ok': False, 'error': 'Game is over'}
+            if game.engine_to_move():
+                return {'ok': False, 'error': 'Not your turn'}
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self.executor, play_move, game.position, move, promotion)
+            if result is None:
+                return {'ok': False, 'error': 'Illegal move'}
+            game.update(move, *result)
+            game.move_latency.add(timer() - begin)
+            await self.play_engine(game)
+
+        return {'ok': True, **game.state()}
+
+    async def play_engine(self, game):
+        """
+        Plays the engine's moves while it is to move, searching and playing
+        them in the executor. The game lock must be held.
+        :param game: The ServerGame to move in.
+        :return: Nothing.
+        """
+        loop = asyncio.get_running_loop()
+        while game.engine_to_move():
+            begin = timer()
+            move, position, status = await loop.run_in_executor(
+                self.executor, engine_move, game.position, self.depth,
+                self.move_time)
+            elapsed = timer() - begin
+            game.engine_latency.add(elapsed)
+            self.engine_latency.add(elapsed)
+            game.update(move, position, status)
+
+        if game.status != error.NORMAL:
+            self.games_finished += 1
+
+    def metrics(self):
+        """
+        Collects the per game and aggregate metrics of the server.
+        :return: A dictionary of the metrics.
+        """
+        return {
+            'games_active': len(self.games),
+            'games_started': self.games_started,
+            'games_finished': self.games_finished,
+            'request_latency': self.request_latency.summary(),
+            'engine_latency': self.engine_latency.summary(),
+            'games': {
+                game.id: {
+                    'moves': len(game.moves),
+                    'status': game.status,
+                    'move_latency': game.move_latency.summary(),
+                    'engine_latency': game.engine_latency.summary()
+                }
+                for game in self.games.values()
+            }
+        }
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None,
+                processes=None, depth=DEFAULT_DEPTH,
+                move_time=DEFAULT_MOVE_TIME):
+    """
+    Runs the server until cancelled.
+    :param host: The host to listen on.
+    :param port: The TCP port to listen on.
+    :param unix_path: The path of a Unix socket to listen on instead of TCP,
+    or None.
+    :param processes: The number of engine processes, or None for one per
+    core.
+    :param depth: The deepest iteration of an engine search.
+    :param move_time: The time limit of an engine search in seconds.
+    :return: Nothing.
+    """
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        server = GameServer(executor, depth, move_time)
+        if unix_path is not None:
+            listener = await asyncio.start_unix_server(server.handle_client,
+                                                       unix_path)
+        else:
+            listener = await asyncio.start_server(server.handle_client, host,
+                                                  port)
+        async with listener:
+            await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hosts chess games over a "
+                                                 "socket")
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help="The host to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="The TCP port to listen on.")
+    parser.add_argument("--unix", default=None,
+                        help="The path of a Unix socket to listen on instead "
+                             "of TCP.")
+    parser.add_argument("--processes", type=error.positive_int, default=None,
+                        help="The number of engine processes.")
+    parser.add_argument("--depth", type=error.positive_int,
+                        default=DEFAULT_DEPTH,
+                        help="The deepest iteration of an engine search.")
+    parser.add_argument("--move-time", type=error.time_value,
+                        default=DEFAULT_MOVE_TIME,
+                        help="The time limit of an engine search in seconds.")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.processes,
+                          args.depth, args.move_time))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Lazy SMP parallel search. Several worker processes search the same root
+position with iterative deepening, the odd numbered workers one ply ahead of
+the even numbered ones, and share their results through a transposition table
+in shared memory. The main process keeps the best result of the deepest
+completed iteration reported by any worker.
+"""
+
+import multiprocessing
+import os
+import queue
+from multiprocessing import shared_memory
+
+import ai
+import board
+import clock
+import tablebase
+import tt
+
+# Seconds between checks of the time limits while waiting for results
+POLL_INTERVAL = 0.01
+
+
+def search_worker(fen_string, shm_name, entries, worker, max_depth,
+                  stop_event, results, tablebase_path=None, chess960=False):
+    """
+    Searches a position in a worker process, reporting every completed
+    iteration. Always finishes by reporting a depth of None along with the
+    number of nodes it searched, even if the search fails.
+    :param fen_string: The FEN string of the position to search.
+    :param shm_name: The name of the shared memory holding the table.
+    :param entries: The number of entries in the table.
+    :param worker: The number of the worker.
+    :param max_depth: The deepest iteration to search.
+    :param stop_event: The multiprocessing.Event that stops the search.
+    :param results: The multiprocessing.Queue to report the results to.
+    :param tablebase_path: The directory of the tablebases to probe, or None.
+    :param chess960: True if the position is from a game of Chess960.
+    :return: Nothing.
+    """
+    nodes = 0
+    tablebases = None
+    shm = None
+    try:
+        if tablebase_path is not None:
+            tablebases = tablebase.Tablebases(tablebase_path)
+        shm = shared_memory.SharedMemory(name=shm_name)
+        table = tt.TranspositionTable(entries, shm.buf)
+        game = board.Position(fen_string, 'c', 'c', chess960)
+        search = ai.Search(clock.SearchLimits(stop_event=stop_event), table,
+                           tablebases)
+
+        def report(depth, score, move):
+            results.put((worker, depth, score, move, search.nodes))
+
+        search.iterate(game, max_depth, 1 + worker % 2, report)
+        nodes = search.nodes
+        table.buffer = None
+    finally:
+        if shm is not None:
+            shm.close()
+        if tablebases is not None:
+            tablebases.close()
+        results.put((worker, None, None, None, nodes))
+
+
+def parallel_search(game, limits=None, max_depth=ai.MAX_DEPTH, workers=None,
+                    entries=tt.DEFAULT_ENTRIES, tablebase_path=None):
+    """
+    Finds the best move in the position using several processes.
+    :param game: The position to search.
+    :param limits: The clock.SearchLimits of the search, or None to search
+    without a time limit.
+    :param max_depth: The deepest iteration to search.
+    :param workers: The number of worker processes, or None for one per core.
+    :param entries: The number of entries in the shared transposition table.
+    :param tablebase_path: The directory of the tablebases to probe, or None.
+    Each worker maps the tables itself, sharing them through the page cache.
+    :return: A tuple (move, score, depth, nodes) of the best move, its score
+    from the point of view of the player to move, the depth it was searched to
+    and the total number of nodes searched. The move is None if there are no
+    legal moves.
+    """
+    legal_moves = game.get_legal_moves()
+    if not legal_moves:
+        return None, 0, 0, 0
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=entries * tt.ENTRY_SIZE)
+    stop_event = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=search_worker,
+                                args=(game.current_fen, shm.name, entries,
+                                      worker, max_depth, stop_event, results,
+                                      tablebase_path, game.chess960))
+        for worker in range(workers)
+    ]
+
+    # The deepest completed iteration as (depth, score, move)
+    best = None
+    finished = set()
+    nodes = 0
+    try:
+        for process in processes:
+            process.start()
+
+        while len(finished) < workers:
+            report = receive(results, processes, finished)
+            if report is not None:
+                worker, depth, score, move, count = report
+                if depth is None:
+                    nodes += count
+                elif best is None or depth > best[0]:
+                    best = (depth, score, move)
+
+            # Stop once out of time or a forced mate or a tablebase win has
+            # been found
+            if limits is not None and (limits.hard_stop() or (
+                    best is not None and limits.soft_stop())):
+                break
+            if best is not None and ai.is_decided(best[1]):
+                break
+    finally:
+        stop_event.set()
+
+        # Drain the queue so that the workers can exit
+        while len(finished) < workers:
+            report = receive(results, processes, finished)
+            if report is not None and report[1] is None:
+                nodes += report[4]
+        for process in processes:
+            if process.pid is not None:
+                process.join()
+        shm.close()
+        shm.unlink()
+
+    if best is None:
+        return legal_moves[0], 0, 0, nodes
+    depth, score, move = best
+    return move, score, depth, nodes
+
+
+def receive(results, processes, finished):
+    """
+    Waits briefly for the next report of a worker. A worker that has died
+    without reporting that it finished is counted as finished once the queue
+    holds nothing more from it, so that a crashed worker cannot leave the
+    main process waiting forever.
+    :param results: The multiprocessing.Queue the workers report to.
+    :param processes: The list of worker processes, indexed by worker.
+    :param finished: The set of the workers that have finished, updated in
+    place.
+    :return: The report (worker, depth, score, move, nodes), or None if there
+    was none. A report of a depth of None is only returned the first time the
+    worker is counted as finished.
+    """
+    # A worker that has exited has flushed its reports to the queue, so if the
+    # queue is empty afterwards it has nothing left to report
+    dead = [worker for worker, process in enumerate(processes)
+            if not process.is_alive()]
+    try:
+        report = results.get(timeout=POLL_INTERVAL)
+    except queue.Empty:
+        finished.update(dead)
+        return None
+
+    worker, depth = report[:2]
+    if depth is None:
+        if worker in finished:
+            return None
+        finished.add(worker)
+    return report
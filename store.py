@@ -0,0 +1,172 @@
+"""
+Persistent storage of finished games in SQLite. Games are buffered and
+inserted in batches, one transaction per batch, together with the hash of
+every position reached so that games can be found by position.
+
+A store assumes it is the only writer of its database while open.
+"""
+
+import json
+import sqlite3
+
+import pgn
+
+DEFAULT_BATCH_SIZE = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    tags TEXT NOT NULL,
+    result INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    moves TEXT NOT NULL,
+    final_fen TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS positions (
+    hash INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    ply INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_result ON games (result);
+CREATE INDEX IF NOT EXISTS games_length ON games (length);
+CREATE INDEX IF NOT EXISTS positions_hash ON positions (hash);
+'''
+
+
+def to_signed(position_hash):
+    """
+    Converts a 64 bit hash to the signed range of an SQLite integer.
+    :param position_hash: The unsigned hash.
+    :return: The signed hash.
+    """
+    if position_hash >= 1 << 63:
+        return position_hash - (1 << 64)
+    return position_hash
+
+
+class GameStore:
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Opens a store, creating the database if needed.
+        :param path: The path of the SQLite database.
+        :param batch_size: The number of games buffered before they are
+        written.
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.batch_size = batch_size
+        self.games = []
+        self.positions = []
+        self.next_id = self.connection.execute(
+            'SELECT COALESCE(MAX(id), 0) + 1 FROM games').fetchone()[0]
+
+    def add_game(self, tags, result, moves, final_fen, hashes):
+        """
+        Adds a finished game to the store. The game is written once the batch
+        is full or the store is flushed.
+        :param tags: A dictionary of the tag pairs of the game.
+        :param result: The exit status of the game as defined in error.py.
+        :param moves: A list of the moves in standard algebraic notation.
+        :param final_fen: The FEN string of the final position.
+        :param hashes: The hashes of the positions of the game, starting with
+        the starting position.
+        :return: The id of the game.
+        """
+        game_id = self.next_id
+        self.next_id += 1
+        self.games.append((game_id, json.dumps(tags), result, len(moves),
+                           ' '.join(moves), final_fen))
+        self.positions.extend((to_signed(position_hash), game_id, ply)
+                              for ply, position_hash in enumerate(hashes))
+        if len(self.games) >= self.batch_size:
+            self.flush()
+        return game_id
+
+    def add_played_game(self, game, result, hashes):
+        """
+        Adds a game that was played to its end from a board.Position.
+        :param game: The final position of the game.
+        :param result: The exit status of the game as defined in error.py.
+        :param hashes: The hashes of the positions of the game, starting with
+        the starting position.
+        :return: The id of the game.
+        """
+        for tags, moves, result_string in pgn.read_games(
+                game.pgn.splitlines()):
+            return self.add_game(tags, result, moves, game.current_fen,
+                                 hashes)
+        return self.add_game({}, result, [], game.current_fen, hashes)
+
+    def flush(self):
+        """
+        Writes the buffered games in a single transaction.
+        :return: Nothing.
+        """
+        if not self.games:
+            return
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO games VALUES (?, ?, ?, ?, ?, ?)', self.games)
+            self.connection.executemany(
+                'INSERT INTO positions VALUES (?, ?, ?)', self.positions)
+        self.games = []
+        self.positions = []
+
+    def close(self):
+        """
+        Writes the buffered games and closes the store.
+        :return: Nothing.
+        """
+        self.flush()
+        self.connection.close()
+
+    def get_game(self, game_id):
+        """
+        Reads a game.
+        :param game_id: The id of the game.
+        :return: A tuple (tags, result, moves, final_fen) of the tag pairs, the
+        exit status, the list of moves and the final FEN string, or None if
+        there is no such game.
+        """
+        self.flush()
+        row = self.connection.execute(
+            'SELECT tags, result, moves, final_fen FROM games WHERE id = ?',
+            (game_id,)).fetchone()
+        if row is None:
+            return None
+        tags, result, moves, final_fen = row
+        return json.loads(tags), result, moves.split(), final_fen
+
+    def find_by_result(self, result):
+        """
+        Finds the games with a result.
+        :param result: The exit status as defined in error.py.
+        :return: A list of the ids of the games.
+        """
+        self.flush()
+        return [row[0] for row in self.connection.execute(
+            'SELECT id FROM games WHERE result = ? ORDER BY id', (result,))]
+
+    def find_by_length(self, minimum, maximum):
+        """
+        Finds the games with a number of plies in a range.
+        :param minimum: The least number of plies.
+        :param maximum: The greatest number of plies.
+        :return: A list of the ids of the games.
+        """
+        self.flush()
+        return [row[0] for row in self.connection.execute(
+            'SELECT id FROM games WHERE length BETWEEN ? AND ? ORDER BY id',
+            (minimum, maximum))]
+
+    def find_by_position(self, position_hash):
+        """
+        Finds the games that reached a position.
+        :param position_hash: The hash of the position.
+        :return: A list of tuples (game id, ply) of every time the position was
+        reached.
+        """
+        self.flush()
+        return [tuple(row) for row in self.connection.execute(
+            'SELECT game_id, ply FROM positions WHERE hash = ? '
+            'ORDER BY game_id, ply', (to_signed(position_hash),))]
@@ -0,0 +1,720 @@
+"""
+Endgame tablebases for positions of up to four pieces, kings included. Tables
+are generated by retrograde analysis and store one byte per position: 0 for a
+draw (or an illegal position) and otherwise the number of plies to mate plus
+one. Wins for the player to move take an odd number of plies, so an even byte
+is a win and an odd byte a loss for the player to move.
+
+Tables are named after their material, white first, e.g. KQvK or KRvKP, and
+only the colouring with the stronger side as white is stored. Castling and en
+passant are not represented in the tables.
+
+Positions are stored once per symmetry class, reflected so that the white king
+stands on files a to d, and in tables without pawns also on ranks 1 to 4. No
+reflection leaves the white king on its square, so every position has exactly
+one stored reflection.
+"""
+
+import argparse
+import mmap
+import os
+from timeit import default_timer as timer
+
+import error
+
+# The results of a probe from the point of view of the player to move
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+MAX_PIECES = 4
+
+# The longest distance to mate in plies a table can hold, as a byte stores the
+# plies plus one and 255 is kept for marking positions during generation
+MAX_PLIES = 254
+
+# The order of the pieces of each colour within a table
+PIECE_ORDER = 'KQRBNP'
+PIECE_VALUES = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+
+PROMOTION_TYPES = 'QRBN'
+
+# Marks an illegal position in the move counts during generation
+ILLEGAL = 255
+
+# Marks a position that can escape into a draw or better by capturing or
+# promoting, so can never be lost
+ESCAPE = 255
+
+FILE_EXTENSION = '.tb'
+
+WHITE = 1
+BLACK = 0
+
+
+def get_square(x, y):
+    """
+    Numbers a square of the board.
+    :param x: The x coordinate of the square.
+    :param y: The y coordinate of the square.
+    :return: The square number y * 8 + x.
+    """
+    return y * 8 + x
+
+
+def get_steps(square, shifts):
+    """
+    Finds the squares one step away from a square.
+    :param square: The square to step from.
+    :param shifts: A list of (x, y) shifts.
+    :return: A list of the squares on the board.
+    """
+    x, y = square % 8, square // 8
+    return [get_square(x + i, y + j) for i, j in shifts
+            if 0 <= x + i <= 7 and 0 <= y + j <= 7]
+
+
+def get_rays(square, directions):
+    """
+    Finds the squares along rays from a square.
+    :param square: The square the rays start from.
+    :param directions: A list of (x, y) directions.
+    :return: A list of rays, each a list of squares from the nearest outwards.
+    """
+    x, y = square % 8, square // 8
+    rays = []
+    for i, j in directions:
+        ray = []
+        k = 1
+        while 0 <= x + i * k <= 7 and 0 <= y + j * k <= 7:
+            ray.append(get_square(x + i * k, y + j * k))
+            k += 1
+        if ray:
+            rays.append(ray)
+    return rays
+
+
+KING_SHIFTS = [(i, j) for i in [-1, 0, 1] for j in [-1, 0, 1] if i or j]
+KNIGHT_SHIFTS = [(i, j) for i in [-2, -1, 1, 2] for j in [-2, -1, 1, 2]
+                 if abs(i) != abs(j)]
+ORTHOGONAL = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+DIAGONAL = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+KING_STEPS = [get_steps(square, KING_SHIFTS) for square in range(64)]
+KNIGHT_STEPS = [get_steps(square, KNIGHT_SHIFTS) for square in range(64)]
+RAYS = {
+    'Q': [get_rays(square, ORTHOGONAL + DIAGONAL) for square in range(64)],
+    'R': [get_rays(square, ORTHOGONAL) for square in range(64)],
+    'B': [get_rays(square, DIAGONAL) for square in range(64)]
+}
+
+# The squares a pawn attacks, indexed by [colour][square]. White pawns move
+# towards y = 0.
+PAWN_ATTACKS = [
+    [get_steps(square, [(-1, 1), (1, 1)]) for square in range(64)],
+    [get_steps(square, [(-1, -1), (1, -1)]) for square in range(64)]
+]
+# The squares the white king is indexed over in tables with and without pawns,
+# and the number of each square within them or -1, indexed by [pawns]
+KING_SQUARES = [
+    [get_square(x, y) for y in range(4, 8) for x in range(4)],
+    [get_square(x, y) for y in range(8) for x in range(4)]
+]
+KING_SLOTS = [[squares.index(square) if square in squares else -1
+               for square in range(64)] for squares in KING_SQUARES]
+
+PAWN_DIRECTION = [8, -8]
+PAWN_START_RANK = [1, 6]
+PAWN_DOUBLE_RANK = [3, 4]
+PROMOTION_RANK = [7, 0]
+
+
+def split_name(name):
+    """
+    Splits a table name into the pieces of each side.
+    :param name: The table name, e.g. KRvKP.
+    :return: A tuple (white, black) of the upper case pieces of each side.
+    """
+    white, black = name.split('v')
+    return white, black
+
+
+def get_name(white, black):
+    """
+    Gets the name of a table, ordering the pieces of each side.
+    :param white: The upper case pieces of white.
+    :param black: The upper case pieces of black.
+    :return: The table name.
+    """
+    white = ''.join(sorted(white, key=PIECE_ORDER.index))
+    black = ''.join(sorted(black, key=PIECE_ORDER.index))
+    return ''.join((white, 'v', black))
+
+
+def get_canonical_name(name):
+    """
+    Gets the name of the stored colouring of a material combination, i.e. the
+    one with the stronger side as white.
+    :param name: A table name.
+    :return: The canonical table name.
+    """
+    white, black = split_name(name)
+    flipped = get_name(black, white)
+
+    def strength(table_name):
+        side, other = split_name(table_name)
+        return (sum(PIECE_VALUES[piece] for piece in side) -
+                sum(PIECE_VALUES[piece] for piece in other), len(side),
+                [-PIECE_ORDER.index(piece) for piece in side])
+
+    return max(get_name(white, black), flipped, key=strength)
+
+
+def get_layout(name):
+    """
+    Gets the piece types and colours of a table in index order.
+    :param name: The table name.
+    :return: A tuple (types, colours) of lists.
+    """
+    white, black = split_name(name)
+    return list(white + black), [WHITE] * len(white) + [BLACK] * len(black)
+
+
+def get_reflection(king, pawns):
+    """
+    Finds the reflection of the board that brings the white king onto the
+    squares the tables are indexed over. The reflections of the files, of the
+    ranks and of both flip the bits 7, 56 and 63 of the square numbers.
+    :param king: The square of the white king.
+    :param pawns: True if the table has pawns, which only allow the files to be
+    reflected.
+    :return: The mask to XOR the squares with.
+    """
+    mask = 0
+    if king % 8 > 3:
+        mask |= 7
+    if not pawns and king // 8 < 4:
+        mask |= 56
+    return mask
+
+
+def get_size(count, pawns):
+    """
+    Gets the number of positions of a table.
+    :param count: The number of pieces in the table.
+    :param pawns: True if the table has pawns.
+    :return: The number of positions.
+    """
+    return 2 * len(KING_SQUARES[pawns]) * 64 ** (count - 1)
+
+
+def get_index(squares, turn, pawns):
+    """
+    Gets the index of a position in its table, reflecting the position first
+    if the white king is not on the indexed squares.
+    :param squares: The squares of the pieces in table order, the white king
+    first.
+    :param turn: The player to move.
+    :param pawns: True if the table has pawns.
+    :return: The index.
+    """
+    mask = get_reflection(squares[0], pawns)
+    index = turn * len(KING_SQUARES[pawns]) + \
+        KING_SLOTS[pawns][squares[0] ^ mask]
+    for square in squares[1:]:
+        index = index * 64 + (square ^ mask)
+    return index
+
+
+def get_squares(index, count, pawns):
+    """
+    Gets the position at an index of a table.
+    :param index: The index.
+    :param count: The number of pieces in the table.
+    :param pawns: True if the table has pawns.
+    :return: A tuple (squares, turn) of the squares of the pieces in table
+    order and the player to move.
+    """
+    squares = [0] * count
+    for i in range(count - 1, 0, -1):
+        squares[i] = index % 64
+        index //= 64
+    kings = len(KING_SQUARES[pawns])
+    squares[0] = KING_SQUARES[pawns][index % kings]
+    return squares, index // kings
+
+
+def is_attacked(square, colour, types, colours, squares, captured=-1):
+    """
+    Checks if a square is attacked by the pieces of a colour.
+    :param square: The square to check.
+    :param colour: The colour of the attacking pieces.
+    :param types: The piece types in table order.
+    :param colours: The piece colours in table order.
+    :param squares: The piece squares in table order.
+    :param captured: The index of a piece that has been captured, or -1.
+    :return: True if the square is attacked, false otherwise.
+    """
+    occupied = [squares[i] for i in range(len(squares)) if i != captured]
+    for i in range(len(types)):
+        if colours[i] != colour or i == captured:
+            continue
+        piece = types[i]
+        origin = squares[i]
+        if piece == 'K':
+            if square in KING_STEPS[origin]:
+                return True
+        elif piece == 'N':
+            if square in KNIGHT_STEPS[origin]:
+                return True
+        elif piece == 'P':
+            if square in PAWN_ATTACKS[colour][origin]:
+                return True
+        else:
+            for ray in RAYS[piece][origin]:
+                if square not in ray:
+                    continue
+                for target in ray:
+                    if target == square:
+                        return True
+                    if target in occupied:
+                        break
+                break
+    return False
+
+
+def in_check(colour, types, colours, squares, captured=-1):
+    """
+    Checks if the king of a colour is attacked.
+    :param colour: The colour of the king.
+    :param types: The piece types in table order.
+    :param colours: The piece colours in table order.
+    :param squares: The piece squares in table order.
+    :param captured: The index of a piece that has been captured, or -1.
+    :return: True if the king is in check, false otherwise.
+    """
+    king = colours.index(colour)
+    return is_attacked(squares[king], 1 - colour, types, colours, squares,
+                       captured)
+
+
+def is_legal(types, colours, squares, turn):
+    """
+    Checks that a position can occur: the pieces are on different squares, no
+    pawn is on the first or last rank and the player not to move is not in
+    check.
+    :param types: The piece types in table order.
+    :param colours: The piece colours in table order.
+    :param squares: The piece squares in table order.
+    :param turn: The player to move.
+    :return: True if the position is legal, false otherwise.
+    """
+    if len(set(squares)) != len(squares):
+        return False
+    for i in range(len(types)):
+        if types[i] == 'P' and squares[i] // 8 in (0, 7):
+            return False
+    return not in_check(1 - turn, types, colours, squares)
+
+
+def get_targets(i, types, colours, squares):
+    """
+    Finds the squares a piece can move to, ignoring checks. Pawn promotions are
+    included as moves to the last rank.
+    :param i: The index of the piece.
+    :param types: The piece types in table order.
+    :param colours: The piece colours in table order.
+    :param squares: The piece squares in table order.
+    :return: A list of tuples (square, captured) of the target squares and the
+    index of the captured piece, or -1.
+    """
+    piece = types[i]
+    colour = colours[i]
+    origin = squares[i]
+    targets = []
+
+    def occupant(square):
+        if square in squares:
+            return squares.index(square)
+        return -1
+
+    if piece == 'P':
+        ahead = origin + PAWN_DIRECTION[colour]
+        if occupant(ahead) == -1:
+            targets.append((ahead, -1))
+            double = ahead + PAWN_DIRECTION[colour]
+            if origin // 8 == PAWN_START_RANK[colour] and \
+                    occupant(double) == -1:
+                targets.append((double, -1))
+        for square in PAWN_ATTACKS[colour][origin]:
+            j = occupant(square)
+            if j != -1 and colours[j] != colour:
+                targets.append((square, j))
+    elif piece == 'K' or piece == 'N':
+        if piece == 'K':
+            steps = KING_STEPS[origin]
+        else:
+            steps = KNIGHT_STEPS[origin]
+        for square in steps:
+            j = occupant(square)
+            if j == -1 or colours[j] != colour:
+                targets.append((square, j))
+    else:
+        for ray in RAYS[piece][origin]:
+            for square in ray:
+                j = occupant(square)
+                if j == -1:
+                    targets.append((square, -1))
+                else:
+                    if colours[j] != colour:
+                        targets.append((square, j))
+                    break
+
+    return [(square, j) for square, j in targets
+            if j == -1 or types[j] != 'K']
+
+
+def get_origins(i, types, colours, squares):
+    """
+    Finds the squares a piece could have moved from without capturing or
+    promoting, i.e. the un-moves of the piece.
+    :param i: The index of the piece.
+    :param types: The piece types in table order.
+    :param colours: The piece colours in table order.
+    :param squares: The piece squares in table order.
+    :return: A list of the origin squares.
+    """
+    piece = types[i]
+    colour = colours[i]
+    square = squares[i]
+
+    if piece == 'P':
+        origins = []
+        behind = square - PAWN_DIRECTION[colour]
+        if behind // 8 == PROMOTION_RANK[1 - colour] or behind in squares:
+            return origins
+        origins.append(behind)
+        double = behind - PAWN_DIRECTION[colour]
+        if square // 8 == PAWN_DOUBLE_RANK[colour] and double not in squares:
+            origins.append(double)
+        return origins
+    if piece == 'K':
+        return [origin for origin in KING_STEPS[square]
+                if origin not in squares]
+    if piece == 'N':
+        return [origin for origin in KNIGHT_STEPS[square]
+                if origin not in squares]
+
+    origins = []
+    for ray in RAYS[piece][square]:
+        for origin in ray:
+            if origin in squares:
+                break
+            origins.append(origin)
+    return origins
+
+
+class Generator:
+    def __init__(self, directory):
+        """
+        Initialise the generator.
+        :param directory: The directory the tables are written to and the
+        tables they depend on are read from.
+        """
+        self.directory = directory
+        self.tables = {}
+
+    def load(self, name):
+        """
+        Loads a table, generating it first if it does not exist yet.
+        :param name: The canonical table name.
+        :return: The table as bytes.
+        """
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + FILE_EXTENSION)
+            if not os.path.exists(path):
+                self.generate(name)
+            with open(path, 'rb') as table_file:
+                self.tables[name] = table_file.read()
+        return self.tables[name]
+
+    def lookup(self, types, colours, squares, turn):
+        """
+        Looks up a position of another table.
+        :param types: The piece types.
+        :param colours: The piece colours.
+        :param squares: The piece squares.
+        :param turn: The player to move.
+        :return: The stored byte of the position.
+        """
+        if len(types) == 2:
+            return 0
+        name = get_name(
+            [types[i] for i in range(len(types)) if colours[i] == WHITE],
+            [types[i] for i in range(len(types)) if colours[i] == BLACK])
+        canonical = get_canonical_name(name)
+        pieces = list(zip(colours, types, squares))
+        if canonical != name:
+            pieces = [(1 - colour, piece, square ^ 56)
+                      for colour, piece, square in pieces]
+            turn = 1 - turn
+        pieces.sort(key=lambda item: (-item[0], PIECE_ORDER.index(item[1])))
+        return self.load(canonical)[get_index([item[2] for item in pieces],
+                                              turn, 'P' in types)]
+
+    def generate(self, name):
+        """
+        Generates a table and writes it to the directory.
+        :param name: The table name.
+        :return: Nothing.
+        """
+        name = get_canonical_name(name)
+        types, colours = get_layout(name)
+        count = len(types)
+        pawns = 'P' in types
+        size = get_size(count, pawns)
+
+        values = bytearray(size)
+        moves_left = bytearray(size)
+        loss_floor = bytearray(size)
+
+        # Find the mates and the results of the captures and promotions
+        for index in range(size):
+            squares, turn = get_squares(index, count, pawns)
+            if not is_legal(types, colours, squares, turn):
+                moves_left[index] = ILLEGAL
+                continue
+
+            quiet = 0
+            win = 0
+            floor = 0
+            escape = False
+            for i in range(count):
+                if colours[i] != turn:
+                    continue
+                for square, captured in get_targets(i, types, colours,
+                                                    squares):
+                    moved = squares[:]
+                    moved[i] = square
+                    if in_check(turn, types, colours, moved, captured):
+                        continue
+
+                    promoted = types[i] == 'P' and \
+                        square // 8 == PROMOTION_RANK[turn]
+                    if captured == -1 and not promoted:
+                        quiet += 1
+                        continue
+
+                    # The move leaves the table
+                    if promoted:
+                        choices = PROMOTION_TYPES
+                    else:
+                        choices = [types[i]]
+                    for choice in choices:
+                        child_types = types[:]
+                        child_types[i] = choice
+                        keep = [j for j in range(count) if j != captured]
+                        value = self.lookup(
+                            [child_types[j] for j in keep],
+                            [colours[j] for j in keep],
+                            [moved[j] for j in keep], 1 - turn)
+                        if value == 0:
+                            escape = True
+                        elif value % 2 == 1:
+                            if win == 0 or value < win:
+                                win = value
+                        else:
+                            floor = max(floor, value)
+
+            moves_left[index] = quiet
+            if escape:
+                loss_floor[index] = ESCAPE
+            else:
+                loss_floor[index] = floor
+            if win:
+                values[index] = win + 1
+            elif quiet == 0 and floor and not escape:
+                values[index] = floor + 1
+            elif quiet == 0 and not escape and \
+                    in_check(turn, types, colours, squares):
+                values[index] = 1
+
+        # Work backwards from the decided positions one ply at a time
+        for plies in range(MAX_PLIES):
+            value = bytes([plies + 1])
+            index = values.find(value)
+            while index != -1:
+                self.retract(index, plies, types, colours, values, moves_left,
+                             loss_floor)
+                index = values.find(value, index + 1)
+
+        path = os.path.join(self.directory, name + FILE_EXTENSION)
+        with open(path, 'wb') as table_file:
+            table_file.write(values)
+        self.tables[name] = bytes(values)
+
+    def retract(self, index, plies, types, colours, values, moves_left,
+                loss_floor):
+        """
+        Updates the positions that lead to a decided position.
+        :param index: The index of the decided position.
+        :param plies: The number of plies to mate of the decided position.
+        :param types: The piece types in table order.
+        :param colours: The piece colours in table order.
+        :param values: The values of the table.
+        :param moves_left: The number of undecided quiet moves of each
+        position.
+        :param loss_floor: The longest loss by capturing or promoting of each
+        position.
+        :return: Nothing.
+        """
+        count = len(types)
+        pawns = 'P' in types
+        squares, turn = get_squares(index, count, pawns)
+        mover = 1 - turn
+
+        for i in range(count):
+            if colours[i] != mover:
+                continue
+            for origin in get_origins(i, types, colours, squares):
+                previous = squares[:]
+                previous[i] = origin
+                if in_check(turn, types, colours, previous):
+                    continue
+                previous_index = get_index(previous, mover, pawns)
+                if moves_left[previous_index] == ILLEGAL:
+                    continue
+
+                if plies % 2 == 0:
+                    # The mover wins by moving into the lost position
+                    current = values[previous_index]
+                    if current == 0 or current > plies + 2:
+                        values[previous_index] = plies + 2
+                elif values[previous_index] == 0:
+                    # The mover loses once every move leads to a win for the
+                    # opponent
+                    moves_left[previous_index] -= 1
+                    floor = loss_floor[previous_index]
+                    if moves_left[previous_index] == 0 and floor != ESCAPE:
+                        values[previous_index] = max(plies + 1, floor) + 1
+
+
+class Tablebases:
+    def __init__(self, directory):
+        """
+        Opens the tables of a directory for probing. Tables are memory mapped
+        when they are first needed.
+        :param directory: The directory containing the tables.
+        """
+        self.directory = directory
+        self.tables = {}
+
+    def close(self):
+        """
+        Closes the open tables.
+        :return: Nothing.
+        """
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    def get_table(self, name):
+        """
+        Gets a memory mapped table.
+        :param name: The canonical table name.
+        :return: The mmap of the table, or None if the table does not exist.
+        """
+        if name not in self.tables:
+            path = os.path.join(self.directory, name + FILE_EXTENSION)
+            table = None
+            if os.path.exists(path):
+                with open(path, 'rb') as table_file:
+                    table = mmap.mmap(table_file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            self.tables[name] = table
+        return self.tables[name]
+
+    def probe(self, game):
+        """
+        Looks up the result of a position.
+        :param game: The position to look up.
+        :return: A tuple (result, plies) of WIN, DRAW or LOSS for the player to
+        move and the number of plies to mate, or None if the position is not
+        covered by the available tables.
+        """
+        if game.en_passant is not None or any(game.castling):
+            return None
+
+        # Find the pieces of the position
+        pieces = []
+        y = 0
+        for rank in game.pos:
+            x = 0
+            for item in rank:
+                if item != ' ':
+                    pieces.append((int(item.isupper()), item.upper(),
+                                   get_square(x, y)))
+                    if len(pieces) > MAX_PIECES:
+                        return None
+                x += 1
+            y += 1
+
+        if len(pieces) == 2:
+            return DRAW, 0
+
+        turn = game.turn
+        name = get_name([piece for colour, piece, square in pieces
+                         if colour == WHITE],
+                        [piece for colour, piece, square in pieces
+                         if colour == BLACK])
+        canonical = get_canonical_name(name)
+        if canonical != name:
+            pieces = [(1 - colour, piece, square ^ 56)
+                      for colour, piece, square in pieces]
+            turn = 1 - turn
+
+        table = self.get_table(canonical)
+        if table is None:
+            return None
+        pieces.sort(key=lambda item: (-item[0], PIECE_ORDER.index(item[1])))
+        value = table[get_index([square for colour, piece, square in pieces],
+                                turn, 'P' in canonical)]
+
+        if value == 0:
+            return DRAW, 0
+        if value % 2 == 0:
+            return WIN, value - 1
+        return LOSS, value - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates endgame "
+                                                 "tablebases")
+    parser.add_argument("directory", help="The directory to write the tables "
+                                          "to.")
+    parser.add_argument("tables", nargs="+",
+                        help="The tables to generate, e.g. KQvK KRvK KPvK.")
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    generator = Generator(args.directory)
+    for name in args.tables:
+        name = name.upper().replace('V', 'v')
+        if name.count('v') != 1:
+            print("Invalid table: ", name)
+            error.exit_game(error.INCORRECT_ARGS)
+        white, black = split_name(name)
+        if white[:1] != 'K' or black[:1] != 'K' or \
+                len(white) + len(black) > MAX_PIECES or \
+                any(piece not in PIECE_ORDER for piece in white + black):
+            print("Invalid table: ", name)
+            error.exit_game(error.INCORRECT_ARGS)
+
+        begin = timer()
+        generator.generate(name)
+        print(get_canonical_name(name), timer() - begin)
+
+
+if __name__ == "__main__":
+    main()
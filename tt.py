@@ -0,0 +1,95 @@
+"""
+Transposition table for the search. The entries live in a flat buffer so that
+the table can be placed in shared memory and used by several processes at
+once. Entries are written without locks: the stored key is xored with the
+entry data, so an entry torn by two processes writing at the same time fails
+the key check and is treated as a miss.
+"""
+
+import struct
+
+import board
+
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# Default number of entries in a table
+DEFAULT_ENTRIES = 1 << 16
+
+# Each entry holds the checked key followed by the data. The data holds the
+# score in hundredths of a pawn, the depth, the bound type and the best move.
+ENTRY = struct.Struct('<QQ')
+DATA = struct.Struct('<iBBH')
+ENTRY_SIZE = ENTRY.size
+
+# Scores are stored as integers with this many steps per pawn
+SCORE_SCALE = 100
+
+
+class TranspositionTable:
+    def __init__(self, entries=DEFAULT_ENTRIES, buffer=None):
+        """
+        Initialise the table.
+        :param entries: The number of entries in the table.
+        :param buffer: A writable buffer of at least entries * ENTRY_SIZE bytes
+        to hold the table, for example the buf of a SharedMemory. A new buffer
+        is allocated if None.
+        """
+        if buffer is None:
+            buffer = bytearray(entries * ENTRY_SIZE)
+        self.entries = entries
+        self.buffer = buffer
+        self.hits = 0
+        self.probes = 0
+
+    def probe(self, key):
+        """
+        Looks up a position in the table.
+        :param key: The hash of the position.
+        :return: A tuple (score, depth, bound, move) of the stored entry, where
+        move is None if no best move was stored, or None if the position is not
+        in the table.
+        """
+        self.probes += 1
+        checked_key, data = ENTRY.unpack_from(self.buffer,
+                                              (key % self.entries) *
+                                              ENTRY_SIZE)
+        if checked_key ^ data != key or data == 0:
+            return None
+        self.hits += 1
+
+        score, depth, bound, move = DATA.unpack(data.to_bytes(8, 'little'))
+        if move:
+            move = board.decode_move(move)
+        else:
+            move = None
+        return score / SCORE_SCALE, depth, bound, move
+
+    def store(self, key, score, depth, bound, move):
+        """
+        Stores a search result in the table, always replacing the existing
+        entry.
+        :param key: The hash of the position.
+        :param score: The score of the position.
+        :param depth: The depth the position was searched to.
+        :param bound: One of EXACT, LOWER_BOUND or UPPER_BOUND.
+        :param move: The best move found, or None.
+        :return: Nothing.
+        """
+        if move is not None:
+            move = board.encode_move(move)
+        else:
+            move = 0
+        data = int.from_bytes(DATA.pack(round(score * SCORE_SCALE),
+                                        min(depth, 255), bound, move),
+                              'little')
+        ENTRY.pack_into(self.buffer, (key % self.entries) * ENTRY_SIZE,
+                        key ^ data, data)
+
+    def clear(self):
+        """
+        Removes all the entries from the table.
+        :return: Nothing.
+        """
+        self.buffer[:] = bytes(len(self.buffer))
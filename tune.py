@@ -0,0 +1,216 @@
+"""
+Texel tuning of the piece values of ai.evaluate_pos. Each labelled position is
+reduced to a row of the material balance of each piece type, so the
+evaluation of the whole set is a single matrix product and the loss and its
+gradient are computed without a Python loop over the positions.
+
+The loss is the mean squared error between the game results, scored 1, 0.5
+and 0 from white's point of view, and the evaluations mapped to an expected
+score by sigmoid(e) = 1 / (1 + 10 ** (-k * e / 4)). The scaling constant k is
+fitted to the starting values first and then held fixed while the values are
+tuned by gradient descent.
+"""
+
+import argparse
+import json
+
+import numpy
+
+import ai
+import error
+import packed
+import selfplay
+
+# The piece types in the order of the feature columns
+FEATURES = ['P', 'N', 'B', 'R', 'Q']
+
+DEFAULT_ITERATIONS = 1000
+DEFAULT_RATE = 10.0
+
+# The values of k tried when fitting the scaling constant
+K_VALUES = numpy.linspace(0.05, 3, 60)
+
+
+def get_features(game):
+    """
+    Gets the material balance of a position.
+    :param game: The board.Position.
+    :return: A list of the number of white minus black pieces of each type in
+    FEATURES.
+    """
+    features = [0] * len(FEATURES)
+    for rank in game.pos:
+        for item in rank:
+            if item in FEATURES:
+                features[FEATURES.index(item)] += 1
+            elif item.upper() in FEATURES:
+                features[FEATURES.index(item.upper())] -= 1
+    return features
+
+
+def load_bin(path):
+    """
+    Loads the labelled positions of a binary shard written by selfplay.py.
+    :param path: The path of the shard.
+    :return: A tuple (features, results) of the feature matrix and the vector
+    of results scored 1, 0.5 and 0.
+    """
+    features = []
+    results = []
+    with open(path, 'rb') as shard:
+        for game, score, result in selfplay.read_samples(shard):
+            features.append(get_features(game))
+            results.append((result + 1) / 2)
+    return (numpy.array(features, dtype=numpy.float64).reshape(-1,
+                                                               len(FEATURES)),
+            numpy.array(results, dtype=numpy.float64))
+
+
+def load_npy(path):
+    """
+    Loads the labelled positions of a NumPy shard written by selfplay.py.
+    :param path: The path of the shard.
+    :return: A tuple (features, results) of the feature matrix and the vector
+    of results scored 1, 0.5 and 0.
+    """
+    data = numpy.load(path)
+    counts = data['planes'].sum(axis=(2, 3), dtype=numpy.int64)
+    white = [packed.PIECE_CODES[piece] - 1 for piece in FEATURES]
+    black = [packed.PIECE_CODES[piece.lower()] - 1 for piece in FEATURES]
+    features = (counts[:, white] - counts[:, black]).astype(numpy.float64)
+    return features, (data['result'].astype(numpy.float64) + 1) / 2
+
+
+def load(paths):
+    """
+    Loads the labelled positions of self-play shards.
+    :param paths: The paths of the shards, either .bin or .npy files.
+    :return: A tuple (features, results) of the feature matrix and the vector
+    of results scored 1, 0.5 and 0.
+    """
+    features = []
+    results = []
+    for path in paths:
+        if path.endswith('.npy'):
+            shard_features, shard_results = load_npy(path)
+        else:
+            shard_features, shard_results = load_bin(path)
+        features.append(shard_features)
+        results.append(shard_results)
+    return numpy.concatenate(features), numpy.concatenate(results)
+
+
+def sigmoid(evaluations, k):
+    """
+    Maps evaluations to expected scores.
+    :param evaluations: The evaluations in pawns from white's point of view.
+    :param k: The scaling constant.
+    :return: The expected scores between 0 and 1.
+    """
+    return 1 / (1 + numpy.power(10, -k * evaluations / 4))
+
+
+def get_loss(weights, features, results, k):
+    """
+    Calculates the mean squared error of the expected scores.
+    :param weights: The vector of piece values.
+    :param features: The feature matrix.
+    :param results: The vector of results.
+    :param k: The scaling constant.
+    :return: The loss.
+    """
+    return numpy.mean((sigmoid(features @ weights, k) - results) ** 2)
+
+
+def get_gradient(weights, features, results, k):
+    """
+    Calculates the gradient of the loss with respect to the piece values.
+    :param weights: The vector of piece values.
+    :param features: The feature matrix.
+    :param results: The vector of results.
+    :param k: The scaling constant.
+    :return: The gradient vector.
+    """
+    expected = sigmoid(features @ weights, k)
+    errors = (expected - results) * expected * (1 - expected)
+    return 2 * k * numpy.log(10) / 4 * (features.T @ errors) / len(results)
+
+
+def fit_k(weights, features, results):
+    """
+    Finds the scaling constant that best fits the results with the given piece
+    values.
+    :param weights: The vector of piece values.
+    :param features: The feature matrix.
+    :param results: The vector of results.
+    :return: The scaling constant.
+    """
+    losses = [get_loss(weights, features, results, k) for k in K_VALUES]
+    return float(K_VALUES[int(numpy.argmin(losses))])
+
+
+def tune(features, results, weights=None, iterations=DEFAULT_ITERATIONS,
+         rate=DEFAULT_RATE):
+    """
+    Tunes the piece values by gradient descent.
+    :param features: The feature matrix.
+    :param results: The vector of results.
+    :param weights: The starting piece values in the order of FEATURES, or
+    None for the current values of ai.PIECE_VALUES.
+    :param iterations: The number of gradient steps.
+    :param rate: The learning rate.
+    :return: A tuple (weights, k, loss) of the tuned piece values, the scaling
+    constant and the final loss.
+    """
+    if weights is None:
+        weights = [ai.PIECE_VALUES[piece] for piece in FEATURES]
+    weights = numpy.array(weights, dtype=numpy.float64)
+    k = fit_k(weights, features, results)
+    for i in range(iterations):
+        weights -= rate * get_gradient(weights, features, results, k)
+    return weights, k, get_loss(weights, features, results, k)
+
+
+def export(weights, path):
+    """
+    Writes tuned piece values in the format read by ai.load_weights.
+    :param weights: The vector of piece values in the order of FEATURES.
+    :param path: The path of the JSON file to write.
+    :return: Nothing.
+    """
+    with open(path, 'w') as weights_file:
+        json.dump({piece: round(float(value), 3)
+                   for piece, value in zip(FEATURES, weights)},
+                  weights_file, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tunes the piece values on "
+                                                 "self-play data")
+    parser.add_argument("weights", help="The JSON file to write the tuned "
+                                        "piece values to.")
+    parser.add_argument("shards", nargs='+',
+                        help="The shards written by selfplay.py.")
+    parser.add_argument("--iterations", type=error.positive_int,
+                        default=DEFAULT_ITERATIONS,
+                        help="The number of gradient steps.")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="The learning rate.")
+    args = parser.parse_args()
+
+    features, results = load(args.shards)
+    start = [ai.PIECE_VALUES[piece] for piece in FEATURES]
+    weights, k, loss = tune(features, results, start, args.iterations,
+                            args.rate)
+    export(weights, args.weights)
+
+    print("Positions: ", len(results))
+    print("K: ", k)
+    print("Loss: ", get_loss(numpy.array(start, dtype=numpy.float64),
+                             features, results, k), "->", loss)
+    for piece, value in zip(FEATURES, weights):
+        print(piece, round(float(value), 3))
+
+
+if __name__ == "__main__":
+    main()
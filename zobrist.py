@@ -0,0 +1,85 @@
+"""
+Zobrist hashing of board positions. The keys are generated from a fixed seed
+so that hashes agree between processes and between runs, which lets hashes be
+shared through memory and stored on disk.
+"""
+
+import random
+
+SEED = 20181101
+
+# The characters of the pieces in the order of their keys
+PIECE_CHARS = 'KQRBNPkqrbnp'
+
+_generator = random.Random(SEED)
+
+# One key for each piece on each square, indexed by [piece][y][x]
+PIECE_KEYS = {
+    piece: [[_generator.getrandbits(64) for x in range(8)] for y in range(8)]
+    for piece in PIECE_CHARS
+}
+
+# One key for each of the four castling privileges
+CASTLING_KEYS = [_generator.getrandbits(64) for i in range(4)]
+
+# One key for each file of an en passant square
+EN_PASSANT_KEYS = [_generator.getrandbits(64) for x in range(8)]
+
+# Included when it is white to move
+WHITE_TO_MOVE_KEY = _generator.getrandbits(64)
+
+
+def get_hash(pos, turn, castling, en_passant):
+    """
+    Get the hash of the board position. Positions that are equal by
+    board.Position.__eq__ have equal hashes, i.e. the move counters are
+    ignored.
+    :param pos: The list of lists representing the board state.
+    :param turn: The player whose turn it is.
+    :param castling: The castling privileges.
+    :param en_passant: The en passant square.
+    :return: The 64 bit hash as an int.
+    """
+    key = 0
+
+    y = 0
+    for rank in pos:
+        x = 0
+        for item in rank:
+            if item != ' ':
+                key ^= PIECE_KEYS[item][y][x]
+            x += 1
+        y += 1
+
+    if turn:
+        key ^= WHITE_TO_MOVE_KEY
+
+    i = 0
+    for value in castling:
+        if value:
+            key ^= CASTLING_KEYS[i]
+        i += 1
+
+    if en_passant is not None:
+        key ^= EN_PASSANT_KEYS[en_passant[0]]
+
+    return key
+
+
+def get_pawn_hash(pos):
+    """
+    Get the hash of the pawns of the board position alone, which keys the
+    pawn structure cache of the evaluation.
+    :param pos: The list of lists representing the board state.
+    :return: The 64 bit hash as an int.
+    """
+    key = 0
+    y = 0
+    for rank in pos:
+        x = 0
+        for item in rank:
+            if item == 'P' or item == 'p':
+                key ^= PIECE_KEYS[item][y][x]
+            x += 1
+        y += 1
+    return key